@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the ACL chain of a route with 5 ACL alternatives
+
+The first four ACLs fail, the last one (a decorator ACL, like acl.connected)
+passes. It compares the chain walk of HalfRoute.acl_decorator as it was done
+before (the decorator ACL is called twice, "out" is copied twice, and the
+debug messages are formatted) with the compiled chain (CompiledAcl).
+
+Usage :
+
+    python benchmarks/acl_chain.py [iterations]
+"""
+import asyncio
+import sys
+import timeit
+from types import FunctionType
+
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+from halfapi.half_route import HalfRoute
+from halfapi.lib.domain_middleware import acl_headers
+from halfapi.logging import logger
+
+
+def denied(*args, **kwargs):
+    return False
+
+
+def allowed(fct=None):
+    def caller(req, *args, **kwargs):
+        return True
+    return caller
+
+
+PARAMS = [
+    {'acl': denied, 'args': {'required': ['a']}, 'out': ['id']}
+    for _ in range(4)
+] + [{'acl': allowed, 'args': {'required': ['a']}, 'out': ['id', 'name']}]
+
+
+async def route(req, *args, **kwargs):
+    return None
+
+
+def legacy_decorator(fct, params):
+    """ HalfRoute.acl_decorator as it was before the chain compilation
+    """
+    params_headers = [acl_headers(param) for param in params]
+
+    async def caller(req, *args, **kwargs):
+        for param, headers in zip(params, params_headers):
+            if param.get('acl'):
+                passed = param['acl'](req, *args, **kwargs)
+                if isinstance(passed, FunctionType):
+                    passed = param['acl']()(req, *args, **kwargs)
+
+                if not passed:
+                    logger.debug(
+                        'ACL FAIL for current route (%s - %s)', fct, param.get('acl'))
+                    continue
+
+                logger.debug(
+                    'ACL OK for current route (%s - %s)', fct, param.get('acl'))
+
+                req.scope['acl_pass'] = param['acl'].__name__
+                req.scope['acl_headers'] = headers
+
+                if 'args' in param:
+                    req.scope['args'] = param['args']
+                    logger.debug(
+                        'Args for current route (%s)', param.get('args'))
+
+                if 'out' in param:
+                    req.scope['out'] = param['out']
+
+                if 'out' in param:
+                    req.scope['out'] = param['out'].copy()
+
+                if 'check' in req.query_params:
+                    return PlainTextResponse(param['acl'].__name__)
+
+                logger.debug('acl_decorator %s', param)
+                logger.debug('calling %s:%s %s %s', fct.__module__, fct.__name__, args, kwargs)
+                return await fct(req, *args, **kwargs)
+
+    return caller
+
+
+def make_request():
+    return Request({
+        'type': 'http',
+        'method': 'POST',
+        'path': '/bench',
+        'query_string': b'',
+        'headers': [],
+        'path_params': {}
+    })
+
+
+def main(number=100000):
+    before_caller = legacy_decorator(route, PARAMS)
+    after_caller = HalfRoute.acl_decorator(route, PARAMS)
+
+    async def run(caller):
+        for _ in range(number):
+            await caller(make_request())
+
+    async def baseline():
+        for _ in range(number):
+            make_request()
+
+    def measure(coroutine_fct, *args):
+        return min(timeit.repeat(
+            lambda: asyncio.run(coroutine_fct(*args)), number=1, repeat=5))
+
+    t_baseline = measure(baseline)
+    t_before = measure(run, before_caller)
+    t_after = measure(run, after_caller)
+
+    def per_call(total):
+        return (total - t_baseline) / number * 1e6
+
+    print(f'{number} iterations, 5 ACLs (request creation excluded)')
+    print(f'  before (params walk)   : {per_call(t_before):.2f} µs/request')
+    print(f'  after (compiled chain) : {per_call(t_after):.2f} µs/request')
+    print(f'  speedup                : x{per_call(t_before) / per_call(t_after):.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
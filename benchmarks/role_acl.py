@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of a route protected by a long list of role ACLs
+
+The route has 10 ACL alternatives, that check a role of the token payload,
+and only the last one passes. It compares Python functions that look for the
+role in the payload's list with the role ACLs of halfapi.lib.acl, compiled
+into bitmasks.
+
+Usage :
+
+    python benchmarks/role_acl.py [iterations] [acls]
+"""
+import asyncio
+import sys
+import timeit
+
+from starlette.requests import Request
+
+from halfapi.half_route import HalfRoute
+from halfapi.lib import acl
+from halfapi.lib.user import JWTUser
+
+USER = JWTUser('1', '', {
+    'roles': [f'group_{index}' for index in range(20)] + ['role_last']
+})
+
+
+def role_function(role):
+    def fct(req, *args, **kwargs):
+        return role in req.user.payload.get('roles', ())
+    fct.__name__ = role
+    return fct
+
+
+async def route(req, *args, **kwargs):
+    return None
+
+
+def make_request():
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'path': '/bench',
+        'query_string': b'',
+        'headers': [],
+        'path_params': {},
+        'user': USER
+    })
+
+
+def main(number=100000, acls=10):
+    names = [f'role_{index}' for index in range(acls - 1)] + ['role_last']
+    before_caller = HalfRoute.acl_decorator(
+        route, [{'acl': role_function(name)} for name in names])
+    after_caller = HalfRoute.acl_decorator(
+        route, [{'acl': acl.roles(name)} for name in names])
+
+    async def run(caller):
+        for _ in range(number):
+            await caller(make_request())
+
+    async def baseline():
+        for _ in range(number):
+            make_request()
+
+    def measure(coroutine_fct, *args):
+        return min(timeit.repeat(
+            lambda: asyncio.run(coroutine_fct(*args)), number=1, repeat=5))
+
+    t_baseline = measure(baseline)
+    t_before = measure(run, before_caller)
+    t_after = measure(run, after_caller)
+
+    def per_call(total):
+        return (total - t_baseline) / number * 1e6
+
+    print(f'{number} iterations, {acls} ACLs (request creation excluded)')
+    print(f'  before (role in payload list) : {per_call(t_before):.2f} µs/request')
+    print(f'  after (role bitmasks)         : {per_call(t_after):.2f} µs/request')
+    print(f'  speedup                       : x{per_call(t_before) / per_call(t_after):.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
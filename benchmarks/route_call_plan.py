@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the per-request overhead of route_decorator
+
+It compares the arguments assembly of a sync route function when the argument
+specification is introspected on every request (the legacy behaviour) with the
+precompiled halfapi.lib.domain.RouteCallPlan.
+
+Usage :
+
+    python benchmarks/route_call_plan.py [iterations]
+"""
+import sys
+import inspect
+import timeit
+
+from starlette.requests import Request
+
+from halfapi.lib.domain import RouteCallPlan
+
+
+def route(halfapi, data={}, out=None, ret_type='json'):
+    return data
+
+
+def legacy_arguments(fct, request, kwargs):
+    """ Arguments assembly as it was done by route_decorator before RouteCallPlan
+    """
+    fct_args_spec = inspect.getfullargspec(fct).args
+    fct_args_defaults = inspect.getfullargspec(fct).defaults or []
+    fct_args_defaults_dict = dict(list(zip(
+        reversed(fct_args_spec),
+        reversed(fct_args_defaults)
+    )))
+
+    fct_args = request.path_params.copy()
+
+    if 'halfapi' in fct_args_spec:
+        fct_args['halfapi'] = {
+            'user': request.user if
+                'user' in request else None,
+            'config': request.scope.get('config', {}),
+            'domain': request.scope.get('domain', 'unknown'),
+            'cookies': request.cookies,
+            'base_url': request.base_url,
+            'url': request.url
+        }
+
+    if 'data' in fct_args_spec:
+        if 'data' in fct_args_defaults_dict:
+            fct_args['data'] = dict(fct_args_defaults_dict['data'])
+        else:
+            fct_args['data'] = {}
+
+        fct_args['data'].update(kwargs.get('data', {}))
+
+    if 'out' in fct_args_spec:
+        fct_args['out'] = kwargs.get('out')
+
+    if 'ret_type' in fct_args_defaults_dict:
+        ret_type = fct_args_defaults_dict['ret_type']
+    else:
+        ret_type = fct_args.get('data', {}).get('format', 'json')
+
+    return fct_args, ret_type
+
+
+def make_request():
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'path': '/bench/42',
+        'root_path': '',
+        'query_string': b'foo=1',
+        'headers': [(b'host', b'testserver')],
+        'path_params': {'id': 42},
+        'domain': 'bench',
+        'config': {}
+    })
+
+
+def main(number=100000):
+    kwargs = {'data': {'foo': '1'}, 'out': ['id']}
+    plan = RouteCallPlan(route)
+
+    def before():
+        legacy_arguments(route, make_request(), kwargs)
+
+    def after():
+        fct_args = plan.arguments(make_request(), kwargs)
+        plan.get_renderer(fct_args)
+
+    def baseline():
+        make_request()
+
+    t_baseline = min(timeit.repeat(baseline, number=number, repeat=5))
+    t_before = min(timeit.repeat(before, number=number, repeat=5))
+    t_after = min(timeit.repeat(after, number=number, repeat=5))
+
+    def per_call(total):
+        return (total - t_baseline) / number * 1e6
+
+    print(f'{number} iterations (request creation excluded)')
+    print(f'  before (introspection per request) : {per_call(t_before):.2f} µs/request')
+    print(f'  after (RouteCallPlan)              : {per_call(t_after):.2f} µs/request')
+    print(f'  speedup                            : x{per_call(t_before) / per_call(t_after):.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Peak memory and duration of an ODS/XLSX/CSV export
+
+It compares the pyexcel based halfapi.lib.responses.ODSResponse (the rows, the
+sheet and the document are in memory) with the streaming writers of
+halfapi.lib.spreadsheet, that write a generator of rows into a spooled
+temporary file. The csv file type compares the pyexcel ODS export with the
+streaming CSVResponse.
+
+Usage :
+
+    python benchmarks/spreadsheet_export.py [rows] [ods|xlsx|csv]
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from halfapi.lib.responses import CSVResponse, ODSResponse, XLSXResponse
+from halfapi.lib.spreadsheet import WRITERS
+
+
+def rows(number):
+    for i in range(number):
+        yield {'id': i, 'name': f'row {i}', 'value': i / 3, 'ok': i % 2 == 0}
+
+
+def measure(fct):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fct()
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main(number=100000, file_type='ods'):
+    def before():
+        response_cls = XLSXResponse if file_type == 'xlsx' else ODSResponse
+        response_cls(list(rows(number)))
+
+    def after():
+        if file_type == 'csv':
+            response = CSVResponse(rows(number))
+            iterator = iter(response.items)
+            exhausted = False
+            while not exhausted:
+                _, exhausted = response.next_chunk(iterator)
+            return
+
+        with tempfile.SpooledTemporaryFile(max_size=1 << 22) as document:
+            with WRITERS[file_type](document) as writer:
+                writer.write_rows(rows(number))
+
+    print(f'{number} rows ({file_type})')
+    for name, fct in (('before (pyexcel)', before), ('after (streaming)', after)):
+        duration, peak = measure(fct)
+        print(f'  {name:<18} : {duration:.2f} s, peak {peak / (1 << 20):.1f} MiB')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]), *sys.argv[2:3])
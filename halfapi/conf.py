@@ -27,9 +27,20 @@ It follows the following format :
     [project]
     halfapi_version = HALFAPI_VERSION
 
+    [project.compression]
+    algorithm = "gzip"
+    minimum_size = 500
+
+    [project.cache]
+    backend = "sqlite"
+    max_size = 67108864
+
     [domain.domain_name]
     name = domain_name
     routers = routers
+    thread_pool_size = 8
+    thread_pool_queue = 64
+    process_pool_size = 4
 
     [domain.domain_name.config]
     option = Argh
@@ -70,7 +81,11 @@ PROJECT_LEVEL_KEYS = {
     'host',
     'port',
     'loglevel',
-    'dryrun'
+    'dryrun',
+    'jwt_cache_size',
+    'jwks',
+    'compression',
+    'cache'
 }
 
 DOMAIN_LEVEL_KEYS = PROJECT_LEVEL_KEYS | {
@@ -78,7 +93,10 @@ DOMAIN_LEVEL_KEYS = PROJECT_LEVEL_KEYS | {
     'name',
     'module',
     'prefix',
-    'enabled'
+    'enabled',
+    'thread_pool_size',
+    'thread_pool_queue',
+    'process_pool_size'
 }
 
 CONF_FILE = os.environ.get('HALFAPI_CONF_FILE', DEFAULT_CONF['CONF_FILE'])
@@ -11,12 +11,13 @@ from types import ModuleType, FunctionType
 from schema import SchemaError
 
 from starlette.applications import Starlette
+from starlette.authentication import AuthenticationError
 from starlette.middleware import Middleware
 from starlette.routing import Router, Route
 from starlette.schemas import SchemaGenerator
 
 from .lib.acl import AclRoute
-from .lib.responses import ORJSONResponse
+from .lib.responses import PrerenderedJSON
 
 import yaml
 
@@ -26,21 +27,29 @@ from .lib.constants import API_SCHEMA_DICT, ROUTER_SCHEMA, VERBS
 from .half_route import HalfRoute
 from .lib import acl as lib_acl
 from .lib.responses import PlainTextResponse
-from .lib.routes import JSONRoute
+from .lib.routes import JSONRoute, acl_params_schema
 from .lib.schemas import param_docstring_default
 from .lib.domain import MissingAclError, PathError, UnknownPathParameterType, \
     UndefinedRoute, UndefinedFunction, get_fct_name, route_decorator
 from .lib.domain_middleware import DomainMiddleware
+from .lib.jwt_middleware import on_auth_error
+from .lib.executor import configure_process_pool, configure_thread_pool
 from .logging import logger
 
 class HalfDomain(Starlette):
-    def __init__(self, domain, module=None, router=None, acl=None, app=None):
+    def __init__(self, domain, module=None, router=None, acl=None, app=None,
+        thread_pool_size=None, thread_pool_queue=None, process_pool_size=None):
         """
         Parameters:
             domain (str): Module name (should be importable)
             router (str): Router name (should be importable from domain module
                 defaults to __router__ variable from domain module)
             app (HalfAPI): The app instance
+            thread_pool_size (int): Number of threads that run the sync routes
+            thread_pool_queue (int): Number of sync route calls that can wait
+                for a thread before the requests are refused (503)
+            process_pool_size (int): Number of processes that run the routes
+                with the "'executor': 'process'" option
         """
         self.app = app
 
@@ -66,10 +75,23 @@ class HalfDomain(Starlette):
 
         self.m_acl = HalfDomain.m_acl(self.m_domain, acl)
 
+        # The ACL functions whose results are cached (fifth element of ACLS)
+        self.acl_caches = {}
+        for elt in getattr(self.m_acl, 'ACLS', ()):
+            elt = lib_acl.ACL(*elt)
+            if elt.cache:
+                fct = getattr(self.m_acl, elt.name)
+                self.acl_caches[fct] = lib_acl.AclDecisionCache(fct, elt.cache)
+
         self.config = { **app.config }
 
         logger.info('HalfDomain creation %s %s', domain, self.config)
 
+        self.thread_pool = configure_thread_pool(
+            self.name, thread_pool_size, thread_pool_queue)
+        self.process_pool = None
+        self.process_routes = 0
+
         for elt in self.deps:
             package, version = elt
             specifier = SpecifierSet(version)
@@ -83,6 +105,10 @@ class HalfDomain(Starlette):
 
         super().__init__(
             routes=self.gen_domain_routes(),
+            exception_handlers={
+                # The user is resolved when a route reads it
+                AuthenticationError: on_auth_error
+            },
             middleware=[
                 Middleware(
                     DomainMiddleware,
@@ -97,6 +123,16 @@ class HalfDomain(Starlette):
             ]
         )
 
+        if self.process_routes:
+            # Pre-warm the process pool, with the domain module imported
+            self.process_pool = configure_process_pool(
+                self.name, self.m_domain.__name__, process_pool_size)
+            self.process_pool.warmup()
+
+        # The routes are all defined, compute the domain's OpenAPI schema
+        self.openapi = PrerenderedJSON(
+            self.openapi_generator.get_schema(routes=self.routes))
+
     @staticmethod
     def name(module):
         """ Returns the name declared in the 'domain' dict at the root of the package
@@ -192,12 +228,11 @@ class HalfDomain(Starlette):
 
             if elt.public:
                 try:
-                    if inspect.iscoroutinefunction(fct):
-                        logger.warning('async decorator are not yet supported')
-                    else:
+                    # The coroutine ACLs are not decorators
+                    if not inspect.iscoroutinefunction(fct):
                         inner = fct()
 
-                        if inspect.iscoroutinefunction(fct) or callable(inner):
+                        if callable(inner):
                             fct = inner
 
                 except TypeError:
@@ -272,7 +307,7 @@ class HalfDomain(Starlette):
 
 
         if not inspect.iscoroutinefunction(fct):
-            return route_decorator(fct), params
+            return route_decorator(fct, params), params
 
         # TODO: Remove when using only sync functions
         return lib_acl.args_check(fct), params
@@ -430,6 +465,16 @@ class HalfDomain(Starlette):
         )
 
         for path, method, m_router, fct, params in HalfDomain.gen_router_routes(self.m_router, []):
+            if getattr(getattr(fct, 'plan', None), 'executor', None) == 'process':
+                self.process_routes += 1
+
+            if self.acl_caches:
+                params = [
+                    {**param, 'acl': self.acl_caches[param['acl']]}
+                    if param.get('acl') in self.acl_caches else param
+                    for param in params
+                ]
+
             yield HalfRoute(f'/{path}', fct, params, method)
 
     def schema_dict(self) -> Dict:
@@ -460,8 +505,7 @@ class HalfDomain(Starlette):
                 logger.error(
                     'Cannot read docstring from fct (fct=%s path=%s verb=%s', fct.__name__, path, verb)
 
-            d_res[path][verb]['acls'] = list(map(lambda elt: { **elt, 'acl': elt['acl'].__name__ },
-                parameters))
+            d_res[path][verb]['acls'] = list(map(acl_params_schema, parameters))
 
         return d_res
 
@@ -480,7 +524,11 @@ class HalfDomain(Starlette):
         return schema
 
     def schema_openapi(self) -> Route:
-        schema = SchemaGenerator(
+        """ Returns the endpoint of the domain's root route, that serves the
+        OpenAPI schema computed at the domain creation (the "openapi"
+        attribute)
+        """
+        self.openapi_generator = SchemaGenerator(
             {
                 'openapi': '3.0.0',
                 'info': {
@@ -506,8 +554,7 @@ class HalfDomain(Starlette):
               200:
                 description: API Schema in OpenAPI v3 format
             """
-            return ORJSONResponse(
-                schema.get_schema(routes=request.app.routes))
+            return self.openapi.response(request)
 
         return inner
 
@@ -2,9 +2,11 @@
 
 Child class of starlette.routing.Route
 """
+import asyncio
+import inspect
 from functools import partial, wraps
 
-from typing import Callable, Coroutine, List, Dict
+from typing import Awaitable, Callable, Coroutine, List, Dict, Optional, Union
 from types import FunctionType
 
 from starlette.requests import Request
@@ -13,8 +15,172 @@ from starlette.routing import Route
 from starlette.exceptions import HTTPException
 
 from .logging import logger
+from .lib.acl import RoleAcl, public, resolve_acl
+from .lib.cache import Coalescer, ETagger, ResponseCache, cached_call
+from .lib.domain_middleware import acl_headers
 from .lib.domain import MissingAclError, PathError, UnknownPathParameterType, \
-    UndefinedRoute, UndefinedFunction
+    UndefinedRoute, UndefinedFunction, route_option
+
+class CompiledAcl:
+    """ An ACL of a route, resolved when the route is built, with the scope
+    values of the requests that pass it
+
+    Attributes:
+        fct (Callable): The function that checks the request
+        name (str): The name of the ACL
+        scope (Dict): The "acl_pass", "acl_headers", "args" and "out" (a
+            tuple) scope values
+        cache (ResponseCache): The response cache ("cache" option)
+        coalescer (Coalescer): The coalescer ("coalesce" option)
+        etagger (ETagger): The ETag option ("etag" option)
+        cached (bool): True if one of the three previous options is set
+        is_async (bool): True if the ACL function is a coroutine function
+    """
+    __slots__ = ('fct', 'name', 'scope', 'cache', 'coalescer', 'etagger',
+        'cached', 'is_async')
+
+    def __init__(self, route_fct: Callable, param: Dict):
+        self.fct = resolve_acl(param['acl'])
+        self.name = param['acl'].__name__
+        self.is_async = inspect.iscoroutinefunction(self.fct) \
+            or getattr(self.fct, 'is_async', False)
+
+        self.scope = {
+            'acl_pass': self.name,
+            'acl_headers': acl_headers(param)
+        }
+        if 'args' in param:
+            self.scope['args'] = param['args']
+        if 'out' in param:
+            self.scope['out'] = tuple(param['out'])
+
+        name = f'{route_fct.__module__}:{route_fct.__name__} ({self.name})'
+        self.cache = ResponseCache(name, param['cache']) \
+            if param.get('cache') is not None else None
+        self.coalescer = Coalescer(name, param['coalesce'],
+            public=param['acl'] is public) if param.get('coalesce') else None
+        self.etagger = ETagger(name, param['etag']) \
+            if param.get('etag') else None
+        self.cached = self.cache is not None or self.coalescer is not None \
+            or self.etagger is not None
+
+    def check(self, req: Request, *args, **kwargs) -> Union[bool, Awaitable[bool]]:
+        """ Returns the result of the ACL function (a coroutine for the
+        coroutine ACLs)
+        """
+        passed = self.fct(req, *args, **kwargs)
+        if isinstance(passed, FunctionType):
+            # A decorator ACL that was not detected by resolve_acl
+            self.fct = self.fct()
+            passed = self.fct(req, *args, **kwargs)
+
+        return passed
+
+
+async def first_passing_acl(chain: List[CompiledAcl], req: Request, *args,
+    **kwargs) -> Optional[CompiledAcl]:
+    """ Returns the first ACL of the chain that passes, the coroutine ACLs
+    being evaluated concurrently ("concurrent_acls" option)
+
+    The ACLs are awaited in the declaration (priority) order : an ACL is
+    chosen when it passes and all the previous ones failed, and the ACLs that
+    are still running are then cancelled.
+    """
+    tasks = [
+        asyncio.ensure_future(entry.check(req, *args, **kwargs))
+        if entry.is_async else None
+        for entry in chain
+    ]
+    try:
+        for entry, task in zip(chain, tasks):
+            passed = await task if task is not None \
+                else entry.check(req, *args, **kwargs)
+            if passed:
+                return entry
+
+        return None
+    finally:
+        for task in tasks:
+            if task is None:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Retrieves the exceptions of the ACLs that were not awaited
+                task.exception()
+
+
+def acl_evaluator(chain: List[CompiledAcl], concurrent: bool = False,
+    name: str = '') -> Callable[..., Awaitable[Optional[CompiledAcl]]]:
+    """ Returns the coroutine function that returns the first ACL of the chain
+    that passes (None if none passes)
+
+    The chain is evaluated :
+        - as a list of bitmasks, if all its ACLs are role ACLs of the same claim
+        - concurrently, if it has coroutine ACLs and concurrent is True
+        - in order, awaiting the coroutine ACLs, if it has some
+        - in order, otherwise
+
+    The chosen evaluation is logged (debug level), with the route name.
+    """
+    role_acls = [entry.fct for entry in chain]
+    awaitable = any(entry.is_async for entry in chain)
+
+    if role_acls and all(isinstance(fct, RoleAcl) for fct in role_acls) \
+        and len({fct.scope_key for fct in role_acls}) == 1:
+        # The bitmasks are checked against the bitset of the user's roles
+        masks = [
+            (fct.mask, fct.require_all, entry)
+            for fct, entry in zip(role_acls, chain)
+        ]
+        user_bits = role_acls[0].user_bits
+
+        async def passing_acl(req: Request, *args, **kwargs) -> Optional[CompiledAcl]:
+            bits = user_bits(req)
+            for mask, require_all, entry in masks:
+                if (bits & mask == mask) if require_all else (bits & mask):
+                    return entry
+
+            return None
+
+        mode = 'role bitmasks'
+
+    elif awaitable and concurrent:
+        passing_acl = partial(first_passing_acl, chain)
+        mode = 'concurrent'
+
+    elif awaitable:
+        async def passing_acl(req: Request, *args, **kwargs) -> Optional[CompiledAcl]:
+            for entry in chain:
+                passed = entry.check(req, *args, **kwargs)
+                if entry.is_async:
+                    passed = await passed
+                if passed:
+                    return entry
+
+            return None
+
+        mode = 'awaiting'
+
+    else:
+        async def passing_acl(req: Request, *args, **kwargs) -> Optional[CompiledAcl]:
+            for entry in chain:
+                if entry.check(req, *args, **kwargs):
+                    return entry
+
+            return None
+
+        mode = 'sequential'
+
+    # The role ACLs of a mixed chain (or of several claims) are called one by
+    # one
+    not_compiled = mode != 'role bitmasks' \
+        and any(isinstance(fct, RoleAcl) for fct in role_acls)
+    logger.debug('ACL chain of %s (%s) : %s evaluation%s', name,
+        ', '.join(entry.name for entry in chain), mode,
+        ', role ACLs not compiled' if not_compiled else '')
+    return passing_acl
+
 
 class HalfRoute(Route):
     """ HalfRoute
@@ -60,50 +226,45 @@ class HalfRoute(Route):
         if not fct:
             return partial(HalfRoute.acl_decorator, params=params)
 
+        chain = [
+            CompiledAcl(fct, param)
+            for param in params
+            if param.get('acl')
+        ]
+
+        passing_acl = acl_evaluator(
+            chain, route_option(params, 'concurrent_acls', False),
+            f'{fct.__module__}:{fct.__name__}')
 
         @wraps(fct)
         async def caller(req: Request, *args, **kwargs):
-            for param in params:
-                if param.get('acl'):
-                    passed = param['acl'](req, *args, **kwargs)
-                    if isinstance(passed, FunctionType):
-                        passed = param['acl']()(req, *args, **kwargs)
-
-                    if not passed:
-                        logger.debug(
-                            'ACL FAIL for current route (%s - %s)', fct, param.get('acl'))
-                        continue
-
-                    logger.debug(
-                        'ACL OK for current route (%s - %s)', fct, param.get('acl'))
-
-                    req.scope['acl_pass'] = param['acl'].__name__
-
-                    if 'args' in param:
-                        req.scope['args'] = param['args']
-                        logger.debug(
-                            'Args for current route (%s)', param.get('args'))
+            entry = await passing_acl(req, *args, **kwargs)
+            if entry is None:
+                if 'check' in req.query_params:
+                    return PlainTextResponse('')
 
-                    if 'out' in param:
-                        req.scope['out'] = param['out']
+                raise HTTPException(401)
 
-                    if 'out' in param:
-                        req.scope['out'] = param['out'].copy()
+            req.scope.update(entry.scope)
 
-                    if 'check' in req.query_params:
-                        return PlainTextResponse(param['acl'].__name__)
+            # The query string is parsed only if it may have "check"
+            if b'check' in req.scope.get('query_string', b'') \
+                and 'check' in req.query_params:
+                return PlainTextResponse(entry.name)
 
-                    logger.debug('acl_decorator %s', param)
-                    logger.debug('calling %s:%s %s %s', fct.__module__, fct.__name__, args, kwargs)
-                    return await fct(
-                        req, *args,
-                        **{
-                            **kwargs,
-                        })
+            if entry.cached and req.method == 'GET':
+                return await cached_call(
+                    req, partial(fct, req, *args, **kwargs),
+                    entry.cache, entry.coalescer, entry.etagger)
 
-            if 'check' in req.query_params:
-                return PlainTextResponse('')
+            return await fct(req, *args, **kwargs)
 
-            raise HTTPException(401)
+        async def check_acls(req: Request, *args, **kwargs) -> str:
+            """ Returns the name of the first ACL that passes ('' if none
+            passes), as the "check" query parameter
+            """
+            entry = await passing_acl(req, *args, **kwargs)
+            return entry.name if entry is not None else ''
 
+        caller.check_acls = check_acls
         return caller
@@ -17,33 +17,43 @@ from datetime import datetime
 
 # asgi framework
 from starlette.applications import Starlette
-from starlette.authentication import UnauthenticatedUser
+from starlette.authentication import AuthenticationError, UnauthenticatedUser
 from starlette.exceptions import HTTPException
 from starlette.middleware import Middleware
 from starlette.routing import Router, Route, Mount
-from starlette.requests import Request
+from starlette.requests import HTTPConnection, Request
 from starlette.responses import Response, PlainTextResponse
-from starlette.middleware.authentication import AuthenticationMiddleware
 
 from timing_asgi import TimingMiddleware
 from timing_asgi.integrations import StarletteScopeToName
 
 # module libraries
 
+from .lib import acl as lib_acl
+from .lib.acl import acl_caches_stats
+from .lib.cache import coalescers_stats, configure_backend, \
+    response_caches_stats
+from .lib.compression import CompressionMiddleware
 from .lib.constants import API_SCHEMA_DICT
 from .lib.domain_middleware import DomainMiddleware
 from .lib.timing import HTimingClient
-from .lib.jwt_middleware import JWTAuthenticationBackend, on_auth_error
+from .lib.jwks import KeySet
+from .lib.jwt_middleware import JWTAuthenticationBackend, \
+    JWTAuthenticationMiddleware, on_auth_error
 from .lib.responses import (ORJSONResponse, UnauthorizedResponse,
     NotFoundResponse, InternalServerErrorResponse, NotImplementedResponse,
     ServiceUnavailableResponse, gen_exception_route)
 from .lib.domain import NoDomainsException
-from .lib.routes import gen_schema_routes, JSONRoute
-from .lib.schemas import schema_json
+from .lib.routes import gen_schema_routes, match_route, JSONRoute
+from .lib.schemas import openapi_schema, schema_json
 from .logging import logger, config_logging
 from .half_domain import HalfDomain
+from .half_route import HalfRoute
 from halfapi import __version__
 
+# The maximum number of routes of an /halfapi/acls/check request
+ACLS_CHECK_MAX_ROUTES = 256
+
 class HalfAPI(Starlette):
     def __init__(self,
         config,
@@ -54,9 +64,11 @@ class HalfAPI(Starlette):
         )
         self.config = config
         SECRET = self.config.get('secret')
+        JWKS = self.config.get('jwks')
         PRODUCTION = self.config.get('production', True)
         DRYRUN = self.config.get('dryrun', False)
         TIMINGMIDDLEWARE = self.config.get('timingmiddleware', False)
+        COMPRESSION = self.config.get('compression')
 
         if DRYRUN:
             logger.info('HalfAPI starting in dry-run mode')
@@ -66,6 +78,10 @@ class HalfAPI(Starlette):
 
         self.PRODUCTION = PRODUCTION
         self.SECRET = SECRET
+        self.jwt_backend = None
+
+        # The backend of the response caches of the routes
+        configure_backend(self.config.get('cache'))
 
         # Domains
 
@@ -109,7 +125,8 @@ class HalfAPI(Starlette):
                 404: gen_exception_route(NotFoundResponse),
                 500: gen_exception_route(HalfAPI.exception),
                 501: gen_exception_route(NotImplementedResponse),
-                503: gen_exception_route(ServiceUnavailableResponse)
+                503: gen_exception_route(ServiceUnavailableResponse),
+                AuthenticationError: on_auth_error
             }
         )
 
@@ -148,10 +165,21 @@ class HalfAPI(Starlette):
 
         self.add_route('/', JSONRoute(schemas))
 
-        if SECRET:
+        if COMPRESSION:
             self.add_middleware(
-                AuthenticationMiddleware,
-                backend=JWTAuthenticationBackend(),
+                CompressionMiddleware,
+                **(COMPRESSION if isinstance(COMPRESSION, dict) else {}),
+                timing_client=HTimingClient() \
+                    if not PRODUCTION and TIMINGMIDDLEWARE else None
+            )
+
+        if SECRET or JWKS:
+            self.jwt_backend = JWTAuthenticationBackend(
+                cache_size=self.config.get('jwt_cache_size', 1024),
+                keyset=KeySet(JWKS) if JWKS else None)
+            self.add_middleware(
+                JWTAuthenticationMiddleware,
+                backend=self.jwt_backend,
                 on_error=on_auth_error
             )
 
@@ -163,6 +191,9 @@ class HalfAPI(Starlette):
                 starlette_app=self)
             )
 
+        # The routes are all defined, compute the /halfapi/schema response
+        openapi_schema(self)
+
     @property
     def version(self):
         return __version__
@@ -204,8 +235,45 @@ class HalfAPI(Starlette):
 
         yield Route('/whoami', get_user)
         yield Route('/schema', schema_json)
+        # Before the /acls mount
+        yield Route('/acls/check', self.acls_check, methods=['POST'])
         yield Mount('/acls', self.acls_router())
         yield Route('/version', self.version_async)
+
+        async def metrics(request: Request, *args, **kwargs):
+            """
+            description: The statistics of the caches (responses, ACL results
+              and tokens) and of the coalesced requests
+            responses:
+              200:
+                description: The hits, misses and evictions of each cache,
+                  the calls and waiting requests of each coalescer
+                content:
+                  application/json:
+                    schema:
+                      type: object
+            """
+            return ORJSONResponse({
+                'response_caches': response_caches_stats(),
+                'coalescing': coalescers_stats(),
+                'acl_caches': acl_caches_stats(),
+                'jwt_cache': self.jwt_backend.cache.stats \
+                    if self.jwt_backend is not None else None
+            })
+
+        # The metrics name the modules, routes and ACLs : in production,
+        # they are only served to the authenticated users (to nobody if no
+        # token can be verified)
+        if not self.PRODUCTION:
+            metrics_acl = lib_acl.public
+        elif self.SECRET or self.config.get('jwks'):
+            metrics_acl = lib_acl.connected
+        else:
+            metrics_acl = lib_acl.private
+
+        yield Route('/metrics', HalfRoute.acl_decorator(metrics, params=[{
+            'acl': metrics_acl
+        }]))
         """ Halfapi debug routes definition
         """
         if self.PRODUCTION:
@@ -233,6 +301,85 @@ class HalfAPI(Starlette):
 
         yield Route('/exception', exception)
 
+    async def acls_check(self, request: Request, *args, **kwargs):
+        """
+        description: Returns the ACL that passes for each route of the list,
+          for the current user (as the "check" query parameter). The "acl" is
+          null for the routes that are not found or have no ACL, and it is an
+          empty string if no ACL passes.
+        requestBody:
+          content:
+            application/json:
+              schema:
+                type: array
+                maxItems: 256
+                items:
+                  type: array
+                  items:
+                    type: string
+                  example: ["GET", "/dummy_domain/abc/alphabet"]
+        responses:
+          200:
+            description: The ACL of each route
+            content:
+              application/json:
+                schema:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      method:
+                        type: string
+                      path:
+                        type: string
+                      acl:
+                        type: string
+                        nullable: true
+        """
+        try:
+            routes = await request.json()
+            if not isinstance(routes, list) or len(routes) > ACLS_CHECK_MAX_ROUTES:
+                raise ValueError()
+            routes = [
+                (str(method).upper(), str(path))
+                for method, path in routes
+            ]
+        except (TypeError, ValueError) as exc:
+            raise HTTPException(400,
+                f'Expected a list of [method, path] pairs (at most {ACLS_CHECK_MAX_ROUTES})') from exc
+
+        # The token is decoded once, for all the routes, as for a "check"
+        # request
+        if self.jwt_backend is not None:
+            auth, user = self.jwt_backend.resolve(HTTPConnection(
+                {**request.scope, 'query_string': b'check'}))
+        else:
+            auth, user = request.scope.get('auth'), request.scope.get('user')
+
+        result = []
+        for method, path in routes:
+            scope = {
+                'type': 'http',
+                'method': method,
+                'path': path,
+                'root_path': '',
+                'query_string': b'check',
+                'headers': request.scope.get('headers', []),
+                'app': self,
+                'user': user,
+                'auth': auth
+            }
+            route = match_route(self.routes, scope)
+            check_acls = getattr(getattr(route, 'endpoint', None), 'check_acls', None)
+            result.append({
+                'method': method,
+                'path': path,
+                'acl': await check_acls(Request(scope)) \
+                    if check_acls is not None else None
+            })
+
+        return ORJSONResponse(result)
+
     @staticmethod
     def api_schema(domain):
         pass
@@ -291,7 +438,10 @@ class HalfAPI(Starlette):
                 module=importlib.import_module(module),
                 router=kwargs.get('router'),
                 acl=kwargs.get('acl'),
-                app=self
+                app=self,
+                thread_pool_size=kwargs.get('thread_pool_size'),
+                thread_pool_queue=kwargs.get('thread_pool_queue'),
+                process_pool_size=kwargs.get('process_pool_size')
             )
 
         except ImportError as exc:
@@ -303,6 +453,7 @@ class HalfAPI(Starlette):
             raise exc
 
         self.mount(kwargs.get('path', name), self.__domains[name])
+        self.state.openapi_schema = None
 
         return self.__domains[name]
 
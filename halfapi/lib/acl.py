@@ -2,8 +2,12 @@
 """
 Base ACL module that contains generic functions for domains ACL
 """
+import inspect
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from functools import wraps
+from functools import lru_cache, wraps
+from typing import Any, Callable, Dict, Iterable, Optional
 from json import JSONDecodeError
 import yaml
 from starlette.authentication import UnauthenticatedUser
@@ -24,12 +28,27 @@ def private(*args, **kwargs) -> bool:
 
 def connected(fct=public):
     """ Decorator that checks if the user object of the request has been set
+
+    The ACL is a coroutine function if the decorated one is.
     """
+    def authenticated(req) -> bool:
+        return not (not hasattr(req, 'user')
+          or isinstance(req.user, UnauthenticatedUser)
+          or not hasattr(req.user, 'is_authenticated'))
+
+    if inspect.iscoroutinefunction(fct):
+        @wraps(fct)
+        async def async_caller(req, *args, **kwargs):
+            if not authenticated(req):
+                return False
+
+            return await fct(req, **{**kwargs, **getattr(req, 'path_params', {})})
+
+        return async_caller
+
     @wraps(fct)
     def caller(req, *args, **kwargs):
-        if (not hasattr(req, 'user')
-          or isinstance(req.user, UnauthenticatedUser)
-          or not hasattr(req.user, 'is_authenticated')):
+        if not authenticated(req):
             return False
 
         if hasattr(req, 'path_params'):
@@ -38,6 +57,147 @@ def connected(fct=public):
 
     return caller
 
+class RoleVocabulary:
+    """ The bit of each role name, for the role ACLs
+
+    The bits are given when the role ACLs are created (at startup), the roles
+    of the users are then converted into a bitset, cached by list of roles.
+    """
+    def __init__(self):
+        self.bits: Dict[str, int] = {}
+        self.user_bits = lru_cache(maxsize=4096)(self.compute_bits)
+
+    def mask(self, roles: Iterable[str]) -> int:
+        """ Returns the bitmask of the roles (their bits are added if needed)
+
+        Examples:
+
+            >>> vocabulary = RoleVocabulary()
+            >>> vocabulary.mask(['admin', 'editor']), vocabulary.mask(['editor'])
+            (3, 2)
+        """
+        mask = 0
+        for role in roles:
+            if role not in self.bits:
+                self.bits[role] = 1 << len(self.bits)
+                # The cached bitsets miss the new role
+                self.user_bits.cache_clear()
+            mask |= self.bits[role]
+
+        return mask
+
+    def compute_bits(self, roles: tuple) -> int:
+        """ Returns the bitset of the roles of a user (the unknown roles are
+        ignored)
+
+        Examples:
+
+            >>> vocabulary = RoleVocabulary()
+            >>> vocabulary.mask(['admin', 'editor'])
+            3
+            >>> vocabulary.user_bits(('editor', 'reader'))
+            2
+        """
+        bits = 0
+        for role in roles:
+            bits |= self.bits.get(role, 0)
+
+        return bits
+
+
+ROLES = RoleVocabulary()
+
+class RoleAcl:
+    """ An ACL that passes if the user has one of its roles (or all of them
+    with require_all), read in a claim of the token payload
+
+    The roles are compiled into a bitmask when the ACL is created, and the
+    roles of the user into a bitset once per request, so that the check of
+    each role ACL is a single AND.
+
+    Usage (in the acl module of a domain) :
+
+        editor = acl.roles('admin', 'editor', name='editor')
+
+        ACLS = (
+            ('editor', editor.__doc__, 10),
+        )
+    """
+    def __init__(self, *roles: str, name: Optional[str] = None,
+        claim: str = 'roles', require_all: bool = False,
+        vocabulary: RoleVocabulary = ROLES):
+        self.roles = roles
+        self.__name__ = name or '_'.join(roles)
+        self.__doc__ = '{} the role{} {}'.format(
+            'Has all' if require_all else 'Has one of',
+            's' if len(roles) > 1 else '',
+            ', '.join(roles))
+        self.claim = claim
+        self.require_all = require_all
+        self.vocabulary = vocabulary
+        self.mask = vocabulary.mask(roles)
+        # The scope key of the request's bitset
+        self.scope_key = f'role_bits:{claim}:{id(vocabulary)}'
+
+    def user_bits(self, req) -> int:
+        """ Returns the bitset of the user's roles (read once per request)
+        """
+        bits = req.scope.get(self.scope_key)
+        if bits is None:
+            payload = getattr(req.scope.get('user'), 'payload', None) or {}
+            roles = payload.get(self.claim) or ()
+            if isinstance(roles, str):
+                roles = roles.split()
+
+            bits = self.vocabulary.user_bits(tuple(roles))
+            req.scope[self.scope_key] = bits
+
+        return bits
+
+    def __call__(self, req, *args, **kwargs) -> bool:
+        if self.require_all:
+            return self.user_bits(req) & self.mask == self.mask
+
+        return self.user_bits(req) & self.mask != 0
+
+def roles(*names: str, **kwargs) -> RoleAcl:
+    """ Returns a role ACL (see RoleAcl)
+    """
+    return RoleAcl(*names, **kwargs)
+
+
+def is_acl_decorator(fct: Callable) -> bool:
+    """ Returns True if the ACL is a decorator (like "connected"), that
+    returns the ACL function when it is called without the request
+
+    Examples:
+
+        >>> is_acl_decorator(connected), is_acl_decorator(public)
+        (True, False)
+    """
+    try:
+        parameters = list(inspect.signature(fct).parameters.values())
+    except (TypeError, ValueError):
+        return False
+
+    return len(parameters) > 0 and parameters[0].name == 'fct'
+
+def resolve_acl(fct: Callable) -> Callable:
+    """ Returns the function that checks the request, for the plain and the
+    decorator ACLs (called once, when the route is built)
+
+    Examples:
+
+        >>> resolve_acl(connected) is connected
+        False
+        >>> resolve_acl(public) is public
+        True
+    """
+    if is_acl_decorator(fct):
+        return fct()
+
+    return fct
+
 def args_check(fct):
     """ Decorator that puts required and optional arguments in scope
 
@@ -131,7 +291,13 @@ def args_check(fct):
 # When the 'public' boolean value is True, a route protected by this ACL is
 # defined on the "/halfapi/acls/acl_name", that returns an empty response and
 # the status code 200 or 401.
- 
+#
+# The optional fifth element caches the results of the ACL, by user id and by
+# the values of some path parameters (see AclDecisionCache) :
+#
+#   ('is_member', is_member.__doc__, 10, False,
+#       {'ttl': 60, 'path_params': ['group_id']})
+
 ACLS = (
     ('private', private.__doc__, 0, True),
     ('public', public.__doc__, 999, True)
@@ -143,6 +309,120 @@ class ACL():
     documentation: str
     priority: int
     public: bool = False
+    cache: Optional[Dict] = None
+
+
+class AclDecisionCache:
+    """ An ACL function whose results are cached, by user id and by the values
+    of the declared path parameters, for ttl seconds
+
+    The requests without user id (anonymous) are not cached. The cached
+    results are dropped with the "invalidate" method, or the
+    "invalidate_acl_caches" function (when the groups of a user change, for
+    example). A coroutine ACL function gives a coroutine ACL.
+
+    Attributes:
+        ttl (float): The time to live of the results (defaults to 60)
+        path_params (Tuple[str]): The path parameters that the ACL depends on
+        max_entries (int): The maximum number of results (defaults to 10000)
+    """
+    def __init__(self, fct: Callable, options: Dict):
+        self.fct = resolve_acl(fct)
+        self.is_async = inspect.iscoroutinefunction(self.fct)
+        # The name of the ACL, for the routes
+        self.__name__ = fct.__name__
+        self.__doc__ = fct.__doc__
+        self.name = f'{fct.__module__}.{fct.__name__}'
+        self.ttl = options.get('ttl', 60)
+        self.path_params = tuple(options.get('path_params', ()))
+        self.max_entries = options.get('max_entries', 10000)
+        self.results: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        ACL_CACHES[self.name] = self
+
+    def __call__(self, req, *args, **kwargs) -> bool:
+        user_id = getattr(req.scope.get('user'), 'id', None)
+        if user_id is None:
+            return self.fct(req, *args, **kwargs)
+
+        path_params = req.path_params
+        key = (user_id, *(path_params.get(name) for name in self.path_params))
+        result = self.results.get(key)
+        if result is not None and result[1] > time.monotonic():
+            self.results.move_to_end(key)
+            self.hits += 1
+            if self.is_async:
+                return self.cached_result(result[0])
+            return result[0]
+
+        self.misses += 1
+        if self.is_async:
+            return self.async_call(key, req, *args, **kwargs)
+
+        return self.store(key, self.fct(req, *args, **kwargs))
+
+    @staticmethod
+    async def cached_result(passed: bool) -> bool:
+        return passed
+
+    async def async_call(self, key, req, *args, **kwargs) -> bool:
+        return self.store(key, await self.fct(req, *args, **kwargs))
+
+    def store(self, key, passed: Any) -> bool:
+        passed = bool(passed)
+        self.results[key] = (passed, time.monotonic() + self.ttl)
+        self.results.move_to_end(key)
+        if len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+        return passed
+
+    def invalidate(self, user_id: Any = None, **path_params):
+        """ Drops the results of a user (all of them if user_id is None), for
+        the given path parameters values (all of them by default)
+        """
+        if user_id is None and not path_params:
+            self.results.clear()
+            return
+
+        positions = {name: index + 1 for index, name in enumerate(self.path_params)}
+        for key in list(self.results):
+            if user_id is not None and key[0] != user_id:
+                continue
+            if all(key[positions[name]] == value
+                for name, value in path_params.items() if name in positions):
+                del self.results[key]
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            'ttl': self.ttl,
+            'path_params': list(self.path_params),
+            'size': len(self.results),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+ACL_CACHES: Dict[str, AclDecisionCache] = {}
+
+def invalidate_acl_caches(user_id: Any = None, acl: Optional[Callable] = None,
+    **path_params):
+    """ Drops the cached results of the ACLs (or of one ACL function), for a
+    user and for the given path parameters values
+    """
+    for cache in ACL_CACHES.values():
+        if acl is None or cache.name == f'{acl.__module__}.{acl.__name__}':
+            cache.invalidate(user_id, **path_params)
+
+def acl_caches_stats() -> Dict[str, Dict]:
+    """ Returns the statistics of the ACL decision caches, by name
+    """
+    return {
+        name: cache.stats
+        for name, cache in ACL_CACHES.items()
+    }
 
 
 class AclRoute(Route):
@@ -167,7 +447,11 @@ class AclRoute(Route):
             if request.method == 'GET':
                 logger.warning('Deprecated since 0.6.28, use HEAD method since now')
 
-            if self.acl_fct(request, *args, **kwargs) is True:
+            passed = self.acl_fct(request, *args, **kwargs)
+            if inspect.isawaitable(passed):
+                passed = await passed
+
+            if passed is True:
                 return Response(status_code=200)
 
             return Response(status_code=401)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Arrow module
+
+Converts the rows of an iterable of dicts into Arrow record batches, written
+in the IPC streaming format (the "arrow" format of the routes). It needs the
+"pyarrow" package.
+
+The schema of the batches is built from the schema component of the route's
+response, if its docstring refers to one :
+
+    responses:
+      200:
+        content:
+          application/json:
+            schema:
+              type: array
+              items:
+                $ref: "#/components/schemas/Pinnochio"
+
+Otherwise, it is inferred from the first batch. In this case, a column whose
+values of the first batch are all null has the null type, and the next
+batches cannot have values in it.
+
+Classes :
+    - BatchWriter
+
+Functions :
+    - arrow_type
+    - arrow_schema
+"""
+import io
+from typing import Any, Dict, List, Optional
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+def arrow_type(json_schema: Dict) -> Any:
+    """ Returns the Arrow type of a JSON schema (OpenAPI schema object)
+
+    The objects, and the values without type, are strings.
+    """
+    typ = json_schema.get('type')
+    fmt = json_schema.get('format')
+
+    if typ == 'integer':
+        return pa.int32() if fmt == 'int32' else pa.int64()
+    if typ == 'number':
+        return pa.float32() if fmt == 'float' else pa.float64()
+    if typ == 'boolean':
+        return pa.bool_()
+    if typ == 'array':
+        return pa.list_(arrow_type(json_schema.get('items', {})))
+    if typ == 'string' and fmt == 'date':
+        return pa.date32()
+    if typ == 'string' and fmt == 'date-time':
+        return pa.timestamp('us')
+
+    return pa.string()
+
+def arrow_schema(json_schema: Dict, fields: Optional[List[str]] = None) -> Any:
+    """ Returns the Arrow schema of the properties of a JSON schema (only the
+    given fields if they are set)
+    """
+    properties = json_schema.get('properties', {})
+    if fields is None:
+        fields = list(properties.keys())
+
+    required = set(json_schema.get('required', ()))
+    return pa.schema([
+        pa.field(name, arrow_type(properties.get(name, {})),
+            nullable=name not in required)
+        for name in fields
+    ])
+
+
+class BatchWriter:
+    """ Serializes lists of rows as the record batches of an IPC stream
+
+    The bytes of the stream are returned by "write_batch" and "close", as
+    they are produced.
+    """
+    def __init__(self, schema: Any = None, header: Optional[List[str]] = None):
+        if pa is None:
+            raise NotImplementedError('pyarrow is not installed, arrow format not available')
+
+        self.schema = schema
+        self.header = header
+        self.sink = io.BytesIO()
+        self.writer = None
+
+    def read(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def write_batch(self, rows: List[Dict]) -> bytes:
+        """ Returns the stream bytes of a batch (preceded by the schema for
+        the first one)
+        """
+        if self.schema is None:
+            if self.header is not None:
+                rows = [
+                    {key: row.get(key) for key in self.header}
+                    for row in rows
+                ]
+            batch = pa.RecordBatch.from_pylist(rows)
+            self.schema = batch.schema
+        else:
+            batch = pa.RecordBatch.from_pylist(rows, schema=self.schema)
+
+        if self.writer is None:
+            self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+        self.writer.write_batch(batch)
+        return self.read()
+
+    def close(self) -> bytes:
+        """ Returns the end of the stream
+        """
+        if self.writer is None:
+            if self.schema is None:
+                self.schema = pa.schema([
+                    pa.field(name, pa.null()) for name in self.header or ()
+                ])
+            self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+        self.writer.close()
+        return self.read()
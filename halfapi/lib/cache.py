@@ -0,0 +1,1016 @@
+#!/usr/bin/env python3
+"""
+Cache module
+
+The responses of the GET routes can be cached, with the "cache" option
+declared next to the ACL params of the route. It applies to the requests
+authorized by this ACL :
+
+    ACLS = {
+        'GET': [{
+            'acl': acl.public,
+            'cache': {
+                'ttl': 60,
+                'key': ['path', 'args'],
+                'max_entries': 1000
+            }
+        }]
+    }
+
+    - ttl : The time to live of the responses, in seconds (defaults to 60)
+    - key : The parts of the request that identify a response (defaults to
+      all of them)
+        - path : the path parameters
+        - args : the query string
+        - user : the user id
+        - acl : the name of the ACL that passed
+      The format negotiated with the "Accept" header is always part of the key.
+    - max_entries : The maximum number of responses of the route in the cache
+      (defaults to 1024). With the SQLite backend, that is bounded by its
+      size, the option is ignored (a warning is logged).
+
+Only the responses with a 200 status code and a body (not the streamed ones)
+are cached. A cached response is sent without calling the route function.
+
+The concurrent GET requests of a route can also share a single call of the
+route function, with the "coalesce" option (True, or a dict with the "key"
+parts, that defaults to ['path', 'args', 'acl', 'user'], without 'user' for
+the "public" ACL) :
+
+    ACLS = {
+        'GET': [{
+            'acl': acl.public,
+            'coalesce': True
+        }]
+    }
+
+The requests with the same key wait for the response of the first one. A
+route whose response does not depend on the user, behind another ACL than
+"public", can share it between the users with an explicit key.
+
+The "etag" option adds an ETag header to the 200 responses of the GET
+requests, and answers the requests with a matching "If-None-Match" header
+with an empty 304 response. With True, the tag is the hash of the body. It
+can also be a cheap version function of the route's data, called with the
+request : the tag is then the hash of the version and of the request (path
+parameters, query string, user, ACL and format), and the route function is
+not called when the tag matches.
+
+The responses are kept in the memory of each worker, unless the "cache"
+project option selects a backend shared by the workers of the host :
+
+    [project.cache]
+    backend = "sqlite"
+    path = "/dev/shm/halfapi-cache.sqlite"
+    max_size = 67108864
+
+Or by the nodes, with a Redis server behind the memory of each worker :
+
+    [project.cache]
+    backend = "redis"
+    host = "10.0.0.1"
+    port = 6379
+    timeout = 0.05
+    local_ttl = 5
+
+Classes :
+    - CachedResponse
+    - CacheBackend
+    - MemoryBackend
+    - SQLiteBackend
+    - RedisBackend
+    - TieredBackend
+    - ResponseCache
+    - Coalescer
+    - ETagger
+
+Functions :
+    - configure_backend
+    - request_key
+    - response_etag
+    - cached_call
+    - response_caches_stats
+    - coalescers_stats
+
+Constants :
+    RESPONSE_CACHES (Dict[str, ResponseCache]): The response caches, by name
+    COALESCERS (Dict[str, Coalescer]): The coalescers, by name
+"""
+import asyncio
+import hashlib
+import inspect
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .domain import accepted_format
+from .resp import RESPClient
+from .responses import NotModifiedResponse, PrerenderedResponse, etag, \
+    not_modified
+
+from ..logging import logger
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_SIZE = 1 << 26
+DEFAULT_LOCAL_TTL = 5
+LATENCY_SAMPLES = 1024
+KEY_PARTS = ('path', 'args', 'user', 'acl')
+COALESCE_KEY_PARTS = ('path', 'args', 'acl')
+
+# Status code, number of headers / length of a header name and value
+ENTRY_HEADER = struct.Struct('!HH')
+
+class CachedResponse:
+    """ The status code, headers and body of a response
+    """
+    __slots__ = ('status_code', 'raw_headers', 'body')
+
+    def __init__(self, status_code: int, raw_headers: List[Tuple[bytes, bytes]],
+        body: bytes):
+        self.status_code = status_code
+        self.raw_headers = raw_headers
+        self.body = body
+
+    def response(self) -> PrerenderedResponse:
+        return PrerenderedResponse(self.body, self.raw_headers, self.status_code)
+
+    def dumps(self) -> bytes:
+        """ Returns the serialized response, for the shared backends
+
+        Examples:
+
+            >>> CachedResponse(200, [(b'etag', b'"1"')], b'{}').dumps()
+            b'\\x00\\xc8\\x00\\x01\\x00\\x04\\x00\\x03etag"1"{}'
+        """
+        parts = [ENTRY_HEADER.pack(self.status_code, len(self.raw_headers))]
+        for name, value in self.raw_headers:
+            parts.append(ENTRY_HEADER.pack(len(name), len(value)))
+            parts.append(name)
+            parts.append(value)
+
+        parts.append(self.body)
+        return b''.join(parts)
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'CachedResponse':
+        """ Returns the response of the dumps result
+
+        Examples:
+
+            >>> response = CachedResponse.loads(
+            ...     CachedResponse(200, [(b'etag', b'"1"')], b'{}').dumps())
+            >>> response.status_code, response.raw_headers, response.body
+            (200, [(b'etag', b'"1"')], b'{}')
+        """
+        data = memoryview(data)
+        status_code, count = ENTRY_HEADER.unpack_from(data)
+        offset = ENTRY_HEADER.size
+        raw_headers = []
+        for _ in range(count):
+            name_len, value_len = ENTRY_HEADER.unpack_from(data, offset)
+            offset += ENTRY_HEADER.size
+            name = bytes(data[offset:offset + name_len])
+            offset += name_len
+            raw_headers.append((name, bytes(data[offset:offset + value_len])))
+            offset += value_len
+
+        return cls(status_code, raw_headers, bytes(data[offset:]))
+
+
+class CacheBackend:
+    """ The interface of the cache storages
+
+    The values are CachedResponse objects, the keys are strings.
+
+    Attributes:
+        hits (int): The number of keys that were found
+        misses (int): The number of keys that were not found (or had expired)
+        evictions (int): The number of entries that were removed to free
+            some space
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        """ Returns the value of the key (None if it is not in the cache)
+        """
+        raise NotImplementedError
+
+    async def get_many(self, keys: Iterable[str]) -> List[Optional[CachedResponse]]:
+        """ Returns the values of the keys
+        """
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value: CachedResponse, ttl: float):
+        """ Stores the value of the key, for ttl seconds
+        """
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        """ Returns the number of entries (None if it is not known)
+        """
+        raise NotImplementedError
+
+    @property
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self).__name__,
+            'size': self.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions
+        }
+
+
+class MemoryBackend(CacheBackend):
+    """ A bounded LRU cache, in the memory of the worker
+
+    The expired entries are removed when they are read, or when they are the
+    least recently used ones.
+    """
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+
+    def lookup(self, key: str) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        return self.lookup(key)
+
+    async def get_many(self, keys: Iterable[str]) -> List[Optional[CachedResponse]]:
+        return [self.lookup(key) for key in keys]
+
+    async def set(self, key: str, value: CachedResponse, ttl: float):
+        if self.max_entries <= 0:
+            return
+
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        self.entries.pop(key, None)
+
+    async def clear(self):
+        self.entries.clear()
+
+    def size(self) -> int:
+        return len(self.entries)
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            **super().stats,
+            'max_entries': self.max_entries
+        }
+
+
+class SQLiteBackend(CacheBackend):
+    """ A cache shared by the workers of a host, in an SQLite database (in
+    WAL mode, memory mapped, and on a tmpfs by default)
+
+    A response is stored in a single transaction, that also removes the
+    expired entries, then the entries that expire first, when the database is
+    larger than max_size bytes. The statements have a short busy timeout :
+    when the database is locked, a read is a miss and a write is skipped.
+
+    The statements run in a thread of each worker, that owns its connection,
+    so that a locked database does not block the event loop. The database is
+    bounded by max_size : the "max_entries" option of the routes does not
+    apply to it.
+    """
+    def __init__(self, path: Optional[str] = None,
+        max_size: int = DEFAULT_MAX_SIZE, timeout: float = 0.05):
+        super().__init__()
+        if path is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') \
+                else tempfile.gettempdir()
+            path = os.path.join(directory, f'halfapi-cache-{os.getuid()}.sqlite')
+
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pid = None
+        self.thread = None
+        self.connection = None
+        self.page_size = None
+        self.entries = None
+        self.counting = None
+
+    def executor(self) -> ThreadPoolExecutor:
+        """ Returns the thread of the current process (the threads and their
+        connections are not shared with the forked workers)
+        """
+        if self.pid != os.getpid():
+            if self.thread is not None:
+                self.thread.shutdown(wait=False)
+            self.pid = os.getpid()
+            self.thread = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='halfapi-cache')
+            self.connection = None
+
+        return self.thread
+
+    async def run(self, fct: Callable, *args) -> Any:
+        """ Returns the result of the function, called in the thread of the
+        connection
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor(), fct, *args)
+
+    def connect(self) -> sqlite3.Connection:
+        """ Returns the connection of the thread, opened and set up once
+        """
+        if self.connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(f'PRAGMA mmap_size={self.max_size * 2}')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)')
+            self.connection = connection
+            self.page_size, = connection.execute('PRAGMA page_size').fetchone()
+
+        return self.connection
+
+    def select(self, keys: List[str]) -> Dict[str, bytes]:
+        connection = self.connect()
+        rows = connection.execute(
+            'SELECT key, value FROM entries WHERE expires > ? AND key IN ({})'.format(
+                ','.join('?' * len(keys))),
+            (time.time(), *keys))
+        return dict(rows)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Iterable[str]) -> List[Optional[CachedResponse]]:
+        keys = list(keys)
+        try:
+            values = await self.run(self.select, keys)
+        except sqlite3.Error as exc:
+            logger.warning('Cache read failed (%s): %s', self.path, exc)
+            values = {}
+
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return [
+            CachedResponse.loads(values[key]) if key in values else None
+            for key in keys
+        ]
+
+    def used_size(self, connection: sqlite3.Connection) -> int:
+        pages, = connection.execute(
+            'SELECT page_count - freelist_count '
+            'FROM pragma_page_count(), pragma_freelist_count()').fetchone()
+        return pages * self.page_size
+
+    def insert(self, key: str, value: bytes, ttl: float):
+        connection = self.connect()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                (key, value, now + ttl))
+            connection.execute('DELETE FROM entries WHERE expires <= ?', (now,))
+            if self.used_size(connection) > self.max_size:
+                # Evicts a tenth of the entries, the ones that expire first
+                evicted = connection.execute(
+                    'DELETE FROM entries WHERE key IN ('
+                    'SELECT key FROM entries ORDER BY expires LIMIT '
+                    '(SELECT COUNT(*) / 10 + 1 FROM entries))').rowcount
+                self.evictions += evicted
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    async def set(self, key: str, value: CachedResponse, ttl: float):
+        try:
+            await self.run(self.insert, key, value.dumps(), ttl)
+        except sqlite3.Error as exc:
+            logger.warning('Cache write failed (%s): %s', self.path, exc)
+
+    def execute(self, statement: str, *args) -> sqlite3.Cursor:
+        return self.connect().execute(statement, args)
+
+    async def delete(self, key: str):
+        await self.run(self.execute, 'DELETE FROM entries WHERE key = ?', key)
+
+    async def clear(self):
+        await self.run(self.execute, 'DELETE FROM entries')
+
+    def count(self) -> int:
+        self.entries = self.connect().execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0]
+        return self.entries
+
+    def size(self) -> Optional[int]:
+        """ Returns the number of entries of the last count (None before the
+        first one), and counts them again in the thread of the connection,
+        without waiting for it
+        """
+        if self.counting is None or self.counting.done():
+            self.counting = self.executor().submit(self.count)
+
+        return self.entries
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            **super().stats,
+            'path': self.path,
+            'max_size': self.max_size
+        }
+
+
+class RedisBackend(CacheBackend):
+    """ A cache shared by the nodes, on a Redis server (or any server of
+    the RESP protocol)
+
+    The concurrent lookups (of the same loop iteration) are a single MGET
+    command. The commands have a short timeout, that includes the wait for
+    the connection : when the server fails, the reads are misses and the
+    writes are skipped, and the server is not queried for retry_interval
+    seconds. The latencies of the last commands are kept for the stats.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, db: int = 0,
+        password: Optional[str] = None, timeout: float = 0.05,
+        prefix: str = 'halfapi:', retry_interval: float = 1):
+        super().__init__()
+        self.client = RESPClient(host, port, db, password, timeout)
+        self.prefix = prefix
+        self.retry_interval = retry_interval
+        self.errors = 0
+        self.retry_at = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        # The keys and futures of the lookups of the next MGET command
+        self.batch: Optional[List[Tuple[str, asyncio.Future]]] = None
+        self.batches = set()
+
+    async def command(self, *args) -> Any:
+        """ Returns the reply of the command, or raises ConnectionError if
+        the server is not available
+        """
+        if self.retry_at > time.monotonic():
+            raise ConnectionError('Cache server unavailable')
+
+        start = time.perf_counter()
+        try:
+            reply = await self.client.execute(*args)
+        except Exception as exc:
+            self.errors += 1
+            self.retry_at = time.monotonic() + self.retry_interval
+            logger.warning('Cache server error (%s:%s): %r',
+                self.client.host, self.client.port, exc)
+            raise ConnectionError('Cache server unavailable') from exc
+
+        self.latencies.append(time.perf_counter() - start)
+        return reply
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        """ Returns the value of the key, read with the keys of the other
+        lookups of the loop iteration
+        """
+        loop = asyncio.get_running_loop()
+        if self.batch is None:
+            self.batch = []
+            task = loop.create_task(self.flush(self.batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+        future = loop.create_future()
+        self.batch.append((key, future))
+        return await future
+
+    async def flush(self, batch: List[Tuple[str, asyncio.Future]]):
+        """ Reads the keys of the batch, and sets the results of its lookups
+        """
+        if self.batch is batch:
+            self.batch = None
+
+        try:
+            values = await self.get_many([key for key, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for (_, future), value in zip(batch, values):
+            if not future.done():
+                future.set_result(value)
+
+    async def get_many(self, keys: Iterable[str]) -> List[Optional[CachedResponse]]:
+        keys = list(keys)
+        try:
+            values = await self.command('MGET', *(self.prefix + key for key in keys))
+        except ConnectionError:
+            values = [None] * len(keys)
+
+        found = []
+        corrupted = []
+        for key, value in zip(keys, values):
+            if value is not None:
+                try:
+                    value = CachedResponse.loads(value)
+                except (struct.error, ValueError):
+                    # Not written by this backend : a miss
+                    corrupted.append(self.prefix + key)
+                    value = None
+            found.append(value)
+
+        if corrupted:
+            try:
+                await self.command('DEL', *corrupted)
+            except ConnectionError:
+                pass
+
+        hits = len(keys) - found.count(None)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    async def set(self, key: str, value: CachedResponse, ttl: float):
+        try:
+            await self.command(
+                'SET', self.prefix + key, value.dumps(), 'PX', max(int(ttl * 1000), 1))
+        except ConnectionError:
+            pass
+
+    async def delete(self, key: str):
+        await self.command('DEL', self.prefix + key)
+
+    async def clear(self):
+        cursor = b'0'
+        while True:
+            cursor, keys = await self.command(
+                'SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 1000)
+            if keys:
+                await self.command('DEL', *keys)
+            if cursor == b'0':
+                break
+
+    def size(self) -> Optional[int]:
+        return None
+
+    @property
+    def stats(self) -> Dict:
+        latencies = sorted(self.latencies)
+        def percentile(ratio):
+            if not latencies:
+                return None
+            return round(latencies[int(ratio * (len(latencies) - 1))] * 1000, 3)
+
+        return {
+            **super().stats,
+            'errors': self.errors,
+            'latency_ms': {
+                'p50': percentile(.5),
+                'p99': percentile(.99),
+                'max': percentile(1)
+            }
+        }
+
+
+class TieredBackend(CacheBackend):
+    """ A local cache (L1) in front of a shared one (L2)
+
+    The values found in the L2 cache are kept local_ttl seconds in the L1
+    cache.
+    """
+    def __init__(self, local: CacheBackend, remote: CacheBackend,
+        local_ttl: float = DEFAULT_LOCAL_TTL):
+        super().__init__()
+        self.local = local
+        self.remote = remote
+        self.local_ttl = local_ttl
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        value = await self.local.get(key)
+        if value is None:
+            value = await self.remote.get(key)
+            if value is not None:
+                await self.local.set(key, value, self.local_ttl)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def get_many(self, keys: Iterable[str]) -> List[Optional[CachedResponse]]:
+        keys = list(keys)
+        values = await self.local.get_many(keys)
+        missing = [index for index, value in enumerate(values) if value is None]
+        if missing:
+            remote_values = await self.remote.get_many([keys[index] for index in missing])
+            for index, value in zip(missing, remote_values):
+                if value is not None:
+                    values[index] = value
+                    await self.local.set(keys[index], value, self.local_ttl)
+
+        hits = len(keys) - values.count(None)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return values
+
+    async def set(self, key: str, value: CachedResponse, ttl: float):
+        await self.local.set(key, value, min(ttl, self.local_ttl))
+        await self.remote.set(key, value, ttl)
+
+    async def delete(self, key: str):
+        await self.local.delete(key)
+        await self.remote.delete(key)
+
+    async def clear(self):
+        await self.local.clear()
+        await self.remote.clear()
+
+    def size(self) -> Optional[int]:
+        return self.local.size()
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            **super().stats,
+            'local': self.local.stats,
+            'remote': self.remote.stats
+        }
+
+
+def memory_backend(max_entries: int) -> CacheBackend:
+    return MemoryBackend(max_entries)
+
+BACKEND_FACTORY: Callable[[int], CacheBackend] = memory_backend
+
+def configure_backend(options: Union[str, Dict, None]):
+    """ Sets the backend of the response caches, with the "cache" project
+    option (the name of the backend, or a dict of its options and its name)
+
+    It applies to the routes created afterwards.
+
+    Examples:
+
+        >>> configure_backend({'backend': 'memory'})
+        >>> configure_backend('lmdb')
+        Traceback (most recent call last):
+        ...
+        ValueError: Unknown cache backend : lmdb
+    """
+    global BACKEND_FACTORY
+
+    if isinstance(options, str):
+        options = {'backend': options}
+    options = dict(options or {})
+    name = options.pop('backend', 'memory')
+
+    if name == 'memory':
+        BACKEND_FACTORY = memory_backend
+    elif name == 'sqlite':
+        shared = SQLiteBackend(**options)
+        BACKEND_FACTORY = lambda max_entries: shared
+    elif name == 'redis':
+        local_ttl = options.pop('local_ttl', DEFAULT_LOCAL_TTL)
+        remote = RedisBackend(**options)
+        BACKEND_FACTORY = lambda max_entries: TieredBackend(
+            MemoryBackend(max_entries), remote, local_ttl)
+    else:
+        raise ValueError(f'Unknown cache backend : {name}')
+
+
+def request_key(name: str, request: Request, key_parts: Iterable[str]) -> str:
+    """ Returns the key of a request, made of the given parts and of the
+    format negotiated with the "Accept" header
+    """
+    parts = [name, accepted_format(request.headers.get('accept', ''))]
+
+    for part in key_parts:
+        if part == 'path':
+            parts.append(repr(sorted(request.path_params.items())))
+        elif part == 'args':
+            parts.append(str(sorted(request.query_params.multi_items())))
+        elif part == 'user':
+            user = request.scope.get('user')
+            parts.append(str(getattr(user, 'id', '')))
+        elif part == 'acl':
+            parts.append(request.scope.get('acl_pass', ''))
+
+    return hashlib.blake2b(
+        '\0'.join(parts).encode(), digest_size=20).hexdigest()
+
+
+class ResponseCache:
+    """ The response cache of a route, for the requests authorized by one of
+    its ACLs
+
+    Attributes:
+        name (str): The name of the cache (route and ACL)
+        ttl (float): The time to live of the responses
+        key_parts (Tuple[str]): The parts of the request in the key
+        backend (CacheBackend): The storage
+    """
+    def __init__(self, name: str, options: Dict,
+        backend: Optional[CacheBackend] = None):
+        self.name = name
+        self.ttl = options.get('ttl', DEFAULT_TTL)
+        self.key_parts = tuple(options.get('key', KEY_PARTS))
+        self.max_entries = options.get('max_entries', DEFAULT_MAX_ENTRIES)
+
+        unknown = set(self.key_parts) - set(KEY_PARTS)
+        if unknown:
+            raise ValueError(f'Unknown cache key parts for {name}: {unknown}')
+
+        if backend is None:
+            backend = BACKEND_FACTORY(self.max_entries)
+
+        if 'max_entries' in options and isinstance(backend, SQLiteBackend):
+            logger.warning(
+                'The max_entries option of %s does not apply to the SQLite '
+                'cache backend, bounded by its max_size', name)
+
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        RESPONSE_CACHES[name] = self
+
+    def key(self, request: Request) -> str:
+        """ Returns the cache key of a request
+        """
+        return request_key(self.name, request, self.key_parts)
+
+    async def get(self, request: Request) -> Tuple[str, Optional[Response]]:
+        """ Returns the key of the request and the cached response (None if it
+        is not in the cache)
+        """
+        key = self.key(request)
+        cached = await self.backend.get(key)
+        if cached is None:
+            self.misses += 1
+            return key, None
+
+        self.hits += 1
+        return key, cached.response()
+
+    async def store(self, key: str, response: Response):
+        """ Stores the response if it can be cached
+        """
+        body = getattr(response, 'body', None)
+        if response.status_code != 200 or not isinstance(body, bytes) \
+            or getattr(response, 'background', None) is not None:
+            return
+
+        await self.backend.set(
+            key,
+            CachedResponse(response.status_code, list(response.raw_headers), body),
+            self.ttl)
+
+    @property
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'ttl': self.ttl,
+            'key': list(self.key_parts),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'backend': self.backend.stats
+        }
+
+
+class Coalescer:
+    """ Runs a single call of a route for the concurrent requests that have
+    the same key (single flight)
+
+    The call runs in its own task, so it is not cancelled when the client
+    of the first request disconnects. The other requests get a copy of its
+    response, or its exception. The streamed responses cannot be shared : the
+    waiting requests then call the route themselves.
+
+    Attributes:
+        calls (int): The number of calls of the route
+        coalesced (int): The number of requests that waited for a call
+        max_waiters (int): The maximum number of requests that waited for a
+            single call
+    """
+    def __init__(self, name: str, options: Union[bool, Dict],
+        public: bool = False):
+        self.name = name
+        if not isinstance(options, dict):
+            options = {}
+        # The requests of different users share a call only if the route is
+        # public, or if the key is explicit
+        default_key = COALESCE_KEY_PARTS if public \
+            else (*COALESCE_KEY_PARTS, 'user')
+        self.key_parts = tuple(options.get('key', default_key))
+
+        unknown = set(self.key_parts) - set(KEY_PARTS)
+        if unknown:
+            raise ValueError(f'Unknown coalescing key parts for {name}: {unknown}')
+
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.waiters: Dict[str, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+        COALESCERS[name] = self
+
+    def key(self, request: Request) -> str:
+        return request_key(self.name, request, self.key_parts)
+
+    def done(self, key: str, task: asyncio.Task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+            del self.waiters[key]
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Response]]) -> Response:
+        """ Returns the response of the call in flight for the key, or of a
+        new call
+        """
+        task = self.in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(call())
+            self.in_flight[key] = task
+            self.waiters[key] = 0
+            task.add_done_callback(lambda task: self.done(key, task))
+            return await asyncio.shield(task)
+
+        self.coalesced += 1
+        self.waiters[key] += 1
+        self.max_waiters = max(self.max_waiters, self.waiters[key])
+
+        response = await asyncio.shield(task)
+        body = getattr(response, 'body', None)
+        if not isinstance(body, bytes) \
+            or getattr(response, 'background', None) is not None:
+            return await call()
+
+        return PrerenderedResponse(body, list(response.raw_headers), response.status_code)
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            'key': list(self.key_parts),
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self.in_flight),
+            'waiters': sum(self.waiters.values()),
+            'max_waiters': self.max_waiters
+        }
+
+
+def response_etag(response: Response) -> Optional[str]:
+    """ Returns the ETag header of a response
+    """
+    for name, value in response.raw_headers:
+        if name == b'etag':
+            return value.decode('latin-1')
+
+    return None
+
+
+class ETagger:
+    """ Sets the ETag header of the responses of a route, from their body
+    or from the version function of the route
+    """
+    def __init__(self, name: str, option: Union[bool, Callable]):
+        self.name = name
+        self.version = option if callable(option) else None
+
+    async def version_tag(self, request: Request) -> str:
+        """ Returns the ETag of the current version of the response
+        """
+        version = self.version(request)
+        if inspect.isawaitable(version):
+            version = await version
+
+        return etag('\0'.join((
+            request_key(self.name, request, KEY_PARTS), str(version)
+        )).encode())
+
+    @staticmethod
+    def tag(response: Response, tag: Optional[str] = None):
+        """ Sets the ETag header of a 200 response (the hash of its body by
+        default, if it is not streamed)
+        """
+        if response.status_code != 200 or response_etag(response) is not None:
+            return
+
+        if tag is None:
+            body = getattr(response, 'body', None)
+            if not isinstance(body, bytes):
+                return
+            tag = etag(body)
+
+        response.raw_headers.append((b'etag', tag.encode('latin-1')))
+
+
+async def cached_call(request: Request, call: Callable[[], Awaitable[Response]],
+    cache: Optional[ResponseCache] = None,
+    coalescer: Optional[Coalescer] = None,
+    etagger: Optional[ETagger] = None) -> Response:
+    """ Returns the response of a GET request, from the cache or from the
+    call of the route (shared with the concurrent requests), or an empty 304
+    response if the "If-None-Match" header of the request matches its ETag
+    """
+    tag = None
+    if etagger is not None and etagger.version is not None:
+        tag = await etagger.version_tag(request)
+        if not_modified(request, tag):
+            return NotModifiedResponse(headers={'etag': tag})
+
+    response = None
+    if cache is not None:
+        key, response = await cache.get(request)
+        if response is not None and tag is not None \
+            and response_etag(response) != tag:
+            # Cached before a change of version
+            response = None
+
+    async def compute() -> Response:
+        response = await call()
+        if etagger is not None:
+            etagger.tag(response, tag)
+        if cache is not None:
+            await cache.store(key, response)
+        return response
+
+    if response is None:
+        if coalescer is None:
+            response = await compute()
+        else:
+            response = await coalescer.run(coalescer.key(request), compute)
+
+    if etagger is not None and response.status_code == 200:
+        response_tag = response_etag(response)
+        if response_tag is not None and not_modified(request, response_tag):
+            return NotModifiedResponse(headers={'etag': response_tag})
+
+    return response
+
+
+RESPONSE_CACHES: Dict[str, ResponseCache] = {}
+COALESCERS: Dict[str, Coalescer] = {}
+
+def response_caches_stats() -> Dict[str, Dict]:
+    """ Returns the statistics of the response caches, by name
+    """
+    return {
+        name: cache.stats
+        for name, cache in RESPONSE_CACHES.items()
+    }
+
+def coalescers_stats() -> Dict[str, Dict]:
+    """ Returns the statistics of the coalescers, by name
+    """
+    return {
+        name: coalescer.stats
+        for name, coalescer in COALESCERS.items()
+    }
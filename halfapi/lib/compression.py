@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Compression module
+
+Encodes the response bodies with the content-codings accepted by the client
+("Accept-Encoding" header) :
+
+    - gzip
+    - br (if the "brotli" package is installed)
+    - zstd (if the "zstandard" package is installed)
+
+The CompressionMiddleware compresses the responses of the routes, according
+to the "compression" table of the "[project]" configuration section :
+
+    [project.compression]
+    algorithm = "zstd"
+    level = 3
+    minimum_size = 1024
+    exclude = ["image/", "application/zip"]
+
+The client gets the configured algorithm if it accepts it, gzip otherwise. The
+responses that are already encoded, smaller than "minimum_size" bytes or whose
+content type starts with an "exclude" item are sent as is. The streamed
+responses are compressed chunk by chunk.
+
+Classes :
+    - CompressionMiddleware
+    - CompressionResponder
+    - StreamCompressor
+
+Functions :
+    - compress
+    - negotiate
+    - timed_compress
+
+Constants :
+    ENCODINGS (Tuple[str]): The available encodings, by order of preference
+"""
+import gzip
+import time
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..logging import logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODINGS: Tuple[str, ...] = tuple(
+    encoding for encoding, module in (
+        ('br', brotli),
+        ('zstd', zstandard),
+        ('gzip', gzip)
+    ) if module is not None
+)
+
+# The levels used for the payloads that are compressed once (the highest
+# brotli and zstd levels are much slower, for no gain on JSON documents)
+STATIC_LEVELS: Dict[str, int] = {
+    'br': 9,
+    'zstd': 9,
+    'gzip': 9
+}
+
+# The levels used for the responses compressed on the fly
+DYNAMIC_LEVELS: Dict[str, int] = {
+    'br': 4,
+    'zstd': 3,
+    'gzip': 6
+}
+
+DEFAULT_MINIMUM_SIZE = 500
+
+# Content types that are already compressed, or that are event streams
+DEFAULT_EXCLUDE: Tuple[str, ...] = (
+    'image/',
+    'video/',
+    'audio/',
+    'application/zip',
+    'application/gzip',
+    'application/x-7z-compressed',
+    'application/vnd.oasis.opendocument.',
+    'application/vnd.openxmlformats-officedocument.',
+    'text/event-stream'
+)
+
+# Bodies larger than this are compressed outside of the event loop
+THREADPOOL_SIZE = 1 << 20
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """ Returns the body encoded with the given content-coding
+
+    Examples:
+
+        >>> gzip.decompress(compress(b'halfapi', 'gzip'))
+        b'halfapi'
+
+    Raises:
+        NotImplementedError: The encoding is not available
+    """
+    if encoding not in ENCODINGS:
+        raise NotImplementedError(f'Unavailable encoding: {encoding}')
+
+    if level is None:
+        level = STATIC_LEVELS[encoding]
+
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: str,
+    available: Tuple[str, ...] = ENCODINGS) -> Optional[str]:
+    """ Returns the preferred encoding of the client among the available ones
+    (None for the identity)
+
+    The results are cached, as clients send a few distinct header values.
+
+    Examples:
+
+        >>> negotiate('gzip, deflate, br', ('br', 'gzip'))
+        'br'
+        >>> negotiate('gzip;q=1.0, br;q=0.5', ('br', 'gzip'))
+        'gzip'
+        >>> negotiate('*;q=0.5, br;q=0', ('br', 'gzip'))
+        'gzip'
+        >>> negotiate('deflate', ('br', 'gzip')) is None
+        True
+    """
+    weights = {}
+    for elt in accept_encoding.lower().split(','):
+        coding, _, params = elt.partition(';')
+        coding = coding.strip()
+        if not coding:
+            continue
+
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+
+        weights[coding] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+
+    return best
+
+
+class StreamCompressor:
+    """ Compresses a body chunk by chunk
+
+    Each compressed chunk is flushed, so that the client can decode the data
+    that was sent.
+
+    Examples:
+
+        >>> compressor = StreamCompressor('gzip')
+        >>> body = compressor.compress(b'half') + compressor.compress(b'api')
+        >>> gzip.decompress(body + compressor.finish())
+        b'halfapi'
+    """
+    def __init__(self, encoding: str, level: Optional[int] = None):
+        if encoding not in ENCODINGS:
+            raise NotImplementedError(f'Unavailable encoding: {encoding}')
+
+        if level is None:
+            level = DYNAMIC_LEVELS[encoding]
+
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == 'br':
+            self.compressor = brotli.Compressor(quality=level)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, chunk: bytes) -> bytes:
+        """ Returns the compressed and flushed chunk
+        """
+        if self.encoding == 'gzip':
+            return self.compressor.compress(chunk) \
+                + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self.compressor.process(chunk) + self.compressor.flush()
+
+        return self.compressor.compress(chunk) \
+            + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        """ Returns the end of the compressed stream
+        """
+        if self.encoding == 'br':
+            return self.compressor.finish()
+
+        return self.compressor.flush()
+
+
+def timed_compress(body: bytes, encoding: str, level: int) -> Tuple[bytes, float]:
+    """ Returns the compressed body and the CPU time of the compression
+    """
+    start = time.thread_time()
+    body = compress(body, encoding, level)
+    return body, time.thread_time() - start
+
+
+class CompressionMiddleware:
+    """ Compresses the responses in the encoding accepted by the client
+
+    If a timing client is given (see halfapi.lib.timing), the compression
+    ratio and CPU time of each response are sent to it as the
+    "halfapi.compression" metric.
+    """
+    def __init__(self, app: ASGIApp, algorithm: str = 'gzip',
+        level: Optional[int] = None, minimum_size: int = DEFAULT_MINIMUM_SIZE,
+        exclude: Iterable[str] = DEFAULT_EXCLUDE, timing_client=None):
+        """
+        Raises:
+            NotImplementedError: The algorithm is not available
+        """
+        if algorithm not in ENCODINGS:
+            raise NotImplementedError(f'Unavailable compression algorithm: {algorithm}')
+
+        self.app = app
+        self.encodings = tuple(dict.fromkeys((algorithm, 'gzip')))
+        self.levels = {
+            encoding: level if encoding == algorithm and level is not None
+                else DYNAMIC_LEVELS[encoding]
+            for encoding in self.encodings
+        }
+        self.minimum_size = minimum_size
+        self.exclude = tuple(elt.lower() for elt in exclude)
+        self.timing_client = timing_client
+
+        logger.info('Compression middleware (encodings=%s levels=%s minimum_size=%s)',
+            self.encodings, self.levels, minimum_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = None
+        for key, value in scope['headers']:
+            if key == b'accept-encoding':
+                encoding = negotiate(value.decode('latin-1'), self.encodings)
+                break
+
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+    def excluded(self, message: Message) -> bool:
+        """ Returns True if the response (its start message) must not be
+        compressed
+        """
+        status = message.get('status', 200)
+        if status < 200 or status in (204, 304):
+            # Responses without a body
+            return True
+
+        for key, value in message.get('headers', ()):
+            if key == b'content-encoding':
+                return True
+            if key == b'content-type' \
+                and value.decode('latin-1').lower().startswith(self.exclude):
+                return True
+            if key == b'content-length' and int(value) < self.minimum_size:
+                return True
+
+        return False
+
+    def report(self, encoding: str, size: int, compressed_size: int,
+        cpu_time: float):
+        if self.timing_client is None:
+            return
+
+        self.timing_client.timing('halfapi.compression', cpu_time, tags=[
+            f'encoding:{encoding}',
+            f'size:{size}',
+            f'compressed_size:{compressed_size}',
+            f'ratio:{compressed_size / size if size else 1:.3f}'
+        ])
+
+
+class CompressionResponder:
+    """ The "send" function of a response, that compresses its body
+    """
+    def __init__(self, middleware: CompressionMiddleware, encoding: str,
+        send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.level = middleware.levels[encoding]
+        self.next_send = send
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[StreamCompressor] = None
+        self.passthrough = False
+        self.size = 0
+        self.compressed_size = 0
+        self.cpu_time = 0.0
+
+    def headers(self, content_length: Optional[int] = None) -> List[Tuple[bytes, bytes]]:
+        """ Returns the headers of the compressed response
+        """
+        headers = []
+        for key, value in self.start_message.get('headers', ()):
+            if key == b'content-length':
+                continue
+            if key == b'etag' and not value.startswith(b'W/'):
+                # The encoded body is not the one the strong ETag refers to
+                value = b'W/' + value
+            headers.append((key, value))
+
+        if content_length is not None:
+            headers.append((b'content-length', str(content_length).encode()))
+
+        headers.append((b'content-encoding', self.encoding.encode()))
+        headers.append((b'vary', b'accept-encoding'))
+        return headers
+
+    async def send(self, message: Message) -> None:
+        if self.passthrough:
+            await self.next_send(message)
+            return
+
+        if message['type'] == 'http.response.start':
+            if self.middleware.excluded(message):
+                self.passthrough = True
+                await self.next_send(message)
+            else:
+                self.start_message = message
+            return
+
+        if message['type'] != 'http.response.body':
+            await self.next_send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.compressor is None:
+            if not more_body:
+                # The whole body is known
+                await self.send_body(body)
+                return
+
+            if not body:
+                # The compression starts with the first chunk of the body
+                return
+
+            self.compressor = StreamCompressor(self.encoding, self.level)
+            await self.next_send({
+                **self.start_message,
+                'headers': self.headers()
+            })
+
+        start = time.thread_time()
+        chunk = self.compressor.compress(body) if body else b''
+        if not more_body:
+            chunk += self.compressor.finish()
+        self.cpu_time += time.thread_time() - start
+
+        self.size += len(body)
+        self.compressed_size += len(chunk)
+
+        if chunk or not more_body:
+            await self.next_send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': more_body
+            })
+
+        if not more_body:
+            self.middleware.report(
+                self.encoding, self.size, self.compressed_size, self.cpu_time)
+
+    async def send_body(self, body: bytes):
+        """ Sends a response whose body is complete
+        """
+        if not body or len(body) < self.middleware.minimum_size:
+            await self.next_send(self.start_message)
+            await self.next_send({'type': 'http.response.body', 'body': body})
+            return
+
+        if len(body) > THREADPOOL_SIZE:
+            compressed, cpu_time = await run_in_threadpool(
+                timed_compress, body, self.encoding, self.level)
+        else:
+            compressed, cpu_time = timed_compress(body, self.encoding, self.level)
+
+        self.middleware.report(self.encoding, len(body), len(compressed), cpu_time)
+
+        await self.next_send({
+            **self.start_message,
+            'headers': self.headers(len(compressed))
+        })
+        await self.next_send({'type': 'http.response.body', 'body': compressed})
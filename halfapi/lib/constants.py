@@ -6,13 +6,31 @@ VERBS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
 
 ITERABLE_STR = Or([ str ], { str }, ( str ))
 
+ROUTE_OPTIONS = {
+    # Route-level options, declared next to the ACL params
+    Optional('executor'): Or('thread', 'loop', 'process'),
+    Optional('process_render'): bool,
+    Optional('concurrent_acls'): bool,
+    Optional('cache'): {
+        Optional('ttl'): Or(int, float),
+        Optional('key'): [Or('path', 'args', 'user', 'acl')],
+        Optional('max_entries'): int
+    },
+    Optional('coalesce'): Or(bool, {
+        Optional('key'): [Or('path', 'args', 'user', 'acl')]
+    }),
+    # True, or the version function of the route (its name in the schemas)
+    Optional('etag'): Or(bool, str, callable)
+}
+
 ACLS_SCHEMA = Schema([{
     'acl': str,
     Optional('args'): {
         Optional('required'): ITERABLE_STR,
         Optional('optional'): ITERABLE_STR
     },
-    Optional('out'): ITERABLE_STR
+    Optional('out'): ITERABLE_STR,
+    **ROUTE_OPTIONS
 }])
 ROUTER_ACLS_SCHEMA = Schema([{
     'acl': lambda n: callable(n),
@@ -20,7 +38,8 @@ ROUTER_ACLS_SCHEMA = Schema([{
         Optional('required'): ITERABLE_STR,
         Optional('optional'): ITERABLE_STR
     },
-    Optional('out'): ITERABLE_STR
+    Optional('out'): ITERABLE_STR,
+    **ROUTE_OPTIONS
 }])
 
 
@@ -44,7 +63,7 @@ DOMAIN_SCHEMA = Schema({
     Optional('version'): str,
     Optional('patch_release'): str,
     Optional('acls'): [
-        [str, str, int, Optional(bool)]
+        [str, str, int, Optional(bool), Optional(dict)]
     ]
 })
 
@@ -5,20 +5,30 @@ lib/domain.py The domain-scoped utility functions
 
 import re
 import sys
+import pickle
 import importlib
 import inspect
-from functools import wraps
+from functools import lru_cache, partial, wraps
 from types import ModuleType, FunctionType
-from typing import Coroutine, Generator
-from typing import Dict, List, Tuple
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Coroutine, \
+    Generator, Iterable, Iterator, Union
+from typing import Dict, List, Optional, Tuple
 import yaml
 
+from starlette.concurrency import run_in_threadpool
 from starlette.exceptions import HTTPException
+from starlette.responses import Response
 
 from halfapi.lib import acl
-from halfapi.lib.responses import ORJSONResponse, ODSResponse, XLSXResponse, PlainTextResponse, HTMLResponse
+from halfapi.lib.responses import ORJSONResponse, PlainTextResponse, \
+    HTMLResponse, JSONStreamResponse, NDJSONResponse, SpreadsheetResponse, \
+    CSVResponse, TSVResponse, MsgPackResponse, CBORResponse, ArrowResponse, \
+    WrittenSpreadsheetResponse
+from halfapi.lib import responses
 # from halfapi.lib.router import read_router
 from halfapi.lib.constants import VERBS
+from halfapi.lib.executor import BoundedProcessPool, get_process_pool, \
+    get_thread_pool, process_call, process_write
 
 from ..logging import logger
 
@@ -52,22 +62,64 @@ class NoDomainsException(Exception):
     """
     pass
 
-def route_decorator(fct: FunctionType) -> Coroutine:
-    """ Returns an async function that can be mounted on a router
+class RouteCallPlan:
+    """ The precompiled call plan of a synchronous route function
+
+    The argument specification of the function is introspected once, when the
+    route is generated, so that the per-request wrapper only has to assemble
+    the arguments dictionary and call the function.
+
+    Attributes:
+        fct (FunctionType): The route function
+        args_spec (frozenset): The names of the function arguments
+        defaults (Dict): The default values of the function arguments
+        halfapi (bool): Inject the "halfapi" argument
+        data (bool): Inject the "data" argument
+        data_default (Dict): The default value of the "data" argument
+        out (bool): Inject the "out" argument
+        ret_type (str): The fixed return type (None if it is read from the
+            "format" argument)
+        renderer (Callable): The renderer of the fixed return type
+        executor (str): Where the function is called ("thread", "loop" or
+            "process")
+        process_render (bool): Render the result in the process pool
+        response_ref (str): The name of the schema component of the route's
+            response, read in its docstring (None if it does not refer to one)
     """
-    @wraps(fct)
-    @acl.args_check
-    async def wrapped(request, *args, **kwargs):
-        fct_args_spec = inspect.getfullargspec(fct).args
-        fct_args_defaults = inspect.getfullargspec(fct).defaults or []
-        fct_args_defaults_dict = dict(list(zip(
-            reversed(fct_args_spec),
-            reversed(fct_args_defaults)
-        )))
-
+    __slots__ = ('fct', 'args_spec', 'defaults', 'halfapi', 'data',
+        'data_default', 'out', 'ret_type', 'renderer', 'executor',
+        'process_render', 'response_ref')
+
+    def __init__(self, fct: FunctionType, params: List[Dict] = None):
+        spec = inspect.getfullargspec(fct)
+
+        self.fct = fct
+        self.args_spec = frozenset(spec.args)
+        self.defaults = dict(zip(
+            reversed(spec.args),
+            reversed(spec.defaults or ())
+        ))
+
+        self.halfapi = 'halfapi' in self.args_spec
+        self.data = 'data' in self.args_spec
+        self.data_default = self.defaults.get('data', {})
+        self.out = 'out' in self.args_spec
+
+        self.ret_type = self.defaults.get('ret_type')
+        self.renderer = None
+        if self.ret_type is not None:
+            self.renderer = RENDERERS.get(self.ret_type)
+
+        self.executor = route_option(params or [], 'executor', 'thread')
+        self.process_render = route_option(params or [], 'process_render', False)
+        self.response_ref = response_schema_ref(fct)
+
+    def arguments(self, request, kwargs: Dict) -> Dict:
+        """ Returns the keyword arguments of the route function for a request
+        """
         fct_args = request.path_params.copy()
 
-        if 'halfapi' in fct_args_spec:
+        if self.halfapi:
             fct_args['halfapi'] = {
                 'user': request.user if
                     'user' in request else None,
@@ -78,61 +130,367 @@ def route_decorator(fct: FunctionType) -> Coroutine:
                 'url': request.url
             }
 
-        if 'data' in fct_args_spec:
-            if 'data' in fct_args_defaults_dict:
-                fct_args['data'] = fct_args_defaults_dict['data']
-            else:
-                fct_args['data'] = {}
-
+        if self.data:
+            fct_args['data'] = dict(self.data_default)
             fct_args['data'].update(kwargs.get('data', {}))
 
-        if 'out' in fct_args_spec:
+        if self.out:
             fct_args['out'] = kwargs.get('out')
 
-        """ If format argument is specified (either by get, post param or function argument)
+        return fct_args
+
+    def negotiated(self, fct_args: Dict) -> bool:
+        """ Returns True if the format is negotiated with the "Accept" header
+        (neither fixed by the route nor given by the "format" argument)
         """
-        if 'ret_type' in fct_args_defaults_dict:
-            ret_type = fct_args_defaults_dict['ret_type']
+        return self.ret_type is None \
+            and not (self.data and 'format' in fct_args['data'])
+
+    def get_renderer(self, fct_args: Dict, out: List[str] = None,
+        accept: str = None, components: Dict = None) -> Callable:
+        """ Returns the renderer of the route's return type
+
+        If format argument is specified (either by get, post param or function
+        argument). Otherwise, the format is negotiated with the "Accept"
+        header (json by default).
+
+        The "out" fields are the header of the tabular formats (csv, tsv, ods,
+        xlsx, arrow). The schema of the arrow format is the one of the route's
+        response in the domain's schema components.
+
+        Raises:
+            NotImplementedError: The return type is not handled
+        """
+        if self.ret_type is not None:
+            renderer = self.renderer
+        elif self.data and 'format' in fct_args['data']:
+            renderer = RENDERERS.get(fct_args['data']['format'])
+        elif accept:
+            renderer = RENDERERS[accepted_format(accept)]
         else:
-            ret_type = fct_args.get('data', {}).get('format', 'json')
+            renderer = RENDERERS['json']
 
-        logger.debug('Return type {} (defaults: {})'.format(ret_type,
-            fct_args_defaults_dict))
-        try:
-            logger.debug('FCT_ARGS***** %s', fct_args)
-            if ret_type == 'json':
-                return ORJSONResponse(fct(**fct_args))
+        if renderer is None:
+            raise NotImplementedError
 
-            if ret_type == 'ods':
-                res = fct(**fct_args)
-                assert isinstance(res, list)
-                for elt in res:
-                    assert isinstance(elt, dict)
+        options = {}
+        if out and renderer in TABULAR_RENDERERS:
+            options['header'] = out
 
-                return ODSResponse(res)
+        if renderer is render_arrow and self.response_ref and components:
+            schema = components.get('schemas', {}).get(self.response_ref)
+            if schema:
+                options['schema'] = schema
 
-            if ret_type == 'xlsx':
-                res = fct(**fct_args)
-                assert isinstance(res, list)
-                for elt in res:
-                    assert isinstance(elt, dict)
+        if options:
+            return partial(renderer, **options)
 
-                return XLSXResponse(res)
+        return renderer
 
-            if ret_type in ['html', 'xhtml']:
-                res = fct(**fct_args)
-                assert isinstance(res, str)
+    def call(self, renderer: Callable, fct_args: Dict) -> Response:
+        """ Calls the route function and renders its result
+        """
+        return renderer(self.fct(**fct_args))
+
+    async def call_in_process(self, pool: BoundedProcessPool,
+        renderer: Callable, fct_args: Dict) -> Response:
+        """ Calls the route function in the process pool and renders its
+        result (in the process pool if the "process_render" option is set, and
+        if the response is not written when it is sent, except for the
+        spreadsheet documents, written in a file by the process pool)
+        """
+        renderer_fct = getattr(renderer, 'func', renderer)
+        if self.process_render and renderer_fct in DOCUMENT_RENDERERS:
+            path, status_code, raw_headers = pickle.loads(
+                await pool.run(process_write, self.fct, fct_args, renderer))
+            return WrittenSpreadsheetResponse(path, status_code, raw_headers)
 
-                return HTMLResponse(res)
+        if not self.process_render or renderer_fct in STREAMED_RENDERERS:
+            return renderer(pickle.loads(
+                await pool.run(process_call, self.fct, fct_args)))
 
-            if ret_type in 'txt':
-                res = fct(**fct_args)
-                assert isinstance(res, str)
+        body, status_code, raw_headers = pickle.loads(
+            await pool.run(process_call, self.fct, fct_args, renderer))
+        response = Response(body, status_code=status_code)
+        response.raw_headers = raw_headers
+        return response
 
-                return PlainTextResponse(res)
 
+def response_schema_ref(fct: FunctionType) -> Optional[str]:
+    """ Returns the name of the schema component of the 200 response (or of
+    its items, for an array), in the YAML docstring of a route function
 
-            raise NotImplementedError
+    Examples:
+
+        >>> def route():
+        ...     '''
+        ...     responses:
+        ...       200:
+        ...         content:
+        ...           application/json:
+        ...             schema:
+        ...               type: array
+        ...               items:
+        ...                 $ref: "#/components/schemas/Pinnochio"
+        ...     '''
+        >>> response_schema_ref(route)
+        'Pinnochio'
+    """
+    try:
+        doc = yaml.safe_load(fct.__doc__ or '')
+    except yaml.YAMLError:
+        return None
+
+    if not isinstance(doc, dict) or not isinstance(doc.get('responses'), dict):
+        return None
+
+    response = doc['responses'].get(200, doc['responses'].get('200'))
+    if not isinstance(response, dict):
+        return None
+
+    for content in (response.get('content') or {}).values():
+        schema = (content or {}).get('schema') or {}
+        if schema.get('type') == 'array':
+            schema = schema.get('items') or {}
+
+        ref = schema.get('$ref', '')
+        if ref.startswith('#/components/schemas/'):
+            return ref[len('#/components/schemas/'):]
+
+    return None
+
+def route_option(params: List[Dict], key: str, default: Any = None) -> Any:
+    """ Returns the value of a route-level option, declared in the ACL params
+    of the route (the first declaration wins)
+
+    Examples:
+
+        >>> route_option([{'acl': None}, {'acl': None, 'executor': 'loop'}], 'executor')
+        'loop'
+
+        >>> route_option([{'acl': None}], 'executor', 'thread')
+        'thread'
+    """
+    for param in params:
+        if key in param:
+            return param[key]
+
+    return default
+
+# The formats that are negotiated with the "Accept" header, by media type
+ACCEPT_FORMATS = {
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/cbor': 'cbor'
+}
+
+def available_formats() -> Dict[str, str]:
+    """ Returns the negotiated formats whose library is installed, by media
+    type
+    """
+    unavailable = set()
+    if responses.msgpack is None:
+        unavailable.add('msgpack')
+    if responses.cbor2 is None:
+        unavailable.add('cbor')
+
+    return {
+        media_type: ret_type
+        for media_type, ret_type in ACCEPT_FORMATS.items()
+        if ret_type not in unavailable
+    }
+
+@lru_cache(maxsize=256)
+def accepted_format(accept: str) -> str:
+    """ Returns the format preferred by the client ("Accept" header), among
+    the negotiated ones (json if none of them is explicitly accepted)
+
+    The results are cached, as clients send a few distinct header values.
+
+    Examples:
+
+        >>> accepted_format('application/msgpack, application/json;q=0.9')
+        'msgpack'
+        >>> accepted_format('text/html, */*')
+        'json'
+    """
+    formats = available_formats()
+    best, best_weight = 'json', 0.0
+    for elt in accept.lower().split(','):
+        media_type, _, params = elt.partition(';')
+        ret_type = formats.get(media_type.strip())
+        if ret_type is None:
+            continue
+
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+
+        if weight > best_weight:
+            best, best_weight = ret_type, weight
+
+    return best
+
+def render_json(res: Any) -> Response:
+    """ Renders the result as JSON (iterators and async iterators are
+    streamed as a JSON array)
+    """
+    if isinstance(res, (Iterator, AsyncIterator)):
+        return JSONStreamResponse(res)
+
+    return ORJSONResponse(res)
+
+def render_ndjson(res: Union[Iterable, AsyncIterable]) -> NDJSONResponse:
+    assert isinstance(res, (Iterable, AsyncIterable)) \
+        and not isinstance(res, (str, bytes, dict))
+
+    return NDJSONResponse(res)
+
+def render_ods(res: Union[Iterable[Dict], AsyncIterable[Dict]],
+    header: List[str] = None) -> SpreadsheetResponse:
+    if isinstance(res, list):
+        for elt in res:
+            assert isinstance(elt, dict)
+
+    return SpreadsheetResponse(res, 'ods', header)
+
+def render_xlsx(res: Union[Iterable[Dict], AsyncIterable[Dict]],
+    header: List[str] = None) -> SpreadsheetResponse:
+    if isinstance(res, list):
+        for elt in res:
+            assert isinstance(elt, dict)
+
+    return SpreadsheetResponse(res, 'xlsx', header)
+
+def render_csv(res: Union[Iterable[Dict], AsyncIterable[Dict]],
+    header: List[str] = None) -> CSVResponse:
+    if isinstance(res, list):
+        for elt in res:
+            assert isinstance(elt, dict)
+
+    return CSVResponse(res, header)
+
+def render_tsv(res: Union[Iterable[Dict], AsyncIterable[Dict]],
+    header: List[str] = None) -> TSVResponse:
+    if isinstance(res, list):
+        for elt in res:
+            assert isinstance(elt, dict)
+
+    return TSVResponse(res, header)
+
+def render_msgpack(res: Any) -> MsgPackResponse:
+    return MsgPackResponse(res)
+
+def render_cbor(res: Any) -> CBORResponse:
+    return CBORResponse(res)
+
+def render_arrow(res: Union[Iterable[Dict], AsyncIterable[Dict]],
+    header: List[str] = None, schema: Dict = None) -> ArrowResponse:
+    if isinstance(res, list):
+        for elt in res:
+            assert isinstance(elt, dict)
+
+    return ArrowResponse(res, header, schema)
+
+def render_html(res: str) -> HTMLResponse:
+    assert isinstance(res, str)
+
+    return HTMLResponse(res)
+
+def render_txt(res: str) -> PlainTextResponse:
+    assert isinstance(res, str)
+
+    return PlainTextResponse(res)
+
+RENDERERS = {
+    'json': render_json,
+    'ndjson': render_ndjson,
+    'ods': render_ods,
+    'xlsx': render_xlsx,
+    'html': render_html,
+    'xhtml': render_html,
+    'txt': render_txt,
+    'csv': render_csv,
+    'tsv': render_tsv,
+    'msgpack': render_msgpack,
+    'cbor': render_cbor,
+    'arrow': render_arrow
+}
+
+# The renderers of tabular data, whose header is the "out" fields of the route
+# if they are set
+TABULAR_RENDERERS = {
+    render_ods,
+    render_xlsx,
+    render_csv,
+    render_tsv,
+    render_arrow
+}
+
+# The renderers whose responses are written when they are sent (they cannot
+# be rendered in the process pool, except the documents)
+STREAMED_RENDERERS = {
+    render_ndjson,
+    render_ods,
+    render_xlsx,
+    render_csv,
+    render_tsv,
+    render_arrow
+}
+
+# The renderers of documents written in a file before they are sent (the file
+# can be written in the process pool)
+DOCUMENT_RENDERERS = {
+    render_ods,
+    render_xlsx
+}
+
+
+def route_decorator(fct: FunctionType, params: List[Dict] = None) -> Coroutine:
+    """ Returns an async function that can be mounted on a router
+
+    The function is called in the thread pool of the request's domain, unless
+    the "executor" option of the route is "loop" or "process".
+    """
+    plan = RouteCallPlan(fct, params)
+
+    @wraps(fct)
+    @acl.args_check
+    async def wrapped(request, *args, **kwargs):
+        fct_args = plan.arguments(request, kwargs)
+
+        try:
+            renderer = plan.get_renderer(fct_args, kwargs.get('out'),
+                request.headers.get('accept'),
+                getattr(request.scope.get('app'), 'schema_components', None))
+
+            response = None
+            if plan.executor == 'loop':
+                response = plan.call(renderer, fct_args)
+
+            elif plan.executor == 'process':
+                pool = get_process_pool(request.scope.get('domain'))
+                if pool is not None:
+                    response = await plan.call_in_process(pool, renderer, fct_args)
+
+            if response is None:
+                pool = get_thread_pool(request.scope.get('domain'))
+                if pool is None:
+                    response = await run_in_threadpool(plan.call, renderer, fct_args)
+                else:
+                    response = await pool.run(plan.call, renderer, fct_args)
+
+            if plan.negotiated(fct_args):
+                # The format depends on the "Accept" header
+                response.raw_headers.append((b'vary', b'accept'))
+
+            return response
 
         except NotImplementedError as exc:
             raise HTTPException(501) from exc
@@ -143,6 +501,8 @@ def route_decorator(fct: FunctionType) -> Coroutine:
                 raise HTTPException(500) from exc
             raise exc
 
+    wrapped.plan = plan
+
     return wrapped
 
 
@@ -1,80 +1,102 @@
 """
 DomainMiddleware
 """
-from starlette.datastructures import URL
-from starlette.middleware.base import (BaseHTTPMiddleware,
-    RequestResponseEndpoint)
-from starlette.requests import Request
-from starlette.responses import Response
+from typing import Dict, List, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from ..logging import logger
 
-class DomainMiddleware(BaseHTTPMiddleware):
+def acl_headers(param: Dict) -> List[Tuple[bytes, bytes]]:
+    """ Returns the raw http headers of a route's ACL param
+
+    They are computed when the route is built, and are sent by the
+    DomainMiddleware when the ACL is the one that passed :
+
+        - x-acl
+        - x-args-required
+        - x-args-optional
+        - x-out
+
+    Examples:
+
+        >>> from halfapi.lib.acl import public
+        >>> acl_headers({'acl': public, 'args': {'required': ['foo']}, 'out': ['id']})
+        [(b'x-acl', b'public'), (b'x-args-required', b'foo'), (b'x-out', b'id')]
+    """
+    headers = [(b'x-acl', param['acl'].__name__.encode())]
+
+    args = param.get('args', {})
+    if len(args.get('required', set())):
+        headers.append((b'x-args-required', ','.join(args['required']).encode()))
+    if len(args.get('optional', set())):
+        headers.append((b'x-args-optional', ','.join(args['optional']).encode()))
+
+    if len(param.get('out', set())):
+        headers.append((b'x-out', ','.join(param['out']).encode()))
+
+    return headers
+
+class DomainMiddleware:
     """
-    DomainMiddleware adds the api routes and acls to the following scope keys :
+    DomainMiddleware adds the domain name and config to the following scope
+    keys :
 
-        - api
-        - acl
+        - domain
+        - config
+
+    And appends the "x-domain" header and the headers of the ACL that passed
+    ("acl_headers" scope key) to the response.
     """
 
-    def __init__(self, app, domain=None):
+    def __init__(self, app: ASGIApp, domain=None):
         """ app: HalfAPI instance
         """
         logger.info('DomainMiddleware app:%s domain:%s', app, domain)
-        super().__init__(app)
+        self.app = app
         self.domain = domain
-        self.request = None
+        self.domain_header = (b'x-domain', domain['name'].encode())
 
 
-    async def dispatch(self, request: Request,
-        call_next: RequestResponseEndpoint) -> Response:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         Call of the route fonction (decorated or not)
         """
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
 
-        request.scope['domain'] = self.domain['name']
-        if hasattr(request.app, 'config') \
-          and isinstance(request.app.config, dict):
+        scope['domain'] = self.domain['name']
+        app = scope.get('app')
+        if isinstance(getattr(app, 'config', None), dict):
             # Set the config scope to the domain's config
-            request.scope['config'] = request.app.config.get(
+            scope['config'] = app.config.get(
                 'domain', {}
             ).get(
                 self.domain['name'], {}
             ).copy()
 
             # TODO: Remove in 0.7.0
-            config = request.scope['config'].copy()
-            request.scope['config']['domain'] = {}
-            request.scope['config']['domain'][self.domain['name']] = {}
-            request.scope['config']['domain'][self.domain['name']]['config'] = config
-            
-
+            config = scope['config'].copy()
+            scope['config']['domain'] = {}
+            scope['config']['domain'][self.domain['name']] = {}
+            scope['config']['domain'][self.domain['name']]['config'] = config
 
         else:
-            logger.debug('%s', request.app)
-            logger.debug('%s', getattr(request.app, 'config', None))
-
-        response = await call_next(request)
-
-        if 'acl_pass' in request.scope:
-            # Set the http header "x-acl" if an acl was used on the route
-            response.headers['x-acl'] = request.scope['acl_pass']
-
-        if 'args' in request.scope:
-            # Set the http headers "x-args-required" and "x-args-optional"
-
-            if len(request.scope['args'].get('required', set())):
-                response.headers['x-args-required'] = \
-                    ','.join(request.scope['args']['required'])
-            if len(request.scope['args'].get('optional', set())):
-                response.headers['x-args-optional'] = \
-                    ','.join(request.scope['args']['optional'])
-
-        if len(request.scope.get('out', set())):
-            response.headers['x-out'] = \
-                ','.join(request.scope['out'])
-
-
-        response.headers['x-domain'] = self.domain['name']
-
-        return response
+            logger.debug('%s', app)
+            logger.debug('%s', getattr(app, 'config', None))
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                message = {
+                    **message,
+                    'headers': [
+                        *message.get('headers', ()),
+                        *scope.get('acl_headers', ()),
+                        self.domain_header
+                    ]
+                }
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Executor module
+
+Runs the synchronous route functions outside of the event loop, so that a
+route doing DB or file work does not stall the other requests of the worker.
+
+Each domain has its own pools, configured in the "[domain.X]" section of the
+configuration file :
+
+    [domain.domain_name]
+    thread_pool_size = 8
+    thread_pool_queue = 64
+    process_pool_size = 4
+
+The "executor" option, declared next to the ACL params of a route, selects
+where the route function is called :
+
+    - "thread" (default) : in the thread pool of the domain
+    - "loop" : on the event loop
+    - "process" : in the process pool of the domain, for CPU-bound routes. The
+      rendering step is also done in the process pool if the route has the
+      "'process_render': True" option (the ODS and XLSX documents are
+      written in a temporary file, then streamed by the worker).
+
+Classes :
+    - BoundedPool
+    - BoundedThreadPool
+    - BoundedProcessPool
+
+Functions :
+    - configure_thread_pool
+    - configure_process_pool
+    - get_thread_pool
+    - get_process_pool
+    - process_call
+    - process_write
+
+Exception :
+    - UnpicklableResultError
+"""
+import asyncio
+import contextvars
+import importlib
+import os
+import pickle
+import tempfile
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from starlette.exceptions import HTTPException
+
+from ..logging import logger
+
+DEFAULT_THREAD_POOL_QUEUE = 128
+DEFAULT_PROCESS_POOL_QUEUE = 128
+
+class UnpicklableResultError(Exception):
+    """ Exception to use when the result of a function called in the process
+    pool cannot be sent back to the worker
+    """
+    pass
+
+class BoundedPool:
+    """ An executor that refuses the calls (503 status code) when more than
+    "workers + queue_size" calls are pending
+
+    Attributes:
+        max_workers (Optional[int]): The configured number of workers
+        workers (int): The number of workers of the executor
+    """
+    def __init__(self, executor: Executor, max_workers: Optional[int],
+        queue_size: int, workers: int):
+        self.executor = executor
+        self.max_workers = max_workers
+        self.workers = workers
+        self.queue_size = queue_size
+        self.limit = workers + queue_size
+        self.pending = 0
+
+    def submit(self, fct: Callable, *args, **kwargs) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(fct, *args, **kwargs))
+
+    async def run(self, fct: Callable, *args, **kwargs) -> Any:
+        """ Calls fct in the pool and returns its result
+
+        Raises:
+            HTTPException: 503 if the pool queue is full
+        """
+        if self.pending >= self.limit:
+            logger.warning('Pool queue is full (%s pending calls)', self.pending)
+            raise HTTPException(503)
+
+        self.pending += 1
+        try:
+            return await self.submit(fct, *args, **kwargs)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self, wait: bool = False):
+        self.executor.shutdown(wait=wait)
+
+
+class BoundedThreadPool(BoundedPool):
+    """ The thread pool of a domain
+    """
+    def __init__(self, name: str, max_workers: Optional[int] = None,
+        queue_size: int = DEFAULT_THREAD_POOL_QUEUE):
+        # The default of ThreadPoolExecutor
+        workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        super().__init__(
+            ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix=f'halfapi-{name}'),
+            max_workers,
+            queue_size,
+            workers)
+
+    def submit(self, fct: Callable, *args, **kwargs) -> asyncio.Future:
+        context = contextvars.copy_context()
+        return super().submit(context.run, fct, *args, **kwargs)
+
+
+class BoundedProcessPool(BoundedPool):
+    """ The process pool of a domain
+
+    The domain module is imported by each process when it starts.
+    """
+    def __init__(self, name: str, module: str, max_workers: Optional[int] = None,
+        queue_size: int = DEFAULT_PROCESS_POOL_QUEUE):
+        self.module = module
+        # The default of ProcessPoolExecutor
+        workers = max_workers or os.cpu_count() or 1
+        super().__init__(
+            ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=importlib.import_module,
+                initargs=(module,)),
+            max_workers,
+            queue_size,
+            workers)
+
+    def warmup(self):
+        """ Starts the processes of the pool, without waiting for them
+        """
+        for _ in range(self.workers):
+            self.executor.submit(int)
+
+
+def process_call(fct: Callable, fct_args: Dict, renderer: Callable = None) -> bytes:
+    """ Calls the route function (and renders its result if a renderer is
+    given) in a process of the pool
+
+    A generator (or any iterator) result is read entirely in the process, as
+    it cannot be sent back to the worker : it is rendered as a list.
+
+    Returns:
+        bytes: The pickled result, or the pickled (body, status_code,
+        raw_headers) tuple of the rendered response
+
+    Raises:
+        UnpicklableResultError: The result cannot be pickled
+    """
+    res = fct(**fct_args)
+    if isinstance(res, Iterator):
+        res = list(res)
+
+    if renderer is not None:
+        response = renderer(res)
+        res = (response.body, response.status_code, response.raw_headers)
+
+    try:
+        return pickle.dumps(res, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as exc:
+        raise UnpicklableResultError(
+            f'The result of {fct.__module__}:{fct.__qualname__} cannot be '
+            f'sent back from the process pool ({type(res).__name__}: {exc})'
+        ) from None
+
+
+def process_write(fct: Callable, fct_args: Dict, renderer: Callable) -> bytes:
+    """ Calls the route function and writes its rendered document (a
+    SpreadsheetResponse) in a temporary file, in a process of the pool
+
+    The document is sent by the worker, that removes the file.
+
+    Returns:
+        bytes: The pickled (path, status_code, raw_headers) tuple
+    """
+    response = renderer(fct(**fct_args))
+    with tempfile.NamedTemporaryFile(prefix='halfapi-', delete=False) as document:
+        try:
+            response.write(document)
+        except BaseException:
+            os.unlink(document.name)
+            raise
+
+    return pickle.dumps(
+        (document.name, response.status_code, response.raw_headers),
+        protocol=pickle.HIGHEST_PROTOCOL)
+
+
+THREAD_POOLS: Dict[str, BoundedThreadPool] = {}
+PROCESS_POOLS: Dict[str, BoundedProcessPool] = {}
+
+def configure_thread_pool(name: str, max_workers: Optional[int] = None,
+    queue_size: Optional[int] = None) -> BoundedThreadPool:
+    """ Creates the thread pool of a domain (or returns the current one if it
+    has the same settings)
+    """
+    if queue_size is None:
+        queue_size = DEFAULT_THREAD_POOL_QUEUE
+
+    pool = THREAD_POOLS.get(name)
+    if pool is not None:
+        if (pool.max_workers, pool.queue_size) == (max_workers, queue_size):
+            return pool
+        pool.shutdown()
+
+    logger.info('Thread pool for domain %s (max_workers=%s queue_size=%s)',
+        name, max_workers, queue_size)
+    THREAD_POOLS[name] = BoundedThreadPool(name, max_workers, queue_size)
+    return THREAD_POOLS[name]
+
+def configure_process_pool(name: str, module: str,
+    max_workers: Optional[int] = None,
+    queue_size: Optional[int] = None) -> BoundedProcessPool:
+    """ Creates the process pool of a domain (or returns the current one if it
+    has the same settings)
+    """
+    if queue_size is None:
+        queue_size = DEFAULT_PROCESS_POOL_QUEUE
+
+    pool = PROCESS_POOLS.get(name)
+    if pool is not None:
+        if (pool.module, pool.max_workers, pool.queue_size) \
+            == (module, max_workers, queue_size):
+            return pool
+        pool.shutdown()
+
+    logger.info('Process pool for domain %s (module=%s max_workers=%s queue_size=%s)',
+        name, module, max_workers, queue_size)
+    PROCESS_POOLS[name] = BoundedProcessPool(name, module, max_workers, queue_size)
+    return PROCESS_POOLS[name]
+
+def get_thread_pool(name: str) -> Optional[BoundedThreadPool]:
+    """ Returns the thread pool of a domain (None if it is not configured)
+    """
+    return THREAD_POOLS.get(name)
+
+def get_process_pool(name: str) -> Optional[BoundedProcessPool]:
+    """ Returns the process pool of a domain (None if it is not configured)
+    """
+    return PROCESS_POOLS.get(name)
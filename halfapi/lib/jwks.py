@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+JWKS module
+
+Reads the keys that verify the tokens from a local JWKS file (RFC 7517), set
+in the "jwks" option of the "[project]" configuration section :
+
+    [project]
+    jwks = /etc/half_api/jwks.json
+
+The keys (HS256, RS256, EdDSA, ...) are indexed by their "kid", and the file
+is reloaded when it is modified, so that the keys can be rotated without
+restarting the workers.
+
+Classes :
+    - KeySet
+
+Functions :
+    - prepare_key
+"""
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+import orjson
+from jwt.algorithms import get_default_algorithms
+
+from ..logging import logger
+
+def prepare_key(key: Any, algorithm: str) -> Any:
+    """ Returns the key object of a secret or PEM encoded key, so that it is
+    not parsed each time a token is verified
+
+    Examples:
+
+        >>> prepare_key('secret', 'HS256')
+        b'secret'
+    """
+    return get_default_algorithms()[algorithm].prepare_key(key)
+
+def jwk_algorithm(jwk: jwt.PyJWK) -> str:
+    """ Returns the name of the algorithm of a PyJWK object
+    """
+    name = getattr(jwk, 'algorithm_name', None)
+    if name is not None:
+        return name
+
+    # PyJWT < 2.8
+    return next(
+        name for name, algorithm in jwk._algorithms.items()
+        if algorithm is jwk.Algorithm)
+
+class KeySet:
+    """ The keys of a JWKS file, indexed by "kid"
+
+    Attributes:
+        path (str): The JWKS file path
+        check_interval (float): Minimum delay, in seconds, between two checks
+            of the file's modification time
+        keys (Dict[str, Tuple[Any, str]]): The key objects and their algorithm,
+            by key id
+        version (int): Incremented each time the file is loaded
+    """
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.keys: Dict[str, Tuple[Any, str]] = {}
+        self.version = 0
+        self.checked = time.monotonic()
+
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.load()
+
+    def load(self):
+        """ Reads the JWKS file and builds the key objects
+
+        Raises:
+            jwt.PyJWKError: The file contains an invalid key
+        """
+        with open(self.path, 'rb') as jwks_file:
+            jwks = orjson.loads(jwks_file.read())
+
+        keys = {}
+        for jwk_data in jwks.get('keys', []):
+            kid = jwk_data.get('kid')
+            if kid is None:
+                logger.warning('Ignoring a key without "kid" in %s', self.path)
+                continue
+
+            jwk = jwt.PyJWK(jwk_data)
+            keys[kid] = (jwk.key, jwk_algorithm(jwk))
+
+        self.keys = keys
+        self.version += 1
+        logger.info('Loaded %s keys from %s (version %s)',
+            len(keys), self.path, self.version)
+
+    def refresh(self):
+        """ Reloads the JWKS file if it was modified since the last load
+
+        The file is checked at most once every "check_interval" seconds. If it
+        cannot be read, the current keys are kept.
+        """
+        now = time.monotonic()
+        if now - self.checked < self.check_interval:
+            return
+
+        self.checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self.mtime:
+                self.load()
+                self.mtime = mtime
+        except (OSError, ValueError, jwt.PyJWTError) as exc:
+            logger.error('Cannot reload the JWKS file %s : %s', self.path, exc)
+
+    def get(self, kid: str) -> Optional[Tuple[Any, str]]:
+        """ Returns the key object and its algorithm for a key id
+        """
+        return self.keys.get(kid)
@@ -3,14 +3,19 @@ JWT Middleware module
 
 Classes:
     - JWTUser : goes in request.user
+    - TokenCache
     - JWTAuthenticationBackend
     - JWTWebSocketAuthenticationBackend
+    - LazyAuthScope
+    - JWTAuthenticationMiddleware
 
 Raises:
     Exception: If configuration has no SECRET
 """
 
+from collections import OrderedDict
 from os import environ
+import time
 import typing
 from uuid import UUID
 
@@ -21,7 +26,9 @@ from starlette.authentication import (
     UnauthenticatedUser)
 from starlette.requests import HTTPConnection, Request
 from starlette.exceptions import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from .jwks import KeySet, prepare_key
 from .user import CheckUser, JWTUser, Nobody
 from ..logging import logger
 from ..conf import CONFIG
@@ -50,23 +57,143 @@ def on_auth_error(request: Request, exc: Exception):
     response.delete_cookie('Authorization')
     return response
 
+class TokenCache:
+    """ Bounded LRU cache of the verified JWT payloads, keyed by token
+
+    An entry is evicted when the token expires ("exp" claim), so that an
+    expired token is decoded again (and refused).
+
+    Attributes:
+        maxsize (int): The maximum number of entries (0 disables the cache)
+        hits (int): The number of tokens found in the cache
+        misses (int): The number of tokens that had to be decoded
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> typing.Optional[typing.Dict]:
+        """ Returns a copy of the cached payload of the token (None if the token
+        is not in the cache or has expired)
+        """
+        entry = self.entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        payload, exp = entry
+        if exp is not None and exp <= time.time():
+            del self.entries[token]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(token)
+        self.hits += 1
+        return dict(payload)
+
+    def set(self, token: str, payload: typing.Dict):
+        if self.maxsize <= 0:
+            return
+
+        exp = payload.get('exp')
+        self.entries[token] = (dict(payload), float(exp) if exp is not None else None)
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    @property
+    def stats(self) -> typing.Dict:
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
 class JWTAuthenticationBackend(AuthenticationBackend):
+    """ Authenticates the requests with the JWT of their "Authorization" header
+    or cookie
+
+    The token is verified with the key of the keyset that has the "kid" of its
+    header, or with the secret key if it has no "kid".
+    """
     def __init__(self, secret_key: str = SECRET,
-        algorithm: str = 'HS256', prefix: str = 'JWT'):
+        algorithm: str = 'HS256', prefix: str = 'JWT',
+        cache_size: int = 1024, keyset: KeySet = None):
 
-        if secret_key is None:
+        if secret_key is None and keyset is None:
             raise Exception('Missing secret_key argument for JWTAuthenticationBackend')
         self.secret_key = secret_key
         self.algorithm = algorithm
         self.prefix = prefix
+        self.cache = TokenCache(cache_size)
+        self.keyset = keyset
+        self.keyset_version = keyset.version if keyset is not None else None
+        self.key = prepare_key(secret_key, algorithm) \
+            if secret_key is not None else None
 
     @property
     def id(self) -> str:
         return self.__id
 
+    def decode(self, token: str) -> typing.Dict:
+        """ Returns the payload of the token, verified or read from the cache
+        """
+        if self.keyset is not None:
+            self.keyset.refresh()
+            if self.keyset.version != self.keyset_version:
+                # The keys were rotated
+                self.keyset_version = self.keyset.version
+                self.cache.clear()
+
+        payload = self.cache.get(token)
+        if payload is None:
+            key, algorithm = self.verification_key(token)
+            payload = jwt.decode(token,
+                key=key,
+                algorithms=[algorithm],
+                options={
+                    'verify_signature': True
+                })
+            self.cache.set(token, payload)
+
+        return payload
+
+    def verification_key(self, token: str) -> typing.Tuple[typing.Any, str]:
+        """ Returns the key object and the algorithm that verify the token
+
+        Raises:
+            jwt.InvalidTokenError: The token's key id is unknown
+        """
+        if self.keyset is not None:
+            kid = jwt.get_unverified_header(token).get('kid')
+            if kid is not None:
+                key = self.keyset.get(kid)
+                if key is None:
+                    raise jwt.InvalidTokenError(f'Unknown key id: {kid}')
+                return key
+
+        if self.key is None:
+            raise jwt.InvalidTokenError('Missing key id')
+
+        return self.key, self.algorithm
+
     async def authenticate(
         self, conn: HTTPConnection
     ) -> typing.Optional[typing.Tuple['AuthCredentials', 'BaseUser']]:
+        return self.resolve(conn)
+
+    def resolve(
+        self, conn: HTTPConnection
+    ) -> typing.Tuple['AuthCredentials', 'BaseUser']:
+        """ Synchronous version of "authenticate", used to resolve the user
+        when it is read for the first time (see LazyAuthScope)
+        """
 
         # Standard way to authenticate via API
         # https://datatracker.ietf.org/doc/html/rfc7235#section-4.2
@@ -84,16 +211,11 @@ class JWTAuthenticationBackend(AuthenticationBackend):
 
         try:
             if token:
-                payload = jwt.decode(token,
-                    key=self.secret_key,
-                    algorithms=[self.algorithm],
-                    options={
-                        'verify_signature': True
-                    })
+                payload = self.decode(token)
 
             if is_check_call:
                 if token:
-                    return AuthCredentials(), CheckUser(payload['user_id'])
+                    return AuthCredentials(), CheckUser(payload['user_id'], payload)
 
                 return AuthCredentials(), Nobody()
 
@@ -160,3 +282,95 @@ class JWTWebSocketAuthenticationBackend(AuthenticationBackend):
                 token=token,
                 payload=payload)
         )
+
+
+class LazyAuthScope(dict):
+    """ ASGI scope whose "auth" and "user" keys are resolved by the
+    authentication backend when one of them is read for the first time
+
+    The routes that never read "request.user" (i.e. the routes that are only
+    protected by public ACLs) do not pay for the cookie parsing and the token
+    decoding.
+    """
+    AUTH_KEYS = ('auth', 'user')
+
+    def __init__(self, scope: Scope, backend: JWTAuthenticationBackend):
+        super().__init__(scope)
+        self.backend = backend
+        # The application that received the request (its "debug" attribute
+        # tells if a debug token is accepted)
+        self.app = scope.get('app')
+
+    def resolve(self):
+        conn = HTTPConnection({**self, 'app': self.app})
+        self['auth'], self['user'] = self.backend.resolve(conn)
+
+    def __missing__(self, key):
+        if key not in self.AUTH_KEYS:
+            raise KeyError(key)
+
+        self.resolve()
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key) -> bool:
+        return key in self.AUTH_KEYS or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        if key in self.AUTH_KEYS:
+            return self[key]
+
+        return dict.get(self, key, default)
+
+
+class JWTAuthenticationMiddleware:
+    """ Authentication middleware that resolves the user lazily
+
+    It replaces starlette's AuthenticationMiddleware : the "user" and "auth"
+    scope keys are resolved by the backend when the application reads them. If
+    the resolution fails, the response of the "on_error" function is sent
+    instead of the application's one.
+
+    The resolution happens in the routes, so the Starlette applications that
+    are mounted under this middleware should handle the AuthenticationError
+    exceptions themselves (exception_handlers={AuthenticationError: on_auth_error}),
+    otherwise their ServerErrorMiddleware answers with a 500 status code.
+    """
+    def __init__(self, app: ASGIApp, backend: JWTAuthenticationBackend,
+        on_error: typing.Callable = on_auth_error):
+        self.app = app
+        self.backend = backend
+        self.on_error = on_error
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] not in ('http', 'websocket'):
+            await self.app(scope, receive, send)
+            return
+
+        scope = LazyAuthScope(scope, self.backend)
+
+        if scope['type'] == 'websocket':
+            try:
+                scope.resolve()
+            except AuthenticationError:
+                await send({'type': 'websocket.close', 'code': 1000})
+                return
+
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except AuthenticationError as exc:
+            if response_started:
+                raise exc
+
+            response = self.on_error(HTTPConnection(scope), exc)
+            await response(scope, receive, send)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+RESP module
+
+A minimal asyncio client of the Redis serialization protocol (RESP2), used by
+the remote cache backend. The commands are pipelined : the requests of a call
+are written at once, then their replies are read in order.
+
+Classes :
+    - RESPError
+    - RESPClient
+
+Functions :
+    - encode_command
+"""
+import asyncio
+import os
+from typing import Any, List, Optional, Sequence, Union
+
+Arg = Union[bytes, str, int, float]
+
+class RESPError(Exception):
+    """ An error reply of the server
+    """
+
+
+def encode_command(*args: Arg) -> bytes:
+    """ Returns the RESP array of bulk strings of a command
+
+    Examples:
+
+        >>> encode_command('SET', 'key', b'value', 'PX', 1000)
+        b'*5\\r\\n$3\\r\\nSET\\r\\n$3\\r\\nkey\\r\\n$5\\r\\nvalue\\r\\n$2\\r\\nPX\\r\\n$4\\r\\n1000\\r\\n'
+    """
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n' % len(arg))
+        parts.append(arg)
+        parts.append(b'\r\n')
+
+    return b''.join(parts)
+
+
+class RESPClient:
+    """ A connection to a RESP server, opened on the first command
+
+    The connection belongs to the event loop (and the process) that opened
+    it. It is closed after an error or a timeout, as its state is unknown,
+    and reopened by the next command.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, db: int = 0,
+        password: Optional[str] = None, timeout: float = 0.05):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.loop = None
+        self.pid = None
+        self.lock = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        commands = []
+        if self.password is not None:
+            commands.append(('AUTH', self.password))
+        if self.db:
+            commands.append(('SELECT', self.db))
+        if commands:
+            try:
+                await self.exchange(commands)
+            except BaseException:
+                # An error reply of AUTH or SELECT leaves the connection
+                # unauthenticated or on the wrong database
+                self.close()
+                raise
+
+    def close(self):
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except RuntimeError:
+                # The loop of the connection is closed
+                pass
+        self.reader = self.writer = None
+
+    async def read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection closed by the server')
+
+        kind, value = line[:1], line[1:-2]
+        if kind == b'+':
+            return value
+        if kind == b'-':
+            return RESPError(value.decode())
+        if kind == b':':
+            return int(value)
+        if kind == b'$':
+            length = int(value)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(value)
+            if length < 0:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+
+        raise ConnectionError(f'Invalid reply : {line!r}')
+
+    async def exchange(self, commands: Sequence[Sequence[Arg]]) -> List[Any]:
+        self.writer.write(b''.join(encode_command(*command) for command in commands))
+        await self.writer.drain()
+        replies = [await self.read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RESPError):
+                raise reply
+
+        return replies
+
+    async def pipeline(self, commands: Sequence[Sequence[Arg]]) -> List[Any]:
+        """ Returns the replies of the commands, sent in a single write
+
+        The timeout includes the wait for the connection, used by the
+        previous commands.
+
+        Raises asyncio.TimeoutError if the replies are not read within the
+        timeout, OSError if the connection fails and RESPError on the error
+        replies.
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop or self.pid != os.getpid():
+            self.close()
+            self.loop = loop
+            self.pid = os.getpid()
+            self.lock = asyncio.Lock()
+
+        return await asyncio.wait_for(self.send(commands), self.timeout)
+
+    async def send(self, commands: Sequence[Sequence[Arg]]) -> List[Any]:
+        async with self.lock:
+            try:
+                if self.writer is None:
+                    await self.connect()
+
+                return await self.exchange(commands)
+            except RESPError:
+                raise
+            except BaseException:
+                # The state of the connection is unknown (a timeout while
+                # waiting for the lock leaves it open)
+                self.close()
+                raise
+
+    async def execute(self, *args: Arg) -> Any:
+        """ Returns the reply of a command
+        """
+        return (await self.pipeline([args]))[0]
@@ -5,41 +5,95 @@
 Contains some base response classes
 
 Classes :
+    - ArrowResponse
+    - CBORResponse
+    - CSVResponse
     - HJSONResponse
     - InternalServerErrorResponse
+    - IteratorResponse
+    - JSONStreamResponse
+    - MsgPackResponse
+    - NDJSONResponse
     - NotFoundResponse
     - NotImplementedResponse
+    - NotModifiedResponse
     - ORJSONResponse
     - PlainTextResponse
+    - PrerenderedJSON
+    - PrerenderedResponse
     - ServiceUnavailableResponse
+    - SpreadsheetResponse
+    - TSVResponse
     - UnauthorizedResponse
+    - WrittenSpreadsheetResponse
     - ODSResponse
 
+Functions :
+    - binary_default
+    - binary_cast
+    - etag
+    - not_modified
+
 """
-from datetime import date
+import csv
+import dataclasses
 import decimal
+import hashlib
+import os
+import tempfile
 import typing
-from io import BytesIO
+from datetime import date, datetime, time
+from enum import Enum
+from io import BytesIO, StringIO
+from uuid import UUID
 import orjson
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
 # asgi framework
-from starlette.responses import PlainTextResponse, Response, JSONResponse, HTMLResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse, Response, JSONResponse, \
+    HTMLResponse, StreamingResponse
 from starlette.requests import Request
 from starlette.exceptions import HTTPException
 
+from . import arrow, compression, spreadsheet
+from .executor import get_thread_pool
 from .user import JWTUser, Nobody
 from ..logging import logger
 
 
 __all__ = [
+    'ArrowResponse',
+    'CBORResponse',
+    'CSVResponse',
     'HJSONResponse',
     'InternalServerErrorResponse',
+    'IteratorResponse',
+    'JSONStreamResponse',
+    'MsgPackResponse',
+    'NDJSONResponse',
     'NotFoundResponse',
     'NotImplementedResponse',
+    'NotModifiedResponse',
     'ORJSONResponse',
     'PlainTextResponse',
+    'PrerenderedJSON',
+    'PrerenderedResponse',
     'ServiceUnavailableResponse',
-    'UnauthorizedResponse']
+    'SpreadsheetResponse',
+    'TSVResponse',
+    'UnauthorizedResponse',
+    'etag',
+    'not_modified']
 
 
 class InternalServerErrorResponse(Response):
@@ -62,6 +116,12 @@ class NotImplementedResponse(Response):
     def __init__(self, *args, **kwargs):
         super().__init__(status_code=501)
 
+class NotModifiedResponse(Response):
+    """ The 304 Not Modified default Response
+    """
+    def __init__(self, *args, headers=None, **kwargs):
+        super().__init__(status_code=304, headers=headers)
+
 class ServiceUnavailableResponse(Response):
     """ The 503 Service Unavailable default Response
     """
@@ -113,12 +173,564 @@ class ORJSONResponse(JSONResponse):
         raise TypeError(f'Type {type(typ)} is not handled by ORJSONResponse')
 
 
+def etag(content: bytes) -> str:
+    """ Returns the (strong) ETag of a response body
+
+    Examples:
+
+        >>> etag(b'{}')
+        '"2afb9b83f9314e5d029766197f539792"'
+    """
+    return '"{}"'.format(hashlib.blake2b(content, digest_size=16).hexdigest())
+
+
+def not_modified(request: Request, tag: str) -> bool:
+    """ Returns True if the "If-None-Match" header of the request matches the
+    ETag
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == '*':
+        return True
+
+    for elt in if_none_match.split(','):
+        elt = elt.strip()
+        if elt.startswith('W/'):
+            elt = elt[2:]
+        if elt == tag:
+            return True
+
+    return False
+
+
+class PrerenderedResponse:
+    """ A response whose body and headers are built once, and that is sent
+    as is to each request
+
+    A copy of the headers list is sent, as the middlewares may modify it.
+    """
+    __slots__ = ('status_code', 'body', 'raw_headers')
+
+    def __init__(self, body: bytes, raw_headers: typing.List[typing.Tuple[bytes, bytes]],
+        status_code: int = 200):
+        self.status_code = status_code
+        self.body = body
+        self.raw_headers = raw_headers
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            'type': 'http.response.start',
+            'status': self.status_code,
+            'headers': list(self.raw_headers)
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': self.body
+        })
+
+
+class PrerenderedJSON:
+    """ JSON content that is serialized (and compressed) once, and served with
+    its ETag
+
+    The encoded variants that are not smaller than the JSON body are not kept.
+
+    Attributes:
+        body (bytes): The serialized content
+        etag (str): The ETag of the body
+        encodings (Tuple[str]): The available encodings of the body
+    """
+    def __init__(self, content: typing.Any,
+        encodings: typing.Optional[typing.Iterable[str]] = None):
+        self.body = orjson.dumps(content,
+            option=orjson.OPT_NON_STR_KEYS,
+            default=ORJSONResponse.default_cast)
+        self.etag = etag(self.body)
+
+        if encodings is None:
+            encodings = compression.ENCODINGS
+
+        self.variants = {
+            None: self.variant(self.body)
+        }
+        for encoding in encodings:
+            body = compression.compress(self.body, encoding)
+            if len(body) < len(self.body):
+                self.variants[encoding] = self.variant(body, encoding)
+
+        self.encodings = tuple(
+            encoding for encoding in self.variants if encoding is not None)
+
+    def variant(self, body: bytes, encoding: typing.Optional[str] = None) \
+        -> typing.Tuple[str, PrerenderedResponse, PrerenderedResponse]:
+        """ Returns the ETag, the response and the 304 response of an encoded
+        body
+        """
+        tag = self.etag if encoding is None else etag(body)
+        headers = [
+            (b'etag', tag.encode()),
+            (b'vary', b'accept-encoding')
+        ]
+        if encoding is not None:
+            headers.append((b'content-encoding', encoding.encode()))
+
+        return (
+            tag,
+            PrerenderedResponse(body, [
+                (b'content-length', str(len(body)).encode()),
+                (b'content-type', b'application/json'),
+                *headers
+            ]),
+            PrerenderedResponse(b'', headers, 304)
+        )
+
+    def response(self, request: Request) -> PrerenderedResponse:
+        """ Returns the response to the request, in the encoding preferred by
+        the client (304 if the client's version is up to date)
+        """
+        encoding = None
+        if self.encodings:
+            accept_encoding = request.headers.get('accept-encoding')
+            if accept_encoding:
+                encoding = compression.negotiate(accept_encoding, self.encodings)
+
+        tag, response, not_modified_response = self.variants[encoding]
+        if not_modified(request, tag):
+            return not_modified_response
+
+        return response
+
+
+def binary_default(value: typing.Any) -> typing.Any:
+    """ Casts the types that are serialized by orjson (and not by the binary
+    formats) like orjson does, then applies the ORJSONResponse.default_cast
+    rules
+
+    Examples:
+
+        >>> binary_default(datetime(2020, 1, 2, 3, 4, 5))
+        '2020-01-02T03:04:05'
+        >>> binary_default(decimal.Decimal('4.2'))
+        '4.2'
+    """
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+
+    return ORJSONResponse.default_cast(value)
+
+
+# The types that are encoded as they are by the binary formats
+BINARY_TYPES = (str, int, float, bool, bytes, type(None))
+
+def binary_cast(value: typing.Any) -> typing.Any:
+    """ Returns the value with its items cast by binary_default, when their
+    type is not one of BINARY_TYPES (CBOR encodes the dates, decimals, UUIDs
+    and sets with its own tags, and does not call a default function for them)
+
+    Examples:
+
+        >>> binary_cast({'a': [decimal.Decimal('4.2'), {1}], 'b': (1, None)})
+        {'a': ['4.2', [1]], 'b': [1, None]}
+    """
+    if isinstance(value, BINARY_TYPES):
+        return value
+    if isinstance(value, dict):
+        return {key: binary_cast(elt) for key, elt in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [binary_cast(elt) for elt in value]
+
+    return binary_cast(binary_default(value))
+
+
+class MsgPackResponse(Response):
+    """ The response that encodes data into MessagePack (the iterators are
+    collected in an array)
+
+    The types that are not handled by MessagePack are cast as in JSON.
+    """
+    media_type = 'application/msgpack'
+
+    def render(self, content: typing.Any) -> bytes:
+        if msgpack is None:
+            raise NotImplementedError('msgpack is not installed, msgpack format not available')
+
+        if isinstance(content, typing.Iterator):
+            content = list(content)
+
+        return msgpack.packb(content, default=binary_default, use_bin_type=True)
+
+
+class CBORResponse(Response):
+    """ The response that encodes data into CBOR (the iterators are collected
+    in an array)
+
+    The types that are not handled by JSON are cast as in JSON, even those
+    that CBOR has tags for (decimals, dates, UUIDs, sets).
+    """
+    media_type = 'application/cbor'
+
+    def render(self, content: typing.Any) -> bytes:
+        if cbor2 is None:
+            raise NotImplementedError('cbor2 is not installed, cbor format not available')
+
+        if isinstance(content, typing.Iterator):
+            content = list(content)
+
+        return cbor2.dumps(binary_cast(content))
+
+
 class HJSONResponse(ORJSONResponse):
     """ The response that encodes generator data into JSON
+
+    The whole content is kept in memory, use JSONStreamResponse to stream it.
     """
     def render(self, content: typing.Generator):
         return super().render(list(content))
 
+
+class IteratorResponse(StreamingResponse):
+    """ The response that streams the serialized items of a (sync or async)
+    iterable
+
+    The items are serialized and sent by chunks of about "chunk_size" bytes,
+    only one chunk is in memory at a time. The sync iterators (except lists
+    and tuples) are consumed in the thread pool of the request's domain, as
+    reading them may block.
+
+    The subclasses define the "encode" method, and optionally the "start"
+    and "end" ones.
+    """
+    chunk_size = 1 << 16
+
+    def __init__(self, content: typing.Union[typing.Iterable, typing.AsyncIterable],
+        status_code: int = 200, headers: typing.Optional[typing.Mapping[str, str]] = None,
+        media_type: typing.Optional[str] = None, chunk_size: typing.Optional[int] = None):
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+        self.items = content
+        self.count = 0
+        self.pool = None
+        super().__init__(self.chunks(), status_code, headers, media_type)
+
+    async def __call__(self, scope, receive, send):
+        self.pool = get_thread_pool(scope.get('domain'))
+        await super().__call__(scope, receive, send)
+
+    def start(self) -> bytes:
+        """ Returns the beginning of the body
+        """
+        return b''
+
+    def encode(self, item: typing.Any) -> bytes:
+        """ Returns a serialized item (the "count" attribute is the number of
+        items that are already serialized)
+        """
+        raise NotImplementedError
+
+    def end(self) -> bytes:
+        """ Returns the end of the body
+        """
+        return b''
+
+    def next_chunk(self, iterator: typing.Iterator) -> typing.Tuple[bytes, bool]:
+        """ Serializes the next items of the iterator, until the chunk size is
+        reached
+
+        Returns:
+            Tuple[bytes, bool]: The chunk, and True if the iterator is exhausted
+        """
+        buffer = []
+        size = 0
+        for item in iterator:
+            data = self.encode(item)
+            self.count += 1
+            buffer.append(data)
+            size += len(data)
+            if size >= self.chunk_size:
+                return b''.join(buffer), False
+
+        return b''.join(buffer), True
+
+    async def chunks(self) -> typing.AsyncIterator[bytes]:
+        yield self.start()
+
+        if isinstance(self.items, typing.AsyncIterable):
+            buffer = []
+            size = 0
+            async for item in self.items:
+                data = self.encode(item)
+                self.count += 1
+                buffer.append(data)
+                size += len(data)
+                if size >= self.chunk_size:
+                    yield b''.join(buffer)
+                    buffer = []
+                    size = 0
+
+            yield b''.join(buffer) + self.end()
+            return
+
+        iterator = iter(self.items)
+        exhausted = False
+        while not exhausted:
+            if isinstance(self.items, (list, tuple)):
+                chunk, exhausted = self.next_chunk(iterator)
+            elif self.pool is not None:
+                chunk, exhausted = await self.pool.submit(self.next_chunk, iterator)
+            else:
+                chunk, exhausted = await run_in_threadpool(self.next_chunk, iterator)
+
+            if exhausted:
+                chunk += self.end()
+
+            yield chunk
+
+
+class JSONStreamResponse(IteratorResponse):
+    """ The response that streams the items of an iterable as a JSON array
+    """
+    media_type = 'application/json'
+
+    def encode(self, item: typing.Any) -> bytes:
+        return (b',' if self.count else b'[') + orjson.dumps(item,
+            option=orjson.OPT_NON_STR_KEYS,
+            default=ORJSONResponse.default_cast)
+
+    def end(self) -> bytes:
+        return b']' if self.count else b'[]'
+
+
+class NDJSONResponse(IteratorResponse):
+    """ The response that streams the items of an iterable as newline
+    delimited JSON
+    """
+    media_type = 'application/x-ndjson'
+
+    def encode(self, item: typing.Any) -> bytes:
+        return orjson.dumps(item,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+            default=ORJSONResponse.default_cast)
+
+class ArrowResponse(IteratorResponse):
+    """ The response that streams the rows of an iterable of dicts as Arrow
+    record batches of "batch_size" rows, in the IPC streaming format (see
+    halfapi.lib.arrow)
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    batch_size = 10000
+
+    def __init__(self, content: typing.Union[typing.Iterable[typing.Dict], typing.AsyncIterable[typing.Dict]],
+        header: typing.Optional[typing.List[str]] = None,
+        schema: typing.Optional[typing.Dict] = None, status_code: int = 200,
+        headers: typing.Optional[typing.Mapping[str, str]] = None,
+        batch_size: typing.Optional[int] = None):
+        """
+        Parameters:
+            header (List[str]): The columns
+            schema (Dict): The JSON schema of the rows (the Arrow schema is
+                inferred from the first batch if it is not set)
+
+        Raises:
+            NotImplementedError: pyarrow is not installed
+        """
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+        self.writer = arrow.BatchWriter(
+            arrow.arrow_schema(schema, header) if schema else None,
+            header)
+        self.batch = []
+        super().__init__(content, status_code, headers)
+
+    def encode(self, item: typing.Dict) -> bytes:
+        self.batch.append(item)
+        if len(self.batch) < self.batch_size:
+            return b''
+
+        data = self.writer.write_batch(self.batch)
+        self.batch = []
+        return data
+
+    def end(self) -> bytes:
+        data = self.writer.write_batch(self.batch) if self.batch else b''
+        self.batch = []
+        return data + self.writer.close()
+
+
+class CSVResponse(IteratorResponse):
+    """ The response that streams the rows of an iterable of dicts as CSV
+
+    The header is the keys of the first row, or the given list of fields (the
+    other keys of the rows are ignored).
+    """
+    media_type = 'text/csv'
+    file_type = 'csv'
+    delimiter = ','
+
+    def __init__(self, content: typing.Union[typing.Iterable[typing.Dict], typing.AsyncIterable[typing.Dict]],
+        header: typing.Optional[typing.List[str]] = None, status_code: int = 200,
+        headers: typing.Optional[typing.Mapping[str, str]] = None,
+        chunk_size: typing.Optional[int] = None):
+        self.header = list(header) if header else None
+        self.buffer = StringIO()
+        self.writer = None
+
+        filename = f'{date.today()}.{self.file_type}'
+        super().__init__(content, status_code, {
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            **(headers or {})
+        }, chunk_size=chunk_size)
+
+    def start(self) -> bytes:
+        if self.header is None:
+            return b''
+
+        return self.encode_header()
+
+    def encode_header(self) -> bytes:
+        self.writer = csv.DictWriter(self.buffer, self.header,
+            delimiter=self.delimiter, extrasaction='ignore')
+        self.writer.writeheader()
+        return self.flush()
+
+    def encode(self, item: typing.Dict) -> bytes:
+        header = b''
+        if self.writer is None:
+            self.header = list(item.keys())
+            header = self.encode_header()
+
+        self.writer.writerow(item)
+        return header + self.flush()
+
+    def flush(self) -> bytes:
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data.encode()
+
+
+class TSVResponse(CSVResponse):
+    """ The response that streams the rows of an iterable of dicts as
+    tab-separated values
+    """
+    media_type = 'text/tab-separated-values'
+    file_type = 'tsv'
+    delimiter = '\t'
+
+
+class SpreadsheetResponse(Response):
+    """ The response that writes the rows of an iterable of dicts as an ODS
+    or XLSX document (see halfapi.lib.spreadsheet), and streams it
+
+    The document is written row by row into a spooled temporary file (in
+    memory up to "spool_size" bytes, then on disk), in the thread pool of the
+    request's domain, then it is sent by chunks. Async iterables are written
+    on the event loop.
+    """
+    chunk_size = 1 << 16
+    spool_size = 1 << 22
+
+    def __init__(self, content: typing.Union[typing.Iterable[typing.Dict], typing.AsyncIterable[typing.Dict]],
+        file_type: str = 'ods', header: typing.Optional[typing.List[str]] = None,
+        status_code: int = 200, headers: typing.Optional[typing.Mapping[str, str]] = None):
+        self.writer_cls = spreadsheet.WRITERS[file_type]
+        self.rows = content
+        self.header = header
+        self.status_code = status_code
+        self.media_type = self.writer_cls.media_type
+        self.background = None
+
+        filename = f'{date.today()}.{file_type}'
+        self.init_headers({
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            **(headers or {})
+        })
+
+    def write(self, document: typing.BinaryIO) -> int:
+        """ Writes the document, and returns its size
+        """
+        with self.writer_cls(document, self.header) as writer:
+            writer.write_rows(self.rows)
+
+        return document.tell()
+
+    async def write_async(self, document: typing.BinaryIO) -> int:
+        with self.writer_cls(document, self.header) as writer:
+            async for row in self.rows:
+                writer.write_row(row)
+
+        return document.tell()
+
+    async def send_document(self, send, document: typing.BinaryIO, size: int,
+        run: typing.Callable):
+        """ Sends the written document by chunks, read with the run function
+        """
+        await send({
+            'type': 'http.response.start',
+            'status': self.status_code,
+            'headers': [
+                *self.raw_headers,
+                (b'content-length', str(size).encode())
+            ]
+        })
+
+        document.seek(0)
+        more_body = True
+        while more_body:
+            chunk = await run(document.read, self.chunk_size)
+            more_body = len(chunk) == self.chunk_size
+            await send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': more_body
+            })
+
+    async def __call__(self, scope, receive, send):
+        pool = get_thread_pool(scope.get('domain'))
+        run = pool.submit if pool is not None else run_in_threadpool
+
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_size) as document:
+            if isinstance(self.rows, typing.AsyncIterable):
+                size = await self.write_async(document)
+            else:
+                size = await run(self.write, document)
+
+            await self.send_document(send, document, size, run)
+
+
+class WrittenSpreadsheetResponse(SpreadsheetResponse):
+    """ The response that streams a spreadsheet document written in a file by
+    another process (the "process_render" option of the routes run in the
+    process pool)
+
+    The file is removed when it is opened.
+    """
+    def __init__(self, path: str, status_code: int = 200,
+        raw_headers: typing.List[typing.Tuple[bytes, bytes]] = None):
+        self.path = path
+        self.status_code = status_code
+        self.raw_headers = raw_headers or []
+        self.background = None
+
+    async def __call__(self, scope, receive, send):
+        pool = get_thread_pool(scope.get('domain'))
+        run = pool.submit if pool is not None else run_in_threadpool
+
+        with open(self.path, 'rb') as document:
+            os.unlink(self.path)
+            await self.send_document(
+                send, document, os.fstat(document.fileno()).st_size, run)
+
+
 class ODSResponse(Response):
     file_type = 'ods'
 
@@ -6,6 +6,8 @@ Classes :
     - JSONRoute
 
 Fonctions :
+    - acl_params_schema
+    - match_route
     - gen_domain_routes
     - gen_schema_routes
     - api_routes
@@ -16,14 +18,17 @@ Exception :
 """
 import inspect
 
-from typing import Coroutine, Dict, Generator, Tuple, Any
+from typing import Coroutine, Dict, Generator, List, Optional, Tuple, Any
 from types import ModuleType, FunctionType
 
 import yaml
+from starlette.routing import BaseRoute, Match, Mount
+from starlette.types import Scope
 
 # from .domain import gen_router_routes, domain_acls, route_decorator, domain_schema
-from .responses import ORJSONResponse
+from .responses import PrerenderedJSON
 from .acl import args_check
+from .domain import route_decorator
 from ..half_route import HalfRoute
 from . import acl
 
@@ -37,6 +42,9 @@ def JSONRoute(data: Any) -> Coroutine:
     """
     Returns a route function that returns the data as JSON
 
+    The data is serialized and compressed when the route is created, the
+    encoding is chosen according to the "Accept-Encoding" request header.
+
     Parameters:
         data (Any):
             The data to return
@@ -44,12 +52,46 @@ def JSONRoute(data: Any) -> Coroutine:
     Returns:
         async function
     """
+    content = PrerenderedJSON(data)
+
     async def wrapped(request, *args, **kwargs):
-        return ORJSONResponse(data)
+        return content.response(request)
 
     return wrapped
 
 
+def acl_params_schema(param: Dict) -> Dict:
+    """ Returns the ACL params of a route, with the functions ("acl", and the
+    "etag" version function) replaced by their names
+
+    Examples:
+
+        >>> acl_params_schema({'acl': acl.public, 'etag': True, 'out': ['id']})
+        {'acl': 'public', 'etag': True, 'out': ['id']}
+    """
+    return {
+        key: value.__name__ if callable(value) else value
+        for key, value in param.items()
+    }
+
+def match_route(routes: List[BaseRoute], scope: Scope) -> Optional[BaseRoute]:
+    """ Returns the route that matches the path and the method of the scope
+    (looked up in the mounted applications), and updates the scope with its
+    path parameters
+    """
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        if match != Match.FULL:
+            continue
+
+        scope.update(child_scope)
+        if not isinstance(route, Mount):
+            return route
+
+        return match_route(route.routes, scope)
+
+    return None
+
 def gen_domain_routes(m_domain: ModuleType):
     """
     Yields the Route objects for a domain
@@ -80,7 +122,13 @@ def gen_schema_routes(schema: Dict):
             acls = definition.pop('acls')
             # TODO: Check what to do with gen_routes, it is almost the same function
             if not inspect.iscoroutinefunction(fct):
-                yield HalfRoute(path, route_decorator(fct), acls, verb)
+                route = route_decorator(fct, acls)
+                if route.plan.executor == 'process':
+                    # Only the domains have a process pool
+                    logger.warning(
+                        'No process pool for the %s %s route, it runs in the thread pool',
+                        verb, path)
+                yield HalfRoute(path, route, acls, verb)
             else:
                 yield HalfRoute(path, args_check(fct), acls, verb)
 
@@ -106,8 +154,7 @@ def api_routes(m_dom: ModuleType) -> Tuple[Dict, Dict]:
             if 'acl' not in param.keys() or not param['acl']:
                 continue
 
-            l_params.append(param.copy())
-            l_params[-1]['acl'] = param['acl'].__name__
+            l_params.append(acl_params_schema(param))
 
             if param['acl'] not in d_acls.keys():
                 d_acls[param['acl'].__name__] = param['acl']
@@ -2,6 +2,7 @@
 
 Functions :
     - schema_json
+    - openapi_schema
     - schema_dict_dom
     - get_acls
 
@@ -20,7 +21,7 @@ from starlette.schemas import SchemaGenerator
 from .. import __version__
 from ..logging import logger
 from .routes import api_routes
-from .responses import ORJSONResponse
+from .responses import PrerenderedJSON
 
 SCHEMAS = SchemaGenerator(
     {"openapi": "3.0.0", "info": {"title": "HalfAPI", "version": __version__}}
@@ -35,8 +36,22 @@ async def schema_json(request, *args, **kwargs):
       200:
         description: API Schema in OpenAPI v3 format
     """
-    return ORJSONResponse(
-        SCHEMAS.get_schema(routes=request.app.routes))
+    return openapi_schema(request.app).response(request)
+
+
+def openapi_schema(app) -> PrerenderedJSON:
+    """ Returns the serialized OpenAPI schema of an application's routes
+
+    It is computed once (the endpoints docstrings are parsed as YAML) and
+    stored in the "openapi_schema" attribute of the application's state. Set it
+    to None when the routes are modified.
+    """
+    schema = getattr(app.state, 'openapi_schema', None)
+    if schema is None:
+        schema = PrerenderedJSON(SCHEMAS.get_schema(routes=app.routes))
+        app.state.openapi_schema = schema
+
+    return schema
 
 
 def schema_csv_dict(csv: List[str], prefix='/') -> Dict:
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Spreadsheet module
+
+Writes the rows of an iterable of dicts as an ODS or XLSX document, row by
+row, into a file object. The document parts are zip entries written in
+streaming mode, so the memory used does not depend on the number of rows.
+
+The header is the keys of the first row (or the given list of fields). The
+numbers and booleans are written as such, the other values as strings (and as
+dates in the ODS documents).
+
+Classes :
+    - SpreadsheetWriter
+    - ODSWriter
+    - XLSXWriter
+
+Constant :
+    WRITERS (Dict[str, SpreadsheetWriter]): The writers by file type
+"""
+import decimal
+import math
+import re
+import zipfile
+from datetime import date
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional
+from xml.sax.saxutils import escape
+
+# The characters that are not allowed in XML 1.0 documents
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def xml_text(value: Any) -> str:
+    """ Returns the escaped text of a value
+
+    Examples:
+
+        >>> xml_text('<a & b>\\x00')
+        '&lt;a &amp; b&gt;'
+    """
+    return escape(INVALID_XML_CHARS.sub('', str(value)))
+
+def is_number(value: Any) -> bool:
+    """ Returns True if the value is written as a number
+
+    Examples:
+
+        >>> is_number(decimal.Decimal('4.2')), is_number(True), is_number(math.nan)
+        (True, False, False)
+    """
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, decimal.Decimal):
+        return value.is_finite()
+
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class SpreadsheetWriter:
+    """ Writes the rows of a single sheet document
+
+    The subclasses define the document parts, and the serialization of the
+    rows.
+
+    Usage :
+
+        with XLSXWriter(fileobj) as writer:
+            writer.write_rows(rows)
+    """
+    file_type = ''
+    media_type = ''
+    sheet_name = 'Sheet1'
+    sheet_part = ''
+    buffer_size = 1 << 16
+
+    def __init__(self, fileobj: BinaryIO, header: Optional[List[str]] = None):
+        self.archive = zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED)
+        self.header = list(header) if header else None
+        self.rows_count = 0
+        self.sheet = None
+        self.buffer: List[str] = []
+        self.buffer_len = 0
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def begin(self):
+        """ Writes the static parts, and opens the sheet part
+        """
+        for name, content in self.parts().items():
+            self.archive.writestr(name, content)
+
+        self.sheet = self.archive.open(self.sheet_part, 'w', force_zip64=True)
+        self.write(self.start())
+
+    def parts(self) -> Dict[str, str]:
+        """ Returns the static parts of the document, by name
+        """
+        raise NotImplementedError
+
+    def start(self) -> str:
+        """ Returns the beginning of the sheet part
+        """
+        raise NotImplementedError
+
+    def row(self, values: List[Any]) -> str:
+        """ Returns the XML of a row
+        """
+        raise NotImplementedError
+
+    def end(self) -> str:
+        """ Returns the end of the sheet part
+        """
+        raise NotImplementedError
+
+    def write(self, data: str):
+        """ Buffers the data of the sheet part
+        """
+        self.buffer.append(data)
+        self.buffer_len += len(data)
+        if self.buffer_len >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.sheet.write(''.join(self.buffer).encode())
+        self.buffer = []
+        self.buffer_len = 0
+
+    def write_row(self, row: Dict):
+        """ Writes a row (and the header row before the first one)
+        """
+        if self.rows_count == 0:
+            if self.header is None:
+                self.header = list(row.keys())
+            self.write(self.row(self.header))
+
+        self.write(self.row([row.get(key) for key in self.header]))
+        self.rows_count += 1
+
+    def write_rows(self, rows: Iterable[Dict]):
+        for row in rows:
+            self.write_row(row)
+
+    def close(self):
+        """ Closes the sheet part and the archive (the file object is left
+        open)
+        """
+        if self.rows_count == 0 and self.header is not None:
+            self.write(self.row(self.header))
+
+        self.write(self.end())
+        self.flush()
+        self.sheet.close()
+        self.archive.close()
+
+
+class ODSWriter(SpreadsheetWriter):
+    """ Writes an OpenDocument spreadsheet
+    """
+    file_type = 'ods'
+    media_type = 'application/vnd.oasis.opendocument.spreadsheet'
+    sheet_part = 'content.xml'
+
+    def begin(self):
+        # The "mimetype" entry is the first one, and it is not compressed
+        self.archive.writestr(
+            zipfile.ZipInfo('mimetype'), self.media_type,
+            compress_type=zipfile.ZIP_STORED)
+        super().begin()
+
+    def parts(self) -> Dict[str, str]:
+        return {
+            'META-INF/manifest.xml': (
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+                f'<manifest:file-entry manifest:full-path="/" manifest:version="1.2" manifest:media-type="{self.media_type}"/>'
+                '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+                '</manifest:manifest>'
+            )
+        }
+
+    def start(self) -> str:
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<office:document-content'
+            ' xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"'
+            ' xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"'
+            ' xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+            ' office:version="1.2">'
+            '<office:body><office:spreadsheet>'
+            f'<table:table table:name="{self.sheet_name}">'
+        )
+
+    @staticmethod
+    def cell(value: Any) -> str:
+        """ Returns the XML of a cell
+
+        Examples:
+
+            >>> ODSWriter.cell(True)
+            '<table:table-cell office:value-type="boolean" office:boolean-value="true"><text:p>true</text:p></table:table-cell>'
+            >>> ODSWriter.cell(None)
+            '<table:table-cell/>'
+        """
+        if value is None:
+            return '<table:table-cell/>'
+
+        if isinstance(value, bool):
+            text = 'true' if value else 'false'
+            return (
+                '<table:table-cell office:value-type="boolean" '
+                f'office:boolean-value="{text}"><text:p>{text}</text:p></table:table-cell>')
+
+        if is_number(value):
+            return (
+                f'<table:table-cell office:value-type="float" office:value="{value}">'
+                f'<text:p>{value}</text:p></table:table-cell>')
+
+        if isinstance(value, date):
+            text = value.isoformat()
+            return (
+                f'<table:table-cell office:value-type="date" office:date-value="{text}">'
+                f'<text:p>{text}</text:p></table:table-cell>')
+
+        return (
+            '<table:table-cell office:value-type="string">'
+            f'<text:p>{xml_text(value)}</text:p></table:table-cell>')
+
+    def row(self, values: List[Any]) -> str:
+        return '<table:table-row>{}</table:table-row>'.format(
+            ''.join(map(self.cell, values)))
+
+    def end(self) -> str:
+        return '</table:table></office:spreadsheet></office:body></office:document-content>'
+
+
+class XLSXWriter(SpreadsheetWriter):
+    """ Writes an Office Open XML workbook (the strings are inline strings,
+    there is no shared strings table to keep in memory)
+    """
+    file_type = 'xlsx'
+    media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    sheet_part = 'xl/worksheets/sheet1.xml'
+
+    def parts(self) -> Dict[str, str]:
+        xml = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        relationships = 'http://schemas.openxmlformats.org/package/2006/relationships'
+        office_relationships = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+        return {
+            '[Content_Types].xml': (
+                f'{xml}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                '</Types>'
+            ),
+            '_rels/.rels': (
+                f'{xml}<Relationships xmlns="{relationships}">'
+                f'<Relationship Id="rId1" Type="{office_relationships}/officeDocument" Target="xl/workbook.xml"/>'
+                '</Relationships>'
+            ),
+            'xl/workbook.xml': (
+                f'{xml}<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="{office_relationships}">'
+                f'<sheets><sheet name="{self.sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+                '</workbook>'
+            ),
+            'xl/_rels/workbook.xml.rels': (
+                f'{xml}<Relationships xmlns="{relationships}">'
+                f'<Relationship Id="rId1" Type="{office_relationships}/worksheet" Target="worksheets/sheet1.xml"/>'
+                '</Relationships>'
+            )
+        }
+
+    def start(self) -> str:
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            '<sheetData>'
+        )
+
+    @staticmethod
+    def cell(value: Any) -> str:
+        """ Returns the XML of a cell
+
+        Examples:
+
+            >>> XLSXWriter.cell(42)
+            '<c><v>42</v></c>'
+            >>> XLSXWriter.cell('a < b')
+            '<c t="inlineStr"><is><t xml:space="preserve">a &lt; b</t></is></c>'
+        """
+        if value is None:
+            return '<c/>'
+
+        if isinstance(value, bool):
+            return f'<c t="b"><v>{int(value)}</v></c>'
+
+        if is_number(value):
+            return f'<c><v>{value}</v></c>'
+
+        if isinstance(value, date):
+            value = value.isoformat()
+
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{xml_text(value)}</t></is></c>'
+
+    def row(self, values: List[Any]) -> str:
+        return '<row>{}</row>'.format(''.join(map(self.cell, values)))
+
+    def end(self) -> str:
+        return '</sheetData></worksheet>'
+
+
+WRITERS = {
+    'ods': ODSWriter,
+    'xlsx': XLSXWriter
+}
@@ -15,7 +15,13 @@ class HTimingClient(TimingClient):
     """ Used to redefine TimingClient.timing
     """
     def timing(self, metric_name, timing, tags):
-        tags_d = dict(map(lambda elt: elt.split(':'), tags))
+        tags_d = dict(map(lambda elt: elt.split(':', 1), tags))
+
+        if metric_name == 'halfapi.compression':
+            logger.debug('[COMPRESSION][%s] %s -> %s bytes (ratio %s) - %sms',
+                tags_d['encoding'], tags_d['size'], tags_d['compressed_size'],
+                tags_d['ratio'], round(timing*1000, 2))
+            return
 
         logger.debug('[TIME:%s][%s] %s %s - %sms',
             tags_d['time'], metric_name,
@@ -57,9 +57,13 @@ class CheckUser(BaseUser):
     the given route.
 
     It should never be able to run a route function.
+
+    The payload of the token is kept for the ACLs that read its claims (like
+    the role ACLs), so that the check gives the answer of the real request.
     """
-    def __init__(self, user_id: UUID) -> None:
+    def __init__(self, user_id: UUID, payload: dict = None) -> None:
         self.__id = user_id
+        self.payload = payload if payload is not None else {}
 
 
     @property
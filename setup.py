@@ -76,6 +76,20 @@ setup(
             "openapi-spec-validator",
             "coverage"
         ],
+        "crypto":[
+            "cryptography"
+        ],
+        "compression":[
+            "brotli",
+            "zstandard"
+        ],
+        "binary":[
+            "msgpack",
+            "cbor2"
+        ],
+        "arrow":[
+            "pyarrow"
+        ],
         "pyexcel":[
             "pyexcel",
             "pyexcel-ods3",
@@ -0,0 +1,27 @@
+import os
+from ... import acl
+
+ACLS = {
+    'GET': [{'acl': acl.public, 'executor': 'process'}],
+    'POST': [{'acl': acl.public, 'executor': 'process', 'process_render': True}]
+}
+
+def get():
+    """
+    description:
+        returns the pid of the process that ran the route
+    responses:
+        200:
+            description: test response
+    """
+    return {'pid': os.getpid()}
+
+def post():
+    """
+    description:
+        returns the pid of the process that ran and rendered the route
+    responses:
+        200:
+            description: test response
+    """
+    return {'pid': os.getpid()}
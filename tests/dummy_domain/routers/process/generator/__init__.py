@@ -0,0 +1,26 @@
+from .... import acl
+
+ACLS = {
+    'GET': [{'acl': acl.public, 'executor': 'process'}],
+    'POST': [{'acl': acl.public, 'executor': 'process', 'process_render': True}]
+}
+
+def get():
+    """
+    description:
+        returns a generator, read entirely in the process pool
+    responses:
+        200:
+            description: test response
+    """
+    return ({'id': i} for i in range(3))
+
+def post():
+    """
+    description:
+        returns a generator, read entirely and rendered in the process pool
+    responses:
+        200:
+            description: test response
+    """
+    return ({'id': i} for i in range(3))
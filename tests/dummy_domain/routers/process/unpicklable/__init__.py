@@ -0,0 +1,15 @@
+from .... import acl
+
+ACLS = {
+    'GET': [{'acl': acl.public, 'executor': 'process'}]
+}
+
+def get():
+    """
+    description:
+        returns a result that cannot be sent back from the process pool
+    responses:
+        500:
+            description: test response
+    """
+    return lambda: None
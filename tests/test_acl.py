@@ -1,5 +1,10 @@
+import asyncio
+import time
+
 import pytest
+from starlette.applications import Starlette
 from starlette.responses import PlainTextResponse
+from starlette.routing import Route
 from starlette.testclient import TestClient
 from halfapi.half_route import HalfRoute
 from halfapi.lib import acl
@@ -35,3 +40,317 @@ def test_acl_Check(dummy_app, token_debug_false_builder):
     assert resp.status_code == 200
 
 
+
+def test_compiled_acl():
+    from halfapi.half_route import CompiledAcl
+
+    def route(request):
+        pass
+
+    entry = CompiledAcl(route, {'acl': acl.connected, 'out': ['id']})
+    assert entry.name == 'connected'
+    assert entry.fct is not acl.connected
+    assert entry.scope['out'] == ('id',)
+    assert entry.scope['acl_pass'] == 'connected'
+    assert entry.cached is False
+
+    calls = []
+    def decorator_acl(check=acl.public):
+        calls.append(None)
+        def caller(req, *args, **kwargs):
+            return check(req, *args, **kwargs)
+        return caller
+
+    # A decorator that is not detected is resolved on the first request
+    entry = CompiledAcl(route, {'acl': decorator_acl})
+    assert entry.check(None) is True
+    assert entry.check(None) is True
+    # Called with the first request, then without
+    assert len(calls) == 2
+
+def test_acl_decision_cache():
+    from halfapi.lib.constants import DOMAIN_SCHEMA
+
+    calls = []
+    def is_member(req, *args, **kwargs):
+        "Member of the group"
+        calls.append(req.path_params['group_id'])
+        return req.path_params['group_id'] == 1
+
+    cached = acl.AclDecisionCache(is_member, {'ttl': 60, 'path_params': ['group_id']})
+    assert cached.__name__ == 'is_member'
+
+    class Request:
+        def __init__(self, user_id, group_id):
+            self.scope = {'user': type('User', (), {'id': user_id})()}
+            self.path_params = {'group_id': group_id, 'other': user_id}
+
+    assert cached(Request('a', 1)) is True
+    assert cached(Request('a', 1)) is True
+    assert cached(Request('a', 2)) is False
+    assert cached(Request('b', 1)) is True
+    assert calls == [1, 2, 1]
+
+    cached.invalidate('a', group_id=1)
+    assert cached(Request('a', 2)) is False
+    assert cached(Request('a', 1)) is True
+    assert calls == [1, 2, 1, 1]
+
+    acl.invalidate_acl_caches(user_id='b')
+    assert cached(Request('b', 1)) is True
+    assert len(calls) == 5
+    assert acl.acl_caches_stats()[cached.name]['hits'] == 2
+
+    cached.ttl = 0
+    cached.invalidate()
+    cached(Request('a', 1))
+    cached(Request('a', 1))
+    assert len(calls) == 7
+
+    DOMAIN_SCHEMA.validate({
+        'name': 'dummy', 'id': '1',
+        'acls': [['is_member', 'doc', 10, False, {'ttl': 60}]]
+    })
+
+def test_domain_acl_decision_cache(dummy_domain, monkeypatch):
+    from halfapi.halfapi import HalfAPI
+    from dummy_domain import acl as dummy_acl
+
+    monkeypatch.setattr(dummy_acl, 'ACLS', (
+        *acl.ACLS,
+        ('random', dummy_acl.random.__doc__, 10, False, {'ttl': 60})
+    ))
+    app = HalfAPI({
+        'secret': 'turlututu',
+        'production': True,
+        'domain': {'dummy_domain': {**dummy_domain, 'config': {}}}
+    }).application
+
+    halfapi_domain = app.domains['dummy_domain']
+    cached = halfapi_domain.acl_caches[dummy_acl.random]
+    assert cached.__name__ == 'random'
+    assert acl.ACL_CACHES['dummy_domain.acl.random'] is cached
+
+def test_async_acl(dummy_app):
+    async def member(req, *args, **kwargs):
+        "Async ACL"
+        await asyncio.sleep(0)
+        return req.query_params.get('member') == '1'
+
+    @HalfRoute.acl_decorator(params=[{'acl': member}, {'acl': acl.private}])
+    async def async_route(request, **kwargs):
+        return PlainTextResponse(request.scope['acl_pass'])
+
+    dummy_app.add_route('/async', async_route)
+    client = TestClient(dummy_app)
+    assert client.get('/async', params={'member': 1}).text == 'member'
+    assert client.get('/async').status_code == 401
+    assert client.get('/async?check&member=1').text == 'member'
+
+    route = acl.AclRoute('/member', member, acl.ACL('member', '', 10, True))
+    app = Starlette(routes=[route])
+    assert TestClient(app).head('/member', params={'member': 1}).status_code == 200
+    assert TestClient(app).head('/member').status_code == 401
+
+
+def test_concurrent_acls():
+    events = []
+
+    def slow_acl(name, delay, result):
+        async def fct(req, *args, **kwargs):
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                events.append(f'{name} cancelled')
+                raise
+            events.append(name)
+            return result
+        fct.__name__ = name
+        return fct
+
+    @HalfRoute.acl_decorator(params=[
+        {'acl': slow_acl('first', 0.1, False), 'concurrent_acls': True},
+        {'acl': slow_acl('second', 0.1, True)},
+        {'acl': slow_acl('third', 0.01, True)},
+        {'acl': slow_acl('fourth', 1, True)}
+    ])
+    async def route(request, **kwargs):
+        return PlainTextResponse(request.scope['acl_pass'])
+
+    app = Starlette(routes=[Route('/', route)])
+    start = time.perf_counter()
+    res = TestClient(app).get('/')
+    # The passing ACL with the highest priority wins
+    assert res.text == 'second'
+    assert time.perf_counter() - start < 0.19
+    assert events[0] == 'third'
+    assert 'fourth cancelled' in events
+
+def test_async_acl_decision_cache():
+    calls = []
+    async def async_member(req, *args, **kwargs):
+        calls.append(None)
+        return True
+
+    cached = acl.AclDecisionCache(async_member, {})
+    request = type('Request', (), {
+        'scope': {'user': type('User', (), {'id': 'a'})()},
+        'path_params': {}
+    })()
+
+    async def run():
+        assert await cached(request) is True
+        assert await cached(request) is True
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert cached.is_async
+
+def test_acls_check(dummy_domain):
+    from halfapi.halfapi import HalfAPI
+
+    app = HalfAPI({
+        'secret': 'turlututu',
+        'production': True,
+        'domain': {'dummy_domain': {**dummy_domain, 'config': {}}}
+    }).application
+    client = TestClient(app)
+
+    res = client.post('/halfapi/acls/check', json=[
+        ['GET', '/abc/alphabet'],
+        ['get', '/abc/alphabet/9c6b7b4e-4cb4-4f0b-b6c1-1a1b41a5b0c7'],
+        ['POST', '/arguments'],
+        ['DELETE', '/abc/alphabet'],
+        ['GET', '/unknown']
+    ])
+    assert res.status_code == 200
+    assert [elt['acl'] for elt in res.json()] == [
+        'public', 'public', 'public', None, None]
+    assert res.json()[1]['method'] == 'GET'
+
+    assert client.post('/halfapi/acls/check', json={'GET': '/'}).status_code == 400
+    assert client.post('/halfapi/acls/check', json=[['GET']]).status_code == 400
+    # The ACLs routes are still served
+    assert client.get('/halfapi/acls').status_code == 200
+
+def test_acls_check_debug_token(dummy_domain):
+    """ The batch check answers as the "check" requests of the same token
+    """
+    import jwt
+    from halfapi.halfapi import HalfAPI
+    from halfapi.lib.jwt_middleware import SECRET
+
+    app = HalfAPI({
+        'secret': 'turlututu',
+        'production': True,
+        'domain': {'dummy_domain': {**dummy_domain, 'config': {}}}
+    }).application
+
+    @HalfRoute.acl_decorator(params=[{'acl': acl.connected}])
+    async def who(request, **kwargs):
+        return PlainTextResponse('ok')
+
+    app.router.routes.insert(0, Route('/who', who))
+    client = TestClient(app)
+    client.headers['Authorization'] = jwt.encode(
+        {'user_id': '1', 'debug': True}, key=SECRET)
+
+    res = client.get('/who?check')
+    assert res.status_code == 200
+    assert res.text == 'connected'
+
+    res = client.post('/halfapi/acls/check', json=[['GET', '/who']])
+    assert res.status_code == 200
+    assert res.json()[0]['acl'] == 'connected'
+
+
+def test_check_acls():
+    @HalfRoute.acl_decorator(params=[{'acl': acl.private}])
+    async def private_route(request, **kwargs):
+        pass
+
+    request = type('Request', (), {'scope': {}})()
+    assert asyncio.run(private_route.check_acls(request)) == ''
+
+def test_role_acl(dummy_app):
+    from halfapi.lib.user import JWTUser
+
+    vocabulary = acl.RoleVocabulary()
+    editor = acl.roles('admin', 'editor', name='editor', vocabulary=vocabulary)
+    manager = acl.roles('admin', 'manager', require_all=True, vocabulary=vocabulary)
+    scoped = acl.roles('write', claim='scope', vocabulary=vocabulary)
+    assert editor.__name__ == 'editor'
+    assert manager.__name__ == 'admin_manager'
+    assert not acl.is_acl_decorator(editor)
+
+    def request(**payload):
+        return type('Request', (), {
+            'scope': {'user': JWTUser('1', '', payload)}
+        })()
+
+    assert editor(request(roles=['editor', 'other']))
+    assert not editor(request(roles=['reader']))
+    assert not editor(request())
+    assert not manager(request(roles=['admin']))
+    assert manager(request(roles=['manager', 'admin']))
+    assert scoped(request(scope='read write'))
+    assert not editor(type('Request', (), {'scope': {}})())
+
+    # The bitset is computed once per request
+    req = request(roles=['admin'])
+    assert editor(req) and not manager(req)
+    assert [key for key in req.scope if key.startswith('role_bits:roles')]
+
+    @HalfRoute.acl_decorator(params=[{'acl': manager}, {'acl': editor}])
+    async def route(request, **kwargs):
+        return PlainTextResponse(request.scope['acl_pass'])
+
+    dummy_app.add_route('/roles', route)
+    assert TestClient(dummy_app).get('/roles').status_code == 401
+    # The chain of role ACLs is compiled into a list of bitmasks
+    assert asyncio.run(route.check_acls(request(roles=['editor']))) == 'editor'
+    assert asyncio.run(route.check_acls(request(roles=['admin', 'manager']))) \
+        == 'admin_manager'
+    assert asyncio.run(route.check_acls(request(roles=['reader']))) == ''
+
+
+def test_role_acl_check(dummy_app):
+    import jwt
+
+    editor = acl.roles('editor', vocabulary=acl.RoleVocabulary())
+
+    @HalfRoute.acl_decorator(params=[{'acl': editor}])
+    async def route(request, **kwargs):
+        return PlainTextResponse('ok')
+
+    dummy_app.add_route('/roles_check', route)
+    client = TestClient(dummy_app)
+    client.headers['Authorization'] = jwt.encode(
+        {'user_id': '1', 'roles': ['editor']}, key='dummysecret')
+
+    # The check request gives the answer of the real request
+    assert client.get('/roles_check').text == 'ok'
+    assert client.get('/roles_check?check').text == 'editor'
+
+
+def test_role_acl_mixed_chain(caplog):
+    import logging
+    from halfapi.lib.user import JWTUser
+
+    editor = acl.roles('editor', vocabulary=acl.RoleVocabulary())
+
+    def request(**payload):
+        return type('Request', (), {
+            'scope': {'user': JWTUser('1', '', payload)}
+        })()
+
+    with caplog.at_level(logging.DEBUG):
+        @HalfRoute.acl_decorator(params=[{'acl': editor}, {'acl': acl.public}])
+        async def mixed_route(request, **kwargs):
+            return None
+
+    assert '(editor, public) : sequential evaluation, role ACLs not compiled' \
+        in caplog.text
+    # The role ACL is called as a function
+    assert asyncio.run(mixed_route.check_acls(request(roles=['editor']))) == 'editor'
+    assert asyncio.run(mixed_route.check_acls(request(roles=['reader']))) == 'public'
@@ -80,6 +80,23 @@ class TestDummyDomain(TestDomain):
         res = self.client.request('post', '/arguments', json={ **arg_dict, 'z': True})
         assert res.json() == {**arg_dict, 'z': True}
 
+    def test_schema_etag(self):
+        for path in ('/', '/halfapi/schema'):
+            res = self.client.request('get', path)
+            assert res.status_code == 200
+            assert len(res.json()['paths']) > 0
+            etag = res.headers['etag']
+
+            res = self.client.request('get', path,
+                headers={'If-None-Match': etag})
+            assert res.status_code == 304
+            assert res.content == b''
+            assert res.headers['etag'] == etag
+
+            res = self.client.request('get', path,
+                headers={'If-None-Match': '"outdated"'})
+            assert res.status_code == 200
+
     def test_schema_path_params(self):
         res = self.client.request('get', '/halfapi/schema')
         schema = res.json()
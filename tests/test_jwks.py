@@ -0,0 +1,114 @@
+import os
+import json
+import tempfile
+from base64 import urlsafe_b64encode
+from uuid import uuid4
+
+import jwt
+import pytest
+
+from halfapi.lib.jwks import KeySet
+from halfapi.lib.jwt_middleware import JWTAuthenticationBackend
+
+
+def b64(data: bytes) -> str:
+    return urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def write_jwks(path, keys, mtime=None):
+    with open(path, 'w') as jwks_file:
+        json.dump({'keys': keys}, jwks_file)
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+@pytest.fixture
+def jwks_path():
+    _, path = tempfile.mkstemp(suffix='.json')
+    yield path
+    os.remove(path)
+
+def token(key, algorithm, kid=None):
+    return jwt.encode(
+        {'user_id': str(uuid4())},
+        key=key,
+        algorithm=algorithm,
+        headers={'kid': kid} if kid else None)
+
+
+def test_keyset_hs256(jwks_path):
+    write_jwks(jwks_path, [
+        {'kty': 'oct', 'kid': 'first', 'k': b64(b'first secret')},
+        {'kty': 'oct', 'k': b64(b'no kid')},
+    ])
+
+    keyset = KeySet(jwks_path)
+    assert set(keyset.keys) == {'first'}
+    assert keyset.get('first') == (b'first secret', 'HS256')
+    assert keyset.version == 1
+
+    backend = JWTAuthenticationBackend(secret_key=None, keyset=keyset)
+    assert 'user_id' in backend.decode(token(b'first secret', 'HS256', 'first'))
+
+    with pytest.raises(jwt.InvalidTokenError):
+        backend.decode(token(b'first secret', 'HS256', 'unknown'))
+
+    with pytest.raises(jwt.InvalidTokenError):
+        # No kid and no secret key
+        backend.decode(token(b'first secret', 'HS256'))
+
+    backend = JWTAuthenticationBackend(secret_key='legacy', keyset=keyset)
+    assert 'user_id' in backend.decode(token('legacy', 'HS256'))
+
+
+def test_keyset_rotation(jwks_path):
+    write_jwks(jwks_path, [
+        {'kty': 'oct', 'kid': 'first', 'k': b64(b'first secret')},
+    ], mtime=1_000_000_000)
+
+    keyset = KeySet(jwks_path, check_interval=0)
+    backend = JWTAuthenticationBackend(secret_key=None, keyset=keyset)
+    first_token = token(b'first secret', 'HS256', 'first')
+    assert 'user_id' in backend.decode(first_token)
+
+    write_jwks(jwks_path, [
+        {'kty': 'oct', 'kid': 'second', 'k': b64(b'second secret')},
+    ], mtime=2_000_000_000)
+
+    assert 'user_id' in backend.decode(token(b'second secret', 'HS256', 'second'))
+    assert keyset.version == 2
+
+    # The cached payload of the first token was evicted with its key
+    with pytest.raises(jwt.InvalidTokenError):
+        backend.decode(first_token)
+
+    # An invalid file keeps the current keys
+    with open(jwks_path, 'w') as jwks_file:
+        jwks_file.write('{')
+    os.utime(jwks_path, ns=(3_000_000_000, 3_000_000_000))
+    keyset.refresh()
+    assert set(keyset.keys) == {'second'}
+
+
+def test_keyset_asymmetric(jwks_path):
+    pytest.importorskip('cryptography')
+    from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
+    from jwt.algorithms import RSAAlgorithm, OKPAlgorithm
+
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+
+    write_jwks(jwks_path, [
+        {**json.loads(RSAAlgorithm.to_jwk(rsa_key.public_key())), 'kid': 'rsa'},
+        {**json.loads(OKPAlgorithm.to_jwk(ed_key.public_key())), 'kid': 'ed'},
+    ])
+
+    keyset = KeySet(jwks_path)
+    assert keyset.get('rsa')[1] == 'RS256'
+    assert keyset.get('ed')[1] == 'EdDSA'
+
+    backend = JWTAuthenticationBackend(secret_key=None, keyset=keyset)
+    assert 'user_id' in backend.decode(token(rsa_key, 'RS256', 'rsa'))
+    assert 'user_id' in backend.decode(token(ed_key, 'EdDSA', 'ed'))
+
+    with pytest.raises(jwt.InvalidTokenError):
+        # Signed with the wrong key
+        backend.decode(token(rsa_key, 'RS256', 'ed'))
@@ -130,3 +130,170 @@ def test_jwt_DebugTrue_DebugApp(dummy_debug_app, token_debug_true_builder):
               'Authorization': token_debug_true_builder
         })
     assert resp.status_code == 200
+
+
+def test_TokenCache():
+    from halfapi.lib.jwt_middleware import TokenCache
+    import time
+
+    cache = TokenCache(2)
+    assert cache.get('a') is None
+    cache.set('a', {'user_id': 'a'})
+    cache.set('b', {'user_id': 'b', 'exp': time.time() + 60})
+    assert cache.get('a') == {'user_id': 'a'}
+
+    # "b" is the least recently used entry
+    cache.set('c', {'user_id': 'c'})
+    assert cache.get('b') is None
+    assert cache.get('a') == {'user_id': 'a'}
+
+    # Expired entries are evicted
+    cache.set('d', {'user_id': 'd', 'exp': time.time() - 1})
+    assert cache.get('d') is None
+    assert 'd' not in cache.entries
+
+    assert cache.stats == {'size': 1, 'maxsize': 2, 'hits': 2, 'misses': 3}
+
+    # The cached payload cannot be altered by the caller
+    cache.get('a')['user_id'] = 'x'
+    assert cache.get('a') == {'user_id': 'a'}
+
+    disabled = TokenCache(0)
+    disabled.set('a', {})
+    assert disabled.get('a') is None
+
+
+def test_jwt_cache(token_builder):
+    from starlette.applications import Starlette
+    from starlette.middleware.authentication import AuthenticationMiddleware
+
+    async def test_route(request):
+        assert isinstance(request.user, JWTUser)
+        return PlainTextResponse('ok')
+
+    backend = JWTAuthenticationBackend(secret_key='dummysecret')
+    app = Starlette()
+    app.add_route('/test', test_route)
+    app.add_middleware(AuthenticationMiddleware, backend=backend)
+    test_client = TestClient(app)
+
+    for _ in range(3):
+        resp = test_client.request('get', '/test',
+            headers={
+                'Authorization': token_builder
+            })
+        assert resp.status_code == 200
+
+    assert backend.cache.misses == 1
+    assert backend.cache.hits == 2
+
+
+def test_jwt_cache_expired(dummy_app):
+    import time
+    token = jwt.encode({
+        'name': 'xxx',
+        'user_id': str(uuid4()),
+        'exp': int(time.time()) + 1},
+        key='dummysecret')
+
+    async def test_route(request):
+        return PlainTextResponse(type(request.user).__name__)
+
+    dummy_app.add_route('/test', test_route)
+    test_client = TestClient(dummy_app)
+
+    resp = test_client.request('get', '/test', headers={'Authorization': token})
+    assert resp.text == 'JWTUser'
+
+    with patch('halfapi.lib.jwt_middleware.time.time', return_value=time.time() + 2), \
+        patch('jwt.api_jwt.datetime') as mock_datetime:
+        from datetime import datetime, timezone, timedelta
+        mock_datetime.now.return_value = datetime.now(tz=timezone.utc) + timedelta(seconds=2)
+        resp = test_client.request('get', '/test', headers={'Authorization': token})
+        assert resp.text == 'Nobody'
+
+
+def test_JWTAuthenticationMiddleware(token_builder):
+    """ The token is only decoded when the route reads the user
+    """
+    from starlette.applications import Starlette
+    from halfapi.lib.jwt_middleware import JWTAuthenticationMiddleware
+
+    async def public_route(request):
+        return PlainTextResponse('ok')
+
+    async def user_route(request):
+        return PlainTextResponse(type(request.user).__name__)
+
+    backend = JWTAuthenticationBackend(secret_key='dummysecret')
+    app = Starlette()
+    app.add_route('/public', public_route)
+    app.add_route('/user', user_route)
+    app.add_middleware(JWTAuthenticationMiddleware, backend=backend)
+    test_client = TestClient(app)
+
+    resp = test_client.request('get', '/public', headers={'Authorization': 'bad token'})
+    assert resp.status_code == 200
+    resp = test_client.request('get', '/public', headers={'Authorization': token_builder})
+    assert resp.status_code == 200
+    assert backend.cache.stats['misses'] == 0
+
+    resp = test_client.request('get', '/user', headers={'Authorization': 'bad token'})
+    assert resp.status_code == 401
+    assert 'error' in resp.json()
+
+    resp = test_client.request('get', '/user', headers={'Authorization': token_builder})
+    assert resp.status_code == 200
+    assert resp.text == 'JWTUser'
+
+    resp = test_client.request('get', '/user')
+    assert resp.status_code == 200
+    assert resp.text == 'Nobody'
+
+
+def test_JWTAuthenticationMiddleware_debug(token_debug_true_builder):
+    """ A debug token is refused on a production application, even when the
+    user is read from a mounted application
+    """
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from halfapi.lib.jwt_middleware import JWTAuthenticationMiddleware, on_auth_error
+
+    async def user_route(request):
+        return PlainTextResponse(type(request.user).__name__)
+
+    for debug, status_code in ((False, 401), (True, 200)):
+        app = Starlette(debug=debug, routes=[
+            Mount('/mounted', Starlette(debug=not debug, exception_handlers={
+                AuthenticationError: on_auth_error
+            }))
+        ])
+        app.routes[0].app.add_route('/user', user_route)
+        app.add_middleware(JWTAuthenticationMiddleware,
+            backend=JWTAuthenticationBackend(secret_key='dummysecret'))
+        test_client = TestClient(app)
+
+        resp = test_client.request('get', '/mounted/user',
+            headers={'Authorization': token_debug_true_builder})
+        assert resp.status_code == status_code
+
+
+def test_halfapi_lazy_authentication(application_domain):
+    """ A route that does not read the user ignores the token
+    """
+    test_client = TestClient(application_domain)
+    headers = {'Authorization': 'bad token'}
+
+    resp = test_client.request('get', '/abc/alphabet', headers=headers)
+    assert resp.status_code == 200
+
+    resp = test_client.request('get', '/halfapi/version', headers=headers)
+    assert resp.status_code == 200
+
+    # The "halfapi" argument of the route reads the user
+    resp = test_client.request('get', '/config', headers=headers)
+    assert resp.status_code == 401
+    assert 'error' in resp.json()
+
+    resp = test_client.request('get', '/halfapi/whoami', headers=headers)
+    assert resp.status_code == 401
@@ -0,0 +1,91 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from halfapi.lib.domain import route_decorator
+from halfapi.lib.responses import ArrowResponse
+
+pa = pytest.importorskip('pyarrow')
+
+COMPONENTS = {
+    'schemas': {
+        'Row': {
+            'type': 'object',
+            'required': ['id'],
+            'properties': {
+                'id': {'type': 'integer'},
+                'name': {'type': 'string'},
+                'ratio': {'type': 'number'}
+            }
+        }
+    }
+}
+
+def read(content):
+    return pa.ipc.open_stream(content)
+
+
+def call(response):
+    async def app(scope, receive, send):
+        await response(scope, receive, send)
+
+    return TestClient(app).get('/')
+
+
+def test_arrow_response_batches():
+    rows = ({'id': i, 'name': f'row {i}'} for i in range(25))
+    res = call(ArrowResponse(rows, batch_size=10))
+    assert res.headers['content-type'] == 'application/vnd.apache.arrow.stream'
+
+    reader = read(res.content)
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [10, 10, 5]
+    assert reader.schema.names == ['id', 'name']
+    assert reader.schema.field('id').type == pa.int64()
+    assert batches[2].to_pylist()[-1] == {'id': 24, 'name': 'row 24'}
+
+
+def test_arrow_response_schema():
+    schema = COMPONENTS['schemas']['Row']
+    res = call(ArrowResponse([{'id': 1, 'ratio': 1, 'other': 'x'}], schema=schema))
+    reader = read(res.content)
+    assert reader.schema.field('id').type == pa.int64()
+    assert reader.schema.field('id').nullable is False
+    assert reader.schema.field('ratio').type == pa.float64()
+    assert reader.read_all().to_pylist() == [{'id': 1, 'name': None, 'ratio': 1.0}]
+
+    res = call(ArrowResponse([{'id': 1, 'name': 'a'}], header=['name']))
+    assert read(res.content).read_all().to_pylist() == [{'name': 'a'}]
+
+    # No rows
+    res = call(ArrowResponse([], schema=schema))
+    table = read(res.content).read_all()
+    assert table.num_rows == 0
+    assert table.schema.names == ['id', 'name', 'ratio']
+
+
+def test_arrow_route():
+    def route(data):
+        """
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  type: array
+                  items:
+                    $ref: "#/components/schemas/Row"
+        """
+        for i in range(3):
+            yield {'id': i, 'ratio': None}
+
+    app = Starlette(routes=[
+        Route('/', endpoint=route_decorator(route), methods=['GET'])])
+    app.schema_components = COMPONENTS
+
+    res = TestClient(app).get('/', params={'format': 'arrow'})
+    table = read(res.content).read_all()
+    # The "ratio" column has the type of the schema component, not null
+    assert table.schema.field('ratio').type == pa.float64()
+    assert table.column('id').to_pylist() == [0, 1, 2]
@@ -0,0 +1,366 @@
+import asyncio
+
+import httpx
+import jwt
+import pytest
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from halfapi.halfapi import HalfAPI
+from halfapi.half_route import HalfRoute
+from halfapi.lib import acl
+from halfapi.lib.cache import CachedResponse, MemoryBackend, ResponseCache, \
+    SQLiteBackend, COALESCERS, RESPONSE_CACHES, configure_backend
+from halfapi.lib.constants import ROUTER_ACLS_SCHEMA
+from halfapi.lib.responses import ORJSONResponse, etag
+
+
+def test_memory_backend():
+    async def run():
+        backend = MemoryBackend(max_entries=2)
+        value = CachedResponse(200, [], b'a')
+        await backend.set('a', value, 60)
+        await backend.set('b', value, 60)
+        assert await backend.get('a') is value
+        # "b" is the least recently used entry
+        await backend.set('c', value, 60)
+        assert await backend.get_many(['a', 'b', 'c']) == [value, None, value]
+
+        await backend.set('d', value, 0)
+        assert await backend.get('d') is None
+
+        await backend.delete('a')
+        assert await backend.get('a') is None
+        return backend
+
+    backend = asyncio.run(run())
+    assert backend.stats == {
+        'backend': 'MemoryBackend',
+        'size': 1,
+        'hits': 3,
+        'misses': 3,
+        'hit_ratio': 0.5,
+        'evictions': 2,
+        'max_entries': 2
+    }
+
+
+def test_cache_option_schema():
+    ROUTER_ACLS_SCHEMA.validate([{
+        'acl': acl.public,
+        'cache': {'ttl': 10, 'key': ['path', 'user'], 'max_entries': 10}
+    }])
+
+    with pytest.raises(Exception):
+        ROUTER_ACLS_SCHEMA.validate([{
+            'acl': acl.public,
+            'cache': {'key': ['cookie']}
+        }])
+
+
+def test_route_cache(dummy_app):
+    calls = []
+
+    @HalfRoute.acl_decorator(params=[
+        {'acl': acl.public, 'cache': {'ttl': 60, 'key': ['args']}}])
+    async def cached_route(request, **kwargs):
+        calls.append(dict(request.query_params))
+        return PlainTextResponse(f'call {len(calls)}', headers={'x-test': 'ok'})
+
+    dummy_app.add_route('/cached', cached_route, methods=['GET', 'POST'])
+    client = TestClient(dummy_app)
+
+    first = client.get('/cached', params={'a': 1})
+    second = client.get('/cached', params={'a': 1})
+    assert first.text == second.text == 'call 1'
+    assert second.headers['x-test'] == 'ok'
+    assert client.get('/cached', params={'a': 2}).text == 'call 2'
+
+    # The other methods and the ACL checks are not cached
+    assert client.post('/cached', params={'a': 1}).text == 'call 3'
+    assert client.get('/cached?check').text == 'public'
+    assert len(calls) == 3
+
+    name = f'{cached_route.__module__}:cached_route (public)'
+    stats = RESPONSE_CACHES[name].stats
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['backend']['size'] == 2
+
+
+def test_route_cache_uncacheable(dummy_app):
+    calls = []
+
+    @HalfRoute.acl_decorator(params=[{'acl': acl.public, 'cache': {}}])
+    async def uncached_route(request, **kwargs):
+        calls.append(None)
+        if len(calls) == 1:
+            return PlainTextResponse('error', status_code=500)
+
+        return StreamingResponse(iter([b'streamed']))
+
+    dummy_app.add_route('/uncached', uncached_route)
+    client = TestClient(dummy_app)
+    for _ in range(3):
+        client.get('/uncached')
+
+    assert len(calls) == 3
+
+
+def test_response_cache_key():
+    cache = ResponseCache('test_response_cache_key', {'key': ['path']})
+
+    class Request:
+        def __init__(self, path_params, accept=''):
+            self.path_params = path_params
+            self.headers = {'accept': accept}
+
+    assert cache.key(Request({'id': 1})) == cache.key(Request({'id': 1}))
+    assert cache.key(Request({'id': 1})) != cache.key(Request({'id': 2}))
+    # The Accept header is reduced to the negotiated format
+    assert cache.key(Request({'id': 1})) \
+        == cache.key(Request({'id': 1}, 'text/html'))
+
+    with pytest.raises(ValueError):
+        ResponseCache('test_response_cache_key', {'key': ['cookie']})
+
+
+def test_halfapi_metrics(dummy_domain):
+    from halfapi.lib.jwt_middleware import SECRET
+    def application(production):
+        return HalfAPI({
+            'secret': 'turlututu',
+            'production': production,
+            'domain': {
+                'dummy_domain': {
+                    **dummy_domain,
+                    'config': {}
+                }
+            }
+        }).application
+
+    res = TestClient(application(False)).get('/halfapi/metrics')
+    assert res.status_code == 200
+    metrics = res.json()
+    assert isinstance(metrics['response_caches'], dict)
+    assert metrics['jwt_cache']['maxsize'] == 1024
+
+    # Only the authenticated users get the metrics in production
+    client = TestClient(application(True))
+    assert client.get('/halfapi/metrics').status_code == 401
+    client.headers['Authorization'] = jwt.encode({'user_id': '1'}, key=SECRET)
+    assert client.get('/halfapi/metrics').status_code == 200
+
+    # Without a secret, no user is authenticated
+    app = HalfAPI({
+        'production': True,
+        'domain': {'dummy_domain': {**dummy_domain, 'config': {}}}
+    }).application
+    assert TestClient(app).get('/halfapi/metrics').status_code == 401
+
+
+def test_sqlite_backend(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    # Two workers
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    value = CachedResponse(200, [(b'content-type', b'text/plain')], b'body')
+
+    async def run():
+        await first.set('a', value, 60)
+        await first.set('b', value, -1)
+        shared = await second.get_many(['a', 'b'])
+        assert shared[1] is None
+        assert shared[0].raw_headers == value.raw_headers
+        assert shared[0].body == b'body'
+
+        # A forked worker opens its own connection
+        second.pid = None
+        await second.delete('a')
+        assert await first.get('a') is None
+
+    asyncio.run(run())
+    assert second.stats['hits'] == 1
+    # The size is counted in the thread of the connection
+    second.size()
+    second.counting.result()
+    assert second.stats['size'] == 0
+
+
+def test_sqlite_backend_eviction(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'), max_size=1 << 16)
+    value = CachedResponse(200, [], b'x' * 4096)
+
+    async def run():
+        for i in range(100):
+            await backend.set(str(i), value, 60 + i)
+
+        # The entries that expire first were evicted
+        assert await backend.get('0') is None
+        assert await backend.get('99') is not None
+
+    asyncio.run(run())
+    assert backend.evictions > 0
+    backend.size()
+    assert backend.counting.result() < 100
+
+
+def test_sqlite_backend_locked(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / 'cache.sqlite')
+    backend = SQLiteBackend(path, timeout=0.2)
+    value = CachedResponse(200, [], b'body')
+
+    async def run():
+        await backend.set('a', value, 60)
+        backend.size()
+        await asyncio.wrap_future(backend.counting)
+        # Another worker holds the write lock
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute('BEGIN IMMEDIATE')
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        # The write waits for the busy timeout without blocking the loop
+        write = asyncio.ensure_future(backend.set('b', value, 60))
+        await asyncio.sleep(0.05)
+        # The stats serve the last count while the thread is busy
+        assert backend.size() == 1
+        await write
+        ticker.cancel()
+        other.execute('ROLLBACK')
+        assert ticks >= 5
+        assert await backend.get('b') is None
+
+    asyncio.run(run())
+
+
+def test_configure_backend(tmp_path, caplog):
+    try:
+        configure_backend({'backend': 'sqlite', 'path': str(tmp_path / 'cache.sqlite')})
+        first = ResponseCache('test_configure_backend_1', {})
+        second = ResponseCache('test_configure_backend_2', {'max_entries': 10})
+        assert isinstance(first.backend, SQLiteBackend)
+        assert first.backend is second.backend
+        assert 'max_entries option of test_configure_backend_2' in caplog.text
+    finally:
+        configure_backend(None)
+
+    assert isinstance(ResponseCache('test_configure_backend_3', {}).backend,
+        MemoryBackend)
+
+
+def test_route_coalescing():
+    calls = []
+
+    @HalfRoute.acl_decorator(params=[{'acl': acl.public, 'coalesce': True}])
+    async def coalesced_route(request, **kwargs):
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        if request.query_params.get('fail'):
+            raise HTTPException(503)
+        return PlainTextResponse(f'a={request.query_params["a"]}')
+
+    app = Starlette(routes=[Route('/coalesced', coalesced_route)])
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            responses = await asyncio.gather(*(
+                client.get('/coalesced', params={'a': i % 2}) for i in range(10)))
+            assert [res.text for res in responses] == ['a=0', 'a=1'] * 5
+
+            failed = await asyncio.gather(*(
+                client.get('/coalesced', params={'fail': 1}) for i in range(3)))
+            assert [res.status_code for res in failed] == [503] * 3
+
+    asyncio.run(run())
+    assert len(calls) == 3
+
+    stats = COALESCERS[f'{coalesced_route.__module__}:coalesced_route (public)'].stats
+    assert stats['calls'] == 3
+    assert stats['coalesced'] == 10
+    assert stats['max_waiters'] == 4
+    assert stats['in_flight'] == 0
+
+
+def test_coalescer_key():
+    from halfapi.half_route import CompiledAcl
+
+    async def route(request, **kwargs):
+        return None
+
+    # The requests of different users share a call only behind "public"
+    public = CompiledAcl(route, {'acl': acl.public, 'coalesce': True})
+    assert public.coalescer.key_parts == ('path', 'args', 'acl')
+    connected = CompiledAcl(route, {'acl': acl.connected, 'coalesce': True})
+    assert connected.coalescer.key_parts == ('path', 'args', 'acl', 'user')
+    explicit = CompiledAcl(route,
+        {'acl': acl.connected, 'coalesce': {'key': ['path']}})
+    assert explicit.coalescer.key_parts == ('path',)
+
+
+def test_route_etag(dummy_app):
+    calls = []
+
+    @HalfRoute.acl_decorator(params=[{'acl': acl.public, 'etag': True}])
+    async def etag_route(request, **kwargs):
+        calls.append(None)
+        return ORJSONResponse({'items': [1, 2]})
+
+    dummy_app.add_route('/etag', etag_route)
+    client = TestClient(dummy_app)
+
+    res = client.get('/etag')
+    tag = res.headers['etag']
+    assert tag == etag(res.content)
+
+    res = client.get('/etag', headers={'If-None-Match': f'W/{tag}'})
+    assert res.status_code == 304
+    assert res.content == b''
+    assert res.headers['etag'] == tag
+    assert client.get('/etag', headers={'If-None-Match': '"other"'}).status_code == 200
+    assert len(calls) == 3
+
+
+def test_route_etag_version(dummy_app):
+    calls = []
+    version = {'value': 1}
+
+    @HalfRoute.acl_decorator(params=[{
+        'acl': acl.public,
+        'etag': lambda request: version['value'],
+        'cache': {}
+    }])
+    async def version_route(request, **kwargs):
+        calls.append(None)
+        return ORJSONResponse({'version': version['value']})
+
+    dummy_app.add_route('/version', version_route)
+    client = TestClient(dummy_app)
+
+    res = client.get('/version')
+    tag = res.headers['etag']
+    # The route function is not called
+    res = client.get('/version', headers={'If-None-Match': tag})
+    assert res.status_code == 304
+    assert len(calls) == 1
+    # The query string is part of the tag
+    assert client.get('/version', params={'a': 1}).headers['etag'] != tag
+
+    # The cached response of the previous version is not sent
+    version['value'] = 2
+    res = client.get('/version', headers={'If-None-Match': tag})
+    assert res.status_code == 200
+    assert res.json() == {'version': 2}
+    assert res.headers['etag'] != tag
+    assert len(calls) == 3
@@ -0,0 +1,197 @@
+import asyncio
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from halfapi.halfapi import HalfAPI
+from halfapi.lib.compression import CompressionMiddleware, StreamCompressor, \
+    negotiate
+
+BODY = b'halfapi ' * 1000
+
+
+def call(app, headers=((b'accept-encoding', b'gzip'),)):
+    """ Calls the ASGI app and returns the sent messages
+    """
+    messages = []
+    requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # Never disconnects
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app({
+        'type': 'http',
+        'method': 'GET',
+        'path': '/',
+        'root_path': '',
+        'query_string': b'',
+        'headers': list(headers)
+    }, receive, send))
+
+    return messages
+
+
+class TimingClient:
+    def __init__(self):
+        self.metrics = []
+
+    def timing(self, metric_name, timing, tags):
+        self.metrics.append((metric_name, timing, tags))
+
+
+def test_negotiate():
+    assert negotiate('gzip, zstd', ('zstd', 'gzip')) == 'zstd'
+    assert negotiate('zstd;q=0, gzip', ('zstd', 'gzip')) == 'gzip'
+    assert negotiate('identity', ('zstd', 'gzip')) is None
+
+
+def test_compress_body():
+    client = TimingClient()
+    app = CompressionMiddleware(
+        Response(BODY, media_type='text/plain', headers={'ETag': '"x"'}),
+        timing_client=client)
+
+    start, body = call(app)
+    headers = dict(start['headers'])
+    assert headers[b'content-encoding'] == b'gzip'
+    assert headers[b'vary'] == b'accept-encoding'
+    assert headers[b'etag'] == b'W/"x"'
+    assert int(headers[b'content-length']) == len(body['body'])
+    assert gzip.decompress(body['body']) == BODY
+
+    metric_name, cpu_time, tags = client.metrics[0]
+    assert metric_name == 'halfapi.compression'
+    assert cpu_time >= 0
+    assert f'size:{len(BODY)}' in tags
+    assert f'compressed_size:{len(body["body"])}' in tags
+
+
+@pytest.mark.parametrize('response, headers', [
+    # Too small
+    (Response(b'halfapi', media_type='text/plain'), ((b'accept-encoding', b'gzip'),)),
+    # Excluded content type
+    (Response(BODY, media_type='application/zip'), ((b'accept-encoding', b'gzip'),)),
+    # Already encoded
+    (Response(BODY, headers={'Content-Encoding': 'br'}), ((b'accept-encoding', b'gzip'),)),
+    # Not accepted
+    (Response(BODY, media_type='text/plain'), ()),
+])
+def test_passthrough(response, headers):
+    messages = call(CompressionMiddleware(response), headers)
+    assert messages[1]['body'] == response.body
+    assert dict(messages[0]['headers']).get(b'content-encoding') \
+        == dict(response.raw_headers).get(b'content-encoding')
+
+
+@pytest.mark.parametrize('response', [
+    Response(status_code=304, headers={'ETag': '"x"'}),
+    Response(status_code=204),
+    Response(b'', media_type='text/plain'),
+    StreamingResponse(iter([b'', b'']), media_type='text/plain'),
+])
+def test_passthrough_bodiless(response):
+    """ The responses without a body are not compressed, whatever the
+    minimum size
+    """
+    start, *bodies = call(CompressionMiddleware(response, minimum_size=0))
+    assert b'content-encoding' not in dict(start['headers'])
+    assert b''.join(elt['body'] for elt in bodies) == b''
+
+
+def test_compress_etag_not_modified():
+    from halfapi.half_route import HalfRoute
+    from halfapi.lib import acl
+
+    @HalfRoute.acl_decorator(params=[{'acl': acl.public, 'etag': True}])
+    async def route(request, **kwargs):
+        return PlainTextResponse(BODY.decode())
+
+    client = TestClient(CompressionMiddleware(
+        Starlette(routes=[Route('/', route)]), minimum_size=0))
+    tag = client.get('/').headers['etag']
+
+    res = client.get('/', headers={'If-None-Match': tag})
+    assert res.status_code == 304
+    assert 'content-encoding' not in res.headers
+    assert res.headers.get('content-length', '0') == '0'
+    assert res.content == b''
+
+
+def test_compress_stream():
+    async def chunks():
+        for _ in range(3):
+            yield BODY
+
+    client = TimingClient()
+    app = CompressionMiddleware(
+        StreamingResponse(chunks(), media_type='application/x-ndjson'),
+        minimum_size=0,
+        timing_client=client)
+
+    start, *bodies = call(app)
+    headers = dict(start['headers'])
+    assert headers[b'content-encoding'] == b'gzip'
+    assert b'content-length' not in headers
+
+    # Each chunk is sent when it is compressed
+    assert len([elt for elt in bodies if elt['body']]) >= 3
+    assert bodies[-1]['more_body'] is False
+
+    assert gzip.decompress(b''.join(elt['body'] for elt in bodies)) == BODY * 3
+    assert f'size:{len(BODY) * 3}' in client.metrics[0][2]
+
+
+def test_zstd():
+    pytest.importorskip('zstandard')
+
+    app = Starlette(routes=[
+        Route('/', lambda request: PlainTextResponse(BODY.decode()))])
+    app.add_middleware(CompressionMiddleware, algorithm='zstd', level=1)
+    client = TestClient(app)
+
+    res = client.get('/', headers={'Accept-Encoding': 'zstd'})
+    assert res.headers['content-encoding'] == 'zstd'
+    assert res.content == BODY
+
+    # Fallback to gzip
+    res = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert res.headers['content-encoding'] == 'gzip'
+    assert res.content == BODY
+
+
+def test_stream_compressor_unavailable():
+    with pytest.raises(NotImplementedError):
+        StreamCompressor('deflate')
+
+
+def test_halfapi_compression(dummy_domain):
+    app = HalfAPI({
+        'secret': 'turlututu',
+        'production': True,
+        'compression': {'algorithm': 'gzip', 'minimum_size': 10},
+        'domain': {
+            'dummy_domain': {
+                **dummy_domain,
+                'config': {}
+            }
+        }
+    }).application
+
+    middleware = [
+        elt for elt in app.user_middleware if elt.cls is CompressionMiddleware]
+    assert len(middleware) == 1
+    assert middleware[0].options['minimum_size'] == 10
+
+    res = TestClient(app).get('/halfapi/whoami', headers={'Accept-Encoding': 'gzip'})
+    assert res.headers['content-encoding'] == 'gzip'
+    assert res.json()['user']
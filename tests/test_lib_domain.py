@@ -50,6 +50,7 @@
 #     assert isinstance(res, list)
 #     assert len(res) > 0
 
+import pytest
 from starlette.testclient import TestClient
 from starlette.responses import Response
 from starlette.routing import Router, Route
@@ -122,3 +123,144 @@ def test_route_decorator():
     response = client.post('/', json={'toto': 'tata', 'bouboul': True})
     assert response.is_success
     assert response.json() == ''
+
+def test_route_call_plan():
+    """ The call plan is computed once from the function's signature
+    """
+    from halfapi.lib.domain import RouteCallPlan, RENDERERS
+
+    def route(halfapi, data={'x': 1}, ret_type='html'):
+        return ''
+
+    plan = RouteCallPlan(route)
+    assert plan.args_spec == {'halfapi', 'data', 'ret_type'}
+    assert plan.halfapi is True
+    assert plan.data is True
+    assert plan.out is False
+    assert plan.data_default == {'x': 1}
+    assert plan.ret_type == 'html'
+    assert plan.renderer is RENDERERS['html']
+
+    def route(data):
+        return ''
+
+    plan = RouteCallPlan(route)
+    assert plan.ret_type is None
+    assert plan.get_renderer({'data': {}}) is RENDERERS['json']
+    assert plan.get_renderer({'data': {'format': 'txt'}}) is RENDERERS['txt']
+
+    with pytest.raises(NotImplementedError):
+        plan.get_renderer({'data': {'format': 'unknown'}})
+
+def test_route_decorator_data_default():
+    """ The default value of the "data" argument is not shared between requests
+    """
+    default = {'x': '1'}
+
+    def route(data=default):
+        return data
+
+    app = Router([Route('/', endpoint=route_decorator(route), methods=['GET'])])
+    client = TestClient(app)
+    assert client.get('/', params={'y': '2'}).json() == {'x': '1', 'y': '2'}
+    assert client.get('/').json() == {'x': '1'}
+    assert default == {'x': '1'}
+
+def test_route_decorator_stream():
+    """ The generators are streamed as a JSON array or as NDJSON
+    """
+    def route(data):
+        return ({'id': i} for i in range(1000))
+
+    async def rows():
+        for i in range(3):
+            yield {'id': i}
+
+    def async_route():
+        return rows()
+
+    app = Router([
+        Route('/', endpoint=route_decorator(route), methods=['GET']),
+        Route('/async', endpoint=route_decorator(async_route), methods=['GET'])
+    ])
+    client = TestClient(app)
+
+    res = client.get('/')
+    assert res.headers['content-type'] == 'application/json'
+    assert 'content-length' not in res.headers
+    assert res.json() == [{'id': i} for i in range(1000)]
+
+    res = client.get('/', params={'format': 'ndjson'})
+    assert res.headers['content-type'] == 'application/x-ndjson'
+    lines = res.content.splitlines()
+    assert len(lines) == 1000
+    assert lines[0] == b'{"id":0}'
+
+    assert client.get('/async').json() == [{'id': 0}, {'id': 1}, {'id': 2}]
+
+def test_route_decorator_csv():
+    from halfapi.lib.domain import RouteCallPlan, RENDERERS
+
+    def route(data):
+        for i in range(3):
+            yield {'id': i, 'secret': 'x'}
+
+    plan = RouteCallPlan(route)
+    renderer = plan.get_renderer({'data': {'format': 'csv'}}, ['id'])
+    assert renderer.func is RENDERERS['csv']
+    assert renderer.keywords == {'header': ['id']}
+
+    app = Router([Route('/', endpoint=route_decorator(route), methods=['GET'])])
+    client = TestClient(app)
+    res = client.get('/', params={'format': 'csv'})
+    assert res.text == 'id,secret\r\n0,x\r\n1,x\r\n2,x\r\n'
+
+    res = client.get('/', params={'format': 'tsv'})
+    assert res.text.startswith('id\tsecret\r\n')
+
+def test_route_decorator_accept(monkeypatch):
+    """ The format is negotiated with the "Accept" header
+    """
+    msgpack = pytest.importorskip('msgpack')
+    from starlette.applications import Starlette
+    from halfapi.lib import responses
+    from halfapi.lib.domain import accepted_format
+
+    def route(data):
+        return {'id': 1}
+
+    def fixed(ret_type='json'):
+        return {'id': 1}
+
+    app = Starlette(routes=[
+        Route('/', endpoint=route_decorator(route), methods=['GET']),
+        Route('/fixed', endpoint=route_decorator(fixed), methods=['GET'])
+    ])
+    client = TestClient(app)
+
+    res = client.get('/', headers={'Accept': 'application/msgpack'})
+    assert res.headers['content-type'] == 'application/msgpack'
+    assert res.headers['vary'] == 'accept'
+    assert msgpack.unpackb(res.content) == {'id': 1}
+
+    res = client.get('/', headers={'Accept': 'application/msgpack'},
+        params={'format': 'json'})
+    assert res.json() == {'id': 1}
+    assert 'vary' not in res.headers
+
+    res = client.get('/', headers={'Accept': 'text/html, */*'})
+    assert res.json() == {'id': 1}
+
+    res = client.get('/fixed', headers={'Accept': 'application/msgpack'})
+    assert res.json() == {'id': 1}
+    assert 'vary' not in res.headers
+
+    # Not installed : negotiated JSON, or 501 if explicitly requested
+    monkeypatch.setattr(responses, 'msgpack', None)
+    accepted_format.cache_clear()
+    try:
+        res = client.get('/', headers={'Accept': 'application/msgpack'})
+        assert res.json() == {'id': 1}
+        assert client.get('/', params={'format': 'msgpack'}).status_code == 501
+    finally:
+        accepted_format.cache_clear()
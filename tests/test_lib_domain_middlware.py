@@ -1,14 +1,11 @@
 from starlette.testclient import TestClient
-from starlette.middleware.base import BaseHTTPMiddleware
-from unittest.mock import patch
 from halfapi.lib.domain_middleware import DomainMiddleware
 
 def test_init():
-    with patch('starlette.middleware.base.BaseHTTPMiddleware.__init__') as init:
-        mw = DomainMiddleware('app', 'domain')
-        init.assert_called_once_with('app')
-        assert mw.domain == 'domain'
-        assert mw.request == None
+    mw = DomainMiddleware('app', {'name': 'domain'})
+    assert mw.app == 'app'
+    assert mw.domain == {'name': 'domain'}
+    assert mw.domain_header == (b'x-domain', b'domain')
 
 def test_call(application_debug):
     c = TestClient(application_debug)
@@ -36,3 +33,37 @@ def test_call(application_debug):
     assert 'z' in r.headers['x-args-optional'].split(',')
 
 
+
+def test_multiple_domains_streaming():
+    """ Each mounted domain sets its own scope and headers, and streamed
+    responses go through the middleware
+    """
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    from starlette.responses import StreamingResponse
+    from starlette.routing import Mount, Route
+
+    async def endpoint(request):
+        async def content():
+            yield request.scope['domain'].encode()
+            yield b'!'
+
+        return StreamingResponse(content())
+
+    def domain_app(name):
+        return Starlette(
+            routes=[Route('/', endpoint)],
+            middleware=[Middleware(DomainMiddleware, domain={'name': name})])
+
+    app = Starlette(routes=[
+        Mount('/one', domain_app('one')),
+        Mount('/two', domain_app('two'))
+    ])
+    c = TestClient(app)
+
+    for name in ('one', 'two'):
+        r = c.request('get', f'/{name}/')
+        assert r.status_code == 200
+        assert r.text == f'{name}!'
+        assert r.headers['x-domain'] == name
+        assert 'x-acl' not in r.headers
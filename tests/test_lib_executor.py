@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import pytest
+from starlette.exceptions import HTTPException
+from starlette.routing import Router, Route
+from starlette.testclient import TestClient
+
+from halfapi.lib import acl
+from halfapi.lib.domain import route_decorator
+from halfapi.lib.executor import (BoundedThreadPool, configure_thread_pool,
+    get_thread_pool)
+
+
+def test_bounded_thread_pool():
+    pool = BoundedThreadPool('test', max_workers=1, queue_size=1)
+    event = threading.Event()
+
+    async def scenario():
+        calls = [
+            asyncio.ensure_future(pool.run(event.wait, 1))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        assert pool.pending == 2
+
+        with pytest.raises(HTTPException) as exc:
+            await pool.run(threading.get_ident)
+        assert exc.value.status_code == 503
+
+        event.set()
+        await asyncio.gather(*calls)
+        assert pool.pending == 0
+
+        assert await pool.run(threading.get_ident) != threading.get_ident()
+
+    asyncio.run(scenario())
+    pool.shutdown(wait=True)
+
+    # The default number of threads of ThreadPoolExecutor
+    pool = BoundedThreadPool('test', queue_size=1)
+    assert pool.max_workers is None
+    assert pool.limit == pool.workers + 1 == pool.executor._max_workers + 1
+    pool.shutdown()
+
+
+def test_configure_thread_pool():
+    pool = configure_thread_pool('test_configure', 2, 4)
+    assert get_thread_pool('test_configure') is pool
+    assert configure_thread_pool('test_configure', 2, 4) is pool
+    assert configure_thread_pool('test_configure', 3, 4) is not pool
+    assert get_thread_pool('test_configure').max_workers == 3
+
+
+def test_route_decorator_executor():
+    """ Sync routes run in a thread unless their executor option is "loop"
+    """
+    def route():
+        return threading.current_thread().name
+
+    async def loop_thread(request):
+        from starlette.responses import PlainTextResponse
+        return PlainTextResponse(threading.current_thread().name)
+
+    app = Router([
+        Route('/thread', endpoint=route_decorator(route), methods=['GET']),
+        Route('/loop', endpoint=route_decorator(
+            route, [{'acl': acl.public, 'executor': 'loop'}]), methods=['GET']),
+        Route('/reference', endpoint=loop_thread, methods=['GET'])
+    ])
+    with TestClient(app) as client:
+        loop_name = client.get('/reference').text
+
+        assert client.get('/loop').json() == loop_name
+        assert client.get('/thread').json() != loop_name
+
+
+def test_process_call():
+    import pickle
+    from halfapi.lib.domain import render_json
+    from halfapi.lib.executor import process_call, UnpicklableResultError
+
+    assert pickle.loads(process_call(dict, {'a': 1})) == {'a': 1}
+
+    body, status_code, raw_headers = pickle.loads(
+        process_call(dict, {'a': 1}, render_json))
+    assert body == b'{"a":1}'
+    assert status_code == 200
+    assert (b'content-type', b'application/json') in raw_headers
+
+    with pytest.raises(UnpicklableResultError):
+        process_call(lambda: (lambda: None), {})
+
+
+def test_process_routes(application_domain):
+    import os
+    from halfapi.lib.executor import get_process_pool
+
+    assert get_process_pool('dummy_domain') is not None
+
+    client = TestClient(application_domain)
+    res = client.get('/process')
+    assert res.status_code == 200
+    assert res.json()['pid'] != os.getpid()
+
+    res = client.post('/process')
+    assert res.status_code == 200
+    assert res.headers['content-type'] == 'application/json'
+    assert res.json()['pid'] != os.getpid()
+
+    res = client.get('/process/unpicklable')
+    assert res.status_code == 500
+
+    # A generator is read entirely in the process pool
+    expected = [{'id': 0}, {'id': 1}, {'id': 2}]
+    assert client.get('/process/generator').json() == expected
+    assert client.post('/process/generator').json() == expected
+
+
+def test_process_schema_route(caplog):
+    from halfapi.lib.routes import gen_schema_routes
+
+    def route():
+        return {}
+
+    routes = list(gen_schema_routes({'/process': {'GET': {
+        'fct': route,
+        'acls': [{'acl': lambda: True, 'executor': 'process'}]
+    }}}))
+    assert len(routes) == 1
+    assert 'No process pool for the GET /process route' in caplog.text
+
+
+def test_process_write():
+    import os
+    import pickle
+    import zipfile
+    from io import BytesIO
+    from starlette.applications import Starlette
+    from halfapi.lib.domain import render_xlsx
+    from halfapi.lib.executor import process_write
+    from halfapi.lib.responses import WrittenSpreadsheetResponse
+
+    def route():
+        # A generator, that cannot be sent back from the process pool
+        return ({'id': i} for i in range(3))
+
+    path, status_code, raw_headers = pickle.loads(
+        process_write(route, {}, render_xlsx))
+    assert os.path.exists(path)
+
+    app = Starlette(routes=[Route('/', endpoint=lambda request:
+        WrittenSpreadsheetResponse(path, status_code, raw_headers))])
+    res = TestClient(app).get('/')
+    assert res.headers['content-type'].startswith(
+        'application/vnd.openxmlformats-officedocument.spreadsheetml')
+    assert int(res.headers['content-length']) == len(res.content)
+    assert zipfile.is_zipfile(BytesIO(res.content))
+    # The file is removed once it is sent
+    assert not os.path.exists(path)
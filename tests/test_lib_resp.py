@@ -0,0 +1,216 @@
+import asyncio
+import time
+
+import pytest
+
+from halfapi.lib.cache import CachedResponse, MemoryBackend, RedisBackend, \
+    TieredBackend
+from halfapi.lib.resp import RESPClient, RESPError
+
+
+class FakeRESPServer:
+    """ An in-memory server of the GET, MGET, SET, DEL and PING commands
+    """
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.delay = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def bulk(value):
+        if value is None:
+            return b'$-1\r\n'
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    async def read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def reply(self, args):
+        name = args[0].upper()
+        if name == b'PING':
+            return b'+PONG\r\n'
+        if name == b'GET':
+            return self.bulk(self.data.get(args[1]))
+        if name == b'MGET':
+            return b'*%d\r\n' % (len(args) - 1) + b''.join(
+                self.bulk(self.data.get(key)) for key in args[1:])
+        if name == b'SET':
+            self.data[args[1]] = args[2]
+            return b'+OK\r\n'
+        if name == b'DEL':
+            return b':%d\r\n' % sum(
+                self.data.pop(key, None) is not None for key in args[1:])
+        return b'-ERR unknown command\r\n'
+
+    async def handle(self, reader, writer):
+        while True:
+            args = await self.read_command(reader)
+            if args is None:
+                break
+            self.commands.append(args[0].upper())
+            await asyncio.sleep(self.delay)
+            writer.write(self.reply(args))
+            await writer.drain()
+        writer.close()
+
+
+def test_resp_client():
+    async def run():
+        server = FakeRESPServer()
+        client = RESPClient(port=await server.start())
+        assert await client.execute('PING') == b'PONG'
+        assert await client.pipeline([
+            ('SET', 'a', b'1'), ('MGET', 'a', 'b'), ('DEL', 'a')
+        ]) == [b'OK', [b'1', None], 1]
+
+        with pytest.raises(RESPError):
+            await client.execute('FLUSHALL')
+        # The connection is still usable after an error reply
+        assert await client.execute('GET', 'a') is None
+
+        # The connection is closed when AUTH fails
+        client = RESPClient(port=client.port, password='secret')
+        with pytest.raises(RESPError):
+            await client.execute('PING')
+        assert client.writer is None
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_resp_client_lock_timeout():
+    async def run():
+        server = FakeRESPServer()
+        client = RESPClient(port=await server.start(), timeout=0.1)
+        assert await client.execute('PING') == b'PONG'
+
+        # The wait for the connection is part of the timeout
+        server.delay = 0.07
+        start = time.perf_counter()
+        first, second = await asyncio.gather(
+            client.execute('PING'), client.execute('PING'),
+            return_exceptions=True)
+        assert first == b'PONG'
+        assert isinstance(second, asyncio.TimeoutError)
+        assert time.perf_counter() - start < 0.14
+
+        # A command that times out before it gets the connection does not
+        # close it
+        server.delay = 0
+        assert await client.execute('PING') == b'PONG'
+        writer = client.writer
+        async with client.lock:
+            with pytest.raises(asyncio.TimeoutError):
+                await client.execute('PING')
+        assert client.writer is writer
+        assert await client.execute('PING') == b'PONG'
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_redis_backend_batch():
+    async def run():
+        server = FakeRESPServer()
+        backend = RedisBackend(port=await server.start())
+        value = CachedResponse(200, [], b'body')
+        await backend.set('a', value, 60)
+
+        # The concurrent lookups are a single command
+        found = await asyncio.gather(
+            backend.get('a'), backend.get('b'), backend.get('a'))
+        assert [elt and elt.body for elt in found] == [b'body', None, b'body']
+        assert server.commands == [b'SET', b'MGET']
+        assert backend.batch is None
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_redis_backend():
+    async def run():
+        server = FakeRESPServer()
+        backend = RedisBackend(port=await server.start())
+        value = CachedResponse(200, [(b'content-type', b'text/plain')], b'body')
+        await backend.set('a', value, 60)
+        assert server.data[b'halfapi:a'] == value.dumps()
+
+        found = await backend.get_many(['a', 'b'])
+        assert found[0].body == b'body'
+        assert found[1] is None
+        # A single command for several keys
+        assert server.commands == [b'SET', b'MGET']
+
+        # A value that was not written by the backend is a miss, and deleted
+        server.data[b'halfapi:x'] = b'\x00'
+        assert await backend.get_many(['x']) == [None]
+        assert b'halfapi:x' not in server.data
+        del server.commands[2:]
+
+        # The server is too slow : the lookups are misses, and the server is
+        # not queried until the retry interval
+        server.delay = 0.2
+        start = time.perf_counter()
+        assert await backend.get('a') is None
+        await backend.set('c', value, 60)
+        assert time.perf_counter() - start < 0.2
+        assert server.commands.count(b'MGET') == 2
+        assert server.commands.count(b'SET') == 1
+
+        server.delay = 0
+        backend.retry_at = 0
+        assert (await backend.get('a')).body == b'body'
+        await server.stop()
+        return backend
+
+    backend = asyncio.run(run())
+    stats = backend.stats
+    assert stats['hits'] == 2
+    assert stats['misses'] == 3
+    assert stats['errors'] == 1
+    assert stats['latency_ms']['p50'] is not None
+
+
+def test_tiered_backend():
+    async def run():
+        server = FakeRESPServer()
+        remote = RedisBackend(port=await server.start())
+        value = CachedResponse(200, [], b'body')
+        await remote.set('a', value, 60)
+
+        first = TieredBackend(MemoryBackend(), remote)
+        second = TieredBackend(MemoryBackend(), remote)
+        assert (await first.get('a')).body == b'body'
+        # Then from the local cache
+        assert (await first.get('a')).body == b'body'
+        assert server.commands.count(b'MGET') == 1
+
+        await second.set('b', value, 60)
+        assert (await first.get('b')).body == b'body'
+
+        # The remote cache fails : the local cache still answers
+        await server.stop()
+        remote.client.close()
+        assert (await first.get('b')).body == b'body'
+        assert await first.get('c') is None
+        return first
+
+    backend = asyncio.run(run())
+    assert backend.stats['hits'] == 4
+    assert backend.stats['remote']['errors'] == 1
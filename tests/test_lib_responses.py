@@ -2,8 +2,11 @@ import json
 import decimal
 import datetime
 
+import pytest
+
 from starlette.responses import Response
 from halfapi.lib.responses import *
+from halfapi.lib.user import Nobody
 
 def test_orjson():
     test_obj = {
@@ -60,3 +63,150 @@ def test_errors():
     resp = NotImplementedResponse()
     assert isinstance(resp, Response)
     assert resp.status_code == 501
+
+
+def test_prerendered_json():
+    from starlette.requests import Request
+
+    def request(headers=()):
+        return Request({'type': 'http', 'headers': list(headers)})
+
+    content = PrerenderedJSON({'date': datetime.date(1,1,1)}, encodings=())
+    assert content.body == b'{"date":"0001-01-01"}'
+    assert content.etag == etag(content.body)
+
+    resp = content.response(request())
+    assert resp.status_code == 200
+    assert resp.body == content.body
+    assert (b'etag', content.etag.encode()) in resp.raw_headers
+
+    for value in (content.etag, f'W/{content.etag}', f'"x", {content.etag}', '*'):
+        resp = content.response(request([(b'if-none-match', value.encode())]))
+        assert resp.status_code == 304
+
+    resp = content.response(request([(b'if-none-match', b'"x"')]))
+    assert resp.status_code == 200
+
+
+def test_prerendered_json_encodings():
+    import gzip
+    from starlette.requests import Request
+    from halfapi.lib.compression import ENCODINGS
+
+    def request(accept_encoding):
+        return Request({'type': 'http', 'headers': [
+            (b'accept-encoding', accept_encoding.encode())]})
+
+    content = PrerenderedJSON({'paths': ['/a/long/path'] * 100})
+    assert set(content.encodings) == set(ENCODINGS)
+
+    resp = content.response(request('gzip'))
+    headers = dict(resp.raw_headers)
+    assert headers[b'content-encoding'] == b'gzip'
+    assert headers[b'vary'] == b'accept-encoding'
+    assert gzip.decompress(resp.body) == content.body
+    # the responses are built once
+    assert content.response(request('gzip')) is resp
+
+    tag = headers[b'etag']
+    assert tag != content.etag.encode()
+    resp = content.response(Request({'type': 'http', 'headers': [
+        (b'accept-encoding', b'gzip'), (b'if-none-match', tag)]}))
+    assert resp.status_code == 304
+
+    resp = content.response(request('identity'))
+    assert resp.body == content.body
+    assert b'content-encoding' not in dict(resp.raw_headers)
+
+    # Small bodies are not encoded
+    assert PrerenderedJSON({}).encodings == ()
+
+
+def test_stream_responses():
+    from starlette.testclient import TestClient
+
+    def app(response):
+        async def asgi(scope, receive, send):
+            await response(scope, receive, send)
+        return TestClient(asgi)
+
+    res = app(JSONStreamResponse(iter([]))).get('/')
+    assert res.content == b'[]'
+
+    res = app(JSONStreamResponse(
+        ({'dec': decimal.Decimal(i)} for i in range(3)), chunk_size=1)).get('/')
+    assert res.json() == [{'dec': '0'}, {'dec': '1'}, {'dec': '2'}]
+
+    res = app(NDJSONResponse([{'a': 1}, {'b': 2}])).get('/')
+    assert res.content == b'{"a":1}\n{"b":2}\n'
+
+
+def test_iterator_response_chunks():
+    """ The items are pulled by chunks of about chunk_size bytes
+    """
+    pulled = []
+
+    def rows():
+        for i in range(10):
+            pulled.append(i)
+            yield i
+
+    response = NDJSONResponse(rows(), chunk_size=4)
+    iterator = iter(response.items)
+    assert response.next_chunk(iterator) == (b'0\n1\n', False)
+    assert pulled == [0, 1]
+    assert response.next_chunk(iterator) == (b'2\n3\n', False)
+    assert len(pulled) == 4
+
+
+def test_csv_response():
+    from starlette.testclient import TestClient
+
+    def app(response):
+        async def asgi(scope, receive, send):
+            await response(scope, receive, send)
+        return TestClient(asgi)
+
+    rows = [{'id': 1, 'name': 'a,b'}, {'id': 2, 'name': 'c', 'extra': 'x'}]
+
+    res = app(CSVResponse(iter(rows))).get('/')
+    assert res.headers['content-type'] == 'text/csv; charset=utf-8'
+    assert res.headers['content-disposition'].endswith('.csv"')
+    assert res.text == 'id,name\r\n1,"a,b"\r\n2,c\r\n'
+
+    res = app(TSVResponse(rows, header=['name'])).get('/')
+    assert res.headers['content-type'].startswith('text/tab-separated-values')
+    assert res.text == 'name\r\na,b\r\nc\r\n'
+
+    assert app(CSVResponse([], header=['id'])).get('/').text == 'id\r\n'
+    assert app(CSVResponse([])).get('/').text == ''
+
+
+def test_binary_responses():
+    import uuid
+    msgpack = pytest.importorskip('msgpack')
+    cbor2 = pytest.importorskip('cbor2')
+
+    test_obj = {
+        'dec': decimal.Decimal(42),
+        'set': {1},
+        'date': datetime.date(1,1,1),
+        'datetime': datetime.datetime(1,1,1),
+        'uuid': uuid.UUID(int=1)
+    }
+    expected = json.loads(ORJSONResponse(test_obj).body)
+
+    resp = MsgPackResponse(test_obj)
+    assert resp.media_type == 'application/msgpack'
+    assert msgpack.unpackb(resp.body) == expected
+    assert msgpack.unpackb(MsgPackResponse(iter([1, 2])).body) == [1, 2]
+
+    resp = CBORResponse({**test_obj, 'user': Nobody(), 'fct': test_binary_responses})
+    assert resp.media_type == 'application/cbor'
+    # The types are the ones of JSON, even those that CBOR has tags for
+    assert cbor2.loads(resp.body) == {
+        **expected,
+        'user': Nobody().json,
+        'fct': 'test_binary_responses'
+    }
+    assert cbor2.loads(CBORResponse(iter([1, 2])).body) == [1, 2]
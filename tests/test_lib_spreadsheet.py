@@ -0,0 +1,115 @@
+import datetime
+import decimal
+import io
+import zipfile
+
+import pytest
+from starlette.routing import Route, Router
+from starlette.testclient import TestClient
+
+from halfapi.lib.domain import route_decorator
+from halfapi.lib.responses import SpreadsheetResponse
+from halfapi.lib.spreadsheet import ODSWriter, XLSXWriter
+
+ROWS = [
+    {'name': 'a < b', 'count': 1, 'ratio': decimal.Decimal('0.5'),
+        'ok': True, 'day': datetime.date(2020, 1, 2), 'none': None},
+    {'name': 'c', 'count': 2, 'ratio': 1.5,
+        'ok': False, 'day': datetime.date(2021, 3, 4), 'none': None},
+]
+
+def write(writer_cls, rows, header=None):
+    document = io.BytesIO()
+    with writer_cls(document, header) as writer:
+        writer.write_rows(rows)
+
+    document.seek(0)
+    return document
+
+
+def test_xlsx_writer():
+    openpyxl = pytest.importorskip('openpyxl')
+
+    sheet = openpyxl.load_workbook(write(XLSXWriter, iter(ROWS))).active
+    values = list(sheet.values)
+    assert values[0] == ('name', 'count', 'ratio', 'ok', 'day', 'none')
+    assert values[1] == ('a < b', 1, 0.5, True, '2020-01-02', None)
+    assert values[2][:4] == ('c', 2, 1.5, False)
+
+
+def test_ods_writer(tmp_path):
+    ezodf = pytest.importorskip('ezodf')
+
+    document = write(ODSWriter, iter(ROWS))
+    archive = zipfile.ZipFile(document)
+    assert archive.namelist()[0] == 'mimetype'
+    assert archive.getinfo('mimetype').compress_type == zipfile.ZIP_STORED
+
+    path = tmp_path / 'test.ods'
+    path.write_bytes(document.getvalue())
+    sheet = ezodf.opendoc(str(path)).sheets[0]
+    assert sheet[0, 0].value == 'name'
+    assert sheet[1, 0].value == 'a < b'
+    assert sheet[1, 1].value == 1
+    assert sheet[1, 3].value is True
+    assert sheet[1, 4].value == '2020-01-02'
+    assert sheet[2, 2].value == 1.5
+
+
+def test_writer_header():
+    openpyxl = pytest.importorskip('openpyxl')
+
+    sheet = openpyxl.load_workbook(
+        write(XLSXWriter, ROWS, header=['count', 'name'])).active
+    assert list(sheet.values) == [('count', 'name'), (1, 'a < b'), (2, 'c')]
+
+    sheet = openpyxl.load_workbook(write(XLSXWriter, [], header=['id'])).active
+    assert list(sheet.values) == [('id',)]
+
+
+def test_writer_buffer():
+    """ The rows are not kept in memory
+    """
+    document = io.BytesIO()
+    with XLSXWriter(document) as writer:
+        for i in range(10000):
+            writer.write_row({'id': i, 'name': f'row {i}'})
+            assert writer.buffer_len < writer.buffer_size
+
+        assert document.tell() > 0
+
+
+def test_spreadsheet_response():
+    openpyxl = pytest.importorskip('openpyxl')
+
+    def route(ret_type='xlsx'):
+        return ({'id': i} for i in range(5000))
+
+    async def rows():
+        for i in range(3):
+            yield {'id': i}
+
+    SpreadsheetResponse.spool_size = 1024
+    try:
+        app = Router([
+            Route('/', endpoint=route_decorator(route), methods=['GET']),
+            Route('/async', endpoint=lambda request: SpreadsheetResponse(rows(), 'xlsx'))
+        ])
+        client = TestClient(app)
+
+        res = client.get('/')
+        assert res.status_code == 200
+        assert res.headers['content-type'] == XLSXWriter.media_type
+        assert res.headers['content-disposition'].endswith('.xlsx"')
+        assert int(res.headers['content-length']) == len(res.content)
+
+        sheet = openpyxl.load_workbook(io.BytesIO(res.content)).active
+        values = list(sheet.values)
+        assert len(values) == 5001
+        assert values[-1] == (4999,)
+
+        res = client.get('/async')
+        sheet = openpyxl.load_workbook(io.BytesIO(res.content)).active
+        assert list(sheet.values) == [('id',), (0,), (1,), (2,)]
+    finally:
+        SpreadsheetResponse.spool_size = 1 << 22